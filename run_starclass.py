@@ -19,6 +19,8 @@ def main():
 	parser.add_argument('-q', '--quiet', help='Only report warnings and errors.', action='store_true')
 	parser.add_argument('-o', '--overwrite', help='Overwrite existing results.', action='store_true')
 	parser.add_argument('--clear-cache', help='Clear existing features cache tables before running. Can only be used together with --overwrite.', action='store_true')
+	parser.add_argument('--star-major', help='Run all classifiers on one star at a time, sharing the common features between the classifiers.', action='store_true')
+	parser.add_argument('--batch-size', help='Number of stars to classify together with the same classifier. Default=%(default)d.', type=int, default=10)
 	# Option to select which classifier to run:
 	parser.add_argument('-c', '--classifier',
 		default=None,
@@ -49,6 +51,10 @@ def main():
 	# Otherwise we could end up with non-complete MOAT tables.
 	if args.clear_cache and not args.overwrite:
 		parser.error("--clear-cache can not be used without --overwrite")
+	if args.star_major and args.classifier is not None:
+		parser.error("--star-major can not be used together with --classifier")
+	if args.batch_size < 1:
+		parser.error("--batch-size must be a positive integer")
 
 	# Set logging level:
 	logging_level = logging.INFO
@@ -98,19 +104,44 @@ def main():
 	# Running:
 	# When simply running the classifier on new stars:
 	stcl = None
-	with starclass.TaskManager(todo_file, overwrite=args.overwrite, classes=tset.StellarClasses) as tm:
+	with starclass.TaskManager(todo_file, overwrite=args.overwrite, classes=tset.StellarClasses, async_save=True) as tm:
 		# If we were asked to do so, start by clearing the existing MOAT tables:
 		if args.overwrite and args.clear_cache:
 			tm.moat_clear()
 
+		# Run all classifiers on one star at a time, where the star is only loaded once
+		# and all the results of the star are saved together:
+		if args.star_major:
+			classifiers = {}
+			try:
+				while True:
+					tasks = tm.get_star_tasks()
+					if not tasks:
+						break
+					tm.start_task(tasks)
+
+					for task in tasks:
+						if task['classifier'] not in classifiers:
+							stcl = starclass.get_classifier(task['classifier'])
+							classifiers[task['classifier']] = stcl(tset=tset, features_cache=None, truncate_lightcurves=args.truncate)
+
+					results = starclass.classify_star(tasks, classifiers)
+					tm.save_results(results)
+			finally:
+				for stcl in classifiers.values():
+					stcl.close()
+			return
+
 		while True:
-			task = tm.get_task(classifier=current_classifier, change_classifier=change_classifier)
-			if task is None:
+			# Get a batch of tasks, all for the same classifier:
+			tasks = tm.get_tasks(classifier=current_classifier, change_classifier=change_classifier, max_tasks=args.batch_size)
+			if not tasks:
 				break
-			tm.start_task(task)
+			tm.start_task(tasks)
+			cl = tasks[0]['classifier']
 
-			if task['classifier'] != current_classifier or stcl is None:
-				current_classifier = task['classifier']
+			if cl != current_classifier or stcl is None:
+				current_classifier = cl
 				if stcl:
 					stcl.close()
 				stcl = starclass.get_classifier(current_classifier)
@@ -118,13 +149,16 @@ def main():
 
 			# ----------------- This code would run on each worker ------------------------
 
-			res = stcl.classify(task)
+			res = stcl.classify_many(tasks)
 
 			# ----------------- This code would run on each worker ------------------------
 
 			# Return to TaskManager to be saved:
 			tm.save_results(res)
 
+		if stcl:
+			stcl.close()
+
 #--------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
 	main()
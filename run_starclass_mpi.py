@@ -40,6 +40,8 @@ def main():
 	parser.add_argument('-q', '--quiet', help='Only report warnings and errors.', action='store_true')
 	parser.add_argument('-o', '--overwrite', help='Overwrite existing results.', action='store_true')
 	parser.add_argument('--clear-cache', help='Clear existing features cache tables before running. Can only be used together with --overwrite.', action='store_true')
+	parser.add_argument('--star-major', help='Run all classifiers on one star at a time, sharing the common features between the classifiers.', action='store_true')
+	parser.add_argument('--batch-size', help='Number of stars to classify together with the same classifier. Default=%(default)d.', type=int, default=10)
 	# Option to select which classifier to run:
 	parser.add_argument('-c', '--classifier',
 		default=None,
@@ -69,6 +71,10 @@ def main():
 	# Otherwise we could end up with non-complete MOAT tables.
 	if args.clear_cache and not args.overwrite:
 		parser.error("--clear-cache can not be used without --overwrite")
+	if args.star_major and args.classifier is not None:
+		parser.error("--star-major can not be used together with --classifier")
+	if args.batch_size < 1:
+		parser.error("--batch-size must be a positive integer")
 
 	# Get input and output folder from environment variables:
 	input_folder = args.input_folder
@@ -99,7 +105,7 @@ def main():
 
 	if rank == 0:
 		try:
-			with starclass.TaskManager(todo_file, cleanup=True, overwrite=args.overwrite, classes=tset.StellarClasses) as tm:
+			with starclass.TaskManager(todo_file, cleanup=True, overwrite=args.overwrite, classes=tset.StellarClasses, async_save=True) as tm:
 				# If we were asked to do so, start by clearing the existing MOAT tables:
 				if args.overwrite and args.clear_cache:
 					tm.moat_clear()
@@ -140,15 +146,25 @@ def main():
 						tm.logger.debug("Got data from worker %d: %s", source, data)
 						tm.save_results(data)
 
-					if tag in (tags.DONE, tags.READY):
-						# Worker is ready, so send it a task
-						# If provided, try to find a task that is with the same classifier
-						cl = initial_classifiers[source-1] if data is None else data.get('classifier')
-						task = tm.get_task(classifier=cl, change_classifier=change_classifier)
+					if tag in (tags.DONE, tags.READY) and args.star_major:
+						# Worker is ready, so send it all tasks for the next star:
+						task = tm.get_star_tasks()
 						if task:
 							tm.start_task(task)
 							comm.send(task, dest=source, tag=tags.START)
-							tm.logger.debug("Sending task %d to worker %d", task['priority'], source)
+							tm.logger.debug("Sending star %d to worker %d", task[0]['priority'], source)
+						else:
+							comm.send(None, dest=source, tag=tags.EXIT)
+
+					elif tag in (tags.DONE, tags.READY):
+						# Worker is ready, so send it a batch of tasks
+						# If provided, try to find tasks that are with the same classifier
+						cl = initial_classifiers[source-1] if data is None else data[0].get('classifier')
+						task = tm.get_tasks(classifier=cl, change_classifier=change_classifier, max_tasks=args.batch_size)
+						if task:
+							tm.start_task(task)
+							comm.send(task, dest=source, tag=tags.START)
+							tm.logger.debug("Sending %d tasks to worker %d", len(task), source)
 						else:
 							comm.send(None, dest=source, tag=tags.EXIT)
 
@@ -182,6 +198,7 @@ def main():
 		# Get the class for the selected method:
 		current_classifier = None
 		stcl = None
+		classifiers = {}
 
 		try:
 			# Send signal that we are ready for task:
@@ -194,19 +211,37 @@ def main():
 				tag = status.Get_tag()
 				toc_wait = default_timer()
 
-				if tag == tags.START:
+				if tag == tags.START and args.star_major:
+					# Run all classifiers on the star:
+					for t in task:
+						if t['classifier'] not in classifiers:
+							stcl = starclass.get_classifier(t['classifier'])
+							classifiers[t['classifier']] = stcl(tset=tset, features_cache=None, truncate_lightcurves=args.truncate)
+
+					result = starclass.classify_star(task, classifiers)
+
+					# Pad results with metadata and return to TaskManager to be saved:
+					for res in result:
+						res['worker_wait_time'] = toc_wait - tic_wait
+
+					# Send the results back to the master:
+					comm.send(result, dest=0, tag=tags.DONE)
+					del task, result
+
+				elif tag == tags.START:
 					# Run the classification prediction:
-					if task['classifier'] != current_classifier or stcl is None:
-						current_classifier = task['classifier']
+					if task[0]['classifier'] != current_classifier or stcl is None:
+						current_classifier = task[0]['classifier']
 						if stcl:
 							stcl.close()
 						stcl = starclass.get_classifier(current_classifier)
 						stcl = stcl(tset=tset, features_cache=None, truncate_lightcurves=args.truncate)
 
-					result = stcl.classify(task)
+					result = stcl.classify_many(task)
 
 					# Pad results with metadata and return to TaskManager to be saved:
-					result['worker_wait_time'] = toc_wait - tic_wait
+					for res in result:
+						res['worker_wait_time'] = toc_wait - tic_wait
 
 					# Send the result back to the master:
 					comm.send(result, dest=0, tag=tags.DONE)
@@ -228,6 +263,8 @@ def main():
 			logger.exception("Something failed in worker")
 
 		finally:
+			for cl in classifiers.values():
+				cl.close()
 			comm.send(None, dest=0, tag=tags.EXIT)
 
 #--------------------------------------------------------------------------------------------------
@@ -11,22 +11,31 @@ import numpy as np
 import os.path
 import logging
 import traceback
+import itertools
 from tqdm import tqdm
 import enum
 import warnings
 from sklearn.metrics import accuracy_score, confusion_matrix
 from bottleneck import nanvar
+from astropy.units import cds
 from timeit import default_timer
 from .io import load_lightcurve, savePickle, loadPickle
-from .features.freqextr import freqextr, freqextr_table_from_dict, freqextr_table_to_dict
-from .features.fliper import FliPer
+from .features.freqextr import freqextr, freqtable
+from .features.fliper import FliPer, default_bands
 from .features.powerspectrum import powerspectrum
+from .features.timestats import timeseries_statistics, statistics_keys
+from .features.featuregraph import featuregraph
+from .features.derived import relative_lightcurve
 from .utilities import rms_timescale, ptp
 from .plots import plotConfMatrix, plt
 from .StellarClasses import StellarClassesLevel1
 
 __docformat__ = 'restructuredtext'
 
+#: Complex or redundant features which are not saved as common features in the MOAT.
+moat_exclude = ('lightcurve', 'powerspectrum', 'frequencies', 'detrend_coeff', 'priority', 'starid',
+	'tmag', 'other_classifiers')
+
 #--------------------------------------------------------------------------------------------------
 @enum.unique
 class STATUS(enum.Enum):
@@ -166,7 +175,7 @@ class BaseClassifier(object):
 		return np.random.RandomState(self._random_seed)
 
 	#----------------------------------------------------------------------------------------------
-	def classify(self, task):
+	def classify(self, task, features=None):
 		"""
 		Classify a star from the lightcurve and other features.
 
@@ -175,7 +184,12 @@ class BaseClassifier(object):
 		performance metrics.
 
 		Parameters:
-			features (dict): Dictionary of features, including the lightcurve itself.
+			task (dict): Task dictionary as returned by :func:`TaskManager.get_task`.
+			features (:class:`features.featuregraph.featuregraph`, optional): Common features
+				of the star, as returned by :py:func:`load_star`, which are shared with other
+				classifiers running on the same star. The features specific to this
+				classifier from the task are added while classifying. If not provided,
+				the features are loaded using :py:func:`load_star`.
 
 		Returns:
 			dict: Dictionary of classifications
@@ -183,70 +197,151 @@ class BaseClassifier(object):
 		See Also:
 			:py:func:`do_classify`, :py:func:`load_star`
 
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		return self.classify_many([task], features=[features])[0]
+
+	#----------------------------------------------------------------------------------------------
+	def classify_many(self, tasks, features=None):
+		"""
+		Classify several stars from their lightcurves and other features.
+
+		The stars are classified together by :py:func:`do_classify_many`, which for most
+		classifiers means that the trained model is only evaluated once for all the stars.
+		The results are checked in the same way as by :py:func:`classify`. If classifying
+		the stars together fails, the stars are classified one by one, so that a single
+		failing star is not causing the others to fail.
+
+		Parameters:
+			tasks (list): List of task dictionaries as returned by :func:`TaskManager.get_task`.
+			features (list, optional): List of common features of the stars. Elements can
+				be ``None``, in which case the features of the star are loaded using
+				:py:func:`load_star`. See :py:func:`classify`.
+
+		Returns:
+			list: List of dictionaries of classifications, one for each task.
+
+		See Also:
+			:py:func:`classify`, :py:func:`do_classify_many`
+
 		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 		"""
 		logger = logging.getLogger(__name__)
-		result = task.copy()
-		result.update({
-			'tset': self.tset.key,
-			'classifier': self.classifier_key
-		})
+		if features is None:
+			features = [None]*len(tasks)
+
+		results = []
+		for task in tasks:
+			result = task.copy()
+			result.update({
+				'tset': self.tset.key,
+				'classifier': self.classifier_key
+			})
+			results.append(result)
+
 		try:
 			# Load the common features from the task information
 			# and run the prediction/classification on the features:
 			tic_predict = default_timer()
-			features_common = self.load_star(task)
-			res, features = self.do_classify(features_common)
-			toc_predict = default_timer()
-
-			# Basic checks of results:
-			for key, value in res.items():
-				if key not in self.StellarClasses:
-					raise ValueError("Classifier returned unknown stellar class: '%s'" % key)
-				if value < 0 or value > 1:
-					raise ValueError("Classifier should return probability between 0 and 1.")
-
-			# Remove complex or redundant features from common features:
-			for rm in ('lightcurve', 'powerspectrum', 'frequencies', 'priority', 'starid', 'tmag', 'other_classifiers'):
-				if rm in features_common:
-					del features_common[rm]
+			features_common = []
+			added = []
+			for task, feat in zip(tasks, features):
+				if feat is None:
+					feat = self.load_star(task)
+					added.append([])
+				else:
+					# Features shared with other classifiers, where the features specific
+					# to this classifier are only added while classifying:
+					specific = task.get('features') or {}
+					added.append([key for key in specific if not feat.is_evaluated(key)])
+					feat.update(specific)
+				features_common.append(feat)
+
+			try:
+				res, featarray = self.do_classify_many(features_common)
+			finally:
+				for feat, keys in zip(features_common, added):
+					for key in keys:
+						del feat[key]
 
-			if self.features_names and self.classifier_key != 'meta':
-				# If needed, convert features to dictionary:
-				if not isinstance(features, dict):
-					if isinstance(features, np.ndarray):
-						features = features.flatten()
+			toc_predict = default_timer()
 
-					features = dict(zip(self.features_names, [float(feat) for feat in features]))
+			if len(res) != len(tasks) or len(featarray) != len(tasks):
+				raise ValueError("Classifier returned wrong number of results.")
 
-				# Remove features which are already in the common:
-				features = {k: features[k] for k in set(features) - set(features_common)}
-			else:
-				features = None
+			for k, result in enumerate(results):
+				result.update(self._check_result(res[k], featarray[k], features_common[k]))
+				result['elaptime'] = (toc_predict - tic_predict)/len(tasks)
 
-			# Pad results with metadata:
-			result.update({
-				'starclass_results': res,
-				'features_common': features_common,
-				'features': features,
-				'status': STATUS.OK,
-				'elaptime': toc_predict - tic_predict
-			})
 		except (KeyboardInterrupt, SystemExit): # pragma: no cover
-			result.update({
-				'status': STATUS.ABORT
-			})
+			for result in results:
+				result.update({
+					'status': STATUS.ABORT
+				})
 		except: # noqa: E722, pragma: no cover
-			# Something went wrong
+			# Something went wrong. If several stars were classified together,
+			# classify them one by one to find the one(s) failing:
+			if len(tasks) > 1:
+				logger.warning("Classify of %d stars failed. Classifying stars individually.", len(tasks))
+				return [self.classify(task, features=feat) for task, feat in zip(tasks, features)]
+
 			error_msg = traceback.format_exc().strip()
-			result.update({
+			results[0].update({
 				'status': STATUS.ERROR,
 				'details': {'errors': [error_msg]},
 			})
 			logger.exception("Classify failed: Priority '%s', Classifier '%s'.",
-				task.get('priority'), self.classifier_key)
+				tasks[0].get('priority'), self.classifier_key)
+
+		return results
+
+	#----------------------------------------------------------------------------------------------
+	def _check_result(self, res, features, features_common):
+		"""
+		Check and format the results from classifying a single star.
+
+		Parameters:
+			res (dict): Probabilities of the stellar classes returned by the classifier.
+			features (dict or ndarray): Features used by the classifier.
+			features_common (dict): Common features of the star.
 
-		return result
+		Returns:
+			dict: Results and features to be saved.
+
+		Raises:
+			ValueError: If the classifier returned invalid results.
+		"""
+		# Basic checks of results:
+		for key, value in res.items():
+			if key not in self.StellarClasses:
+				raise ValueError("Classifier returned unknown stellar class: '%s'" % key)
+			if value < 0 or value > 1:
+				raise ValueError("Classifier should return probability between 0 and 1.")
+
+		# Remove complex or redundant features from common features.
+		# Only the features which have been evaluated are saved, and any missing
+		# features will be calculated if they are needed by another classifier:
+		features_common = {key: value for key, value in features_common.items() if key not in moat_exclude}
+
+		if self.features_names and self.classifier_key != 'meta':
+			# If needed, convert features to dictionary:
+			if not isinstance(features, dict):
+				if isinstance(features, np.ndarray):
+					features = features.flatten()
+
+				features = dict(zip(self.features_names, [float(feat) for feat in features]))
+
+			# Remove features which are already in the common:
+			features = {k: features[k] for k in set(features) - set(features_common)}
+		else:
+			features = None
+
+		return {
+			'starclass_results': res,
+			'features_common': features_common,
+			'features': features,
+			'status': STATUS.OK
+		}
 
 	#----------------------------------------------------------------------------------------------
 	def do_classify(self, features):
@@ -268,6 +363,30 @@ class BaseClassifier(object):
 		"""
 		raise NotImplementedError()
 
+	#----------------------------------------------------------------------------------------------
+	def do_classify_many(self, features):
+		"""
+		Classify several stars from their lightcurves and other features.
+
+		The default is to call :py:func:`do_classify` for each star. Child classes
+		should overwrite this method if the stars can be classified more efficiently together,
+		e.g. by evaluating the trained model on all stars at once.
+
+		Parameters:
+			features (list): List of dictionaries of features of the stars.
+
+		Returns:
+			tuple: List of dictionaries of stellar classifications (see :py:func:`do_classify`)
+			and list of the features used by the classifier for each star.
+		"""
+		results = []
+		featarray = []
+		for feat in features:
+			res, f = self.do_classify(feat)
+			results.append(res)
+			featarray.append(f)
+		return results, featarray
+
 	#----------------------------------------------------------------------------------------------
 	def train(self, tset):
 		"""
@@ -284,13 +403,15 @@ class BaseClassifier(object):
 		raise NotImplementedError()
 
 	#----------------------------------------------------------------------------------------------
-	def test(self, tset, save=None):
+	def test(self, tset, save=None, batch_size=100):
 		"""
 		Test classifier using training-set, which has been created with a test-fraction.
 
 		Parameters:
 			tset (:class:`TrainingSet`): Training-set to run testing on.
 			save (callable, optional): Function to call for saving test-predictions.
+			batch_size (int, optional): Number of stars to classify together.
+				See :py:func:`classify_many`.
 		"""
 
 		# Start logger:
@@ -305,22 +426,27 @@ class BaseClassifier(object):
 		# All available labels in the current lavel (values):
 		all_classes = [lbl.value for lbl in self.StellarClasses]
 
-		# Classify test set (has to be one by one unless we change classifiers)
+		# Classify test set in batches of stars:
 		y_pred = []
-		for task in tqdm(tset.features_test(), total=len(tset.test_idx)):
-
-			# Classify this star from the test-set:
-			result = self.classify(task)
-			#features = {'freq1': 32432, 'amp1': 4, 'unique_feature': 42} # FIXME: This should be returned by do_classify!
-
-			# FIXME: Only keeping the first label
-			prediction = max(result['starclass_results'], key=lambda key: result['starclass_results'][key]).value
-			y_pred.append(prediction)
-
-			# Save results for this classifier/trainingset in database:
-			if save is not None:
-				logger.debug(result)
-				save(result)
+		tasks = tset.features_test()
+		with tqdm(total=len(tset.test_idx)) as pbar:
+			while True:
+				batch = list(itertools.islice(tasks, batch_size))
+				if not batch:
+					break
+
+				# Classify these stars from the test-set:
+				for result in self.classify_many(batch):
+					# FIXME: Only keeping the first label
+					prediction = max(result['starclass_results'], key=lambda key: result['starclass_results'][key]).value
+					y_pred.append(prediction)
+
+					# Save results for this classifier/trainingset in database:
+					if save is not None:
+						logger.debug(result)
+						save(result)
+
+				pbar.update(len(batch))
 
 		# Convert labels to ndarray:
 		# FIXME: Only comparing to the first label
@@ -346,11 +472,17 @@ class BaseClassifier(object):
 		"""
 		Receive a task from the TaskManager, loads the lightcurve and returns derived features.
 
+		The features are returned as a :class:`features.featuregraph.featuregraph`, where
+		the lightcurve and the features derived from it are only loaded or calculated when
+		they are first accessed. Features which are already available from the features
+		cache or the task (MOAT) are used directly, so a star where all needed
+		features are cached will never have its lightcurve loaded.
+
 		Parameters:
 			task (dict): Task dictionary as returned by :func:`TaskManager.get_task`.
 
 		Returns:
-			dict: Dictionary with features.
+			:class:`features.featuregraph.featuregraph`: Dictionary with features.
 
 		See Also:
 			:py:func:`TaskManager.get_task`
@@ -361,7 +493,7 @@ class BaseClassifier(object):
 		logger = logging.getLogger(__name__)
 
 		# Define variables used below:
-		features = {}
+		features = featuregraph()
 
 		# The Meta-classifier is only using features from the other classifiers,
 		# so there is no reason to load lightcurves and calculate/load any other classifiers:
@@ -373,7 +505,7 @@ class BaseClassifier(object):
 			if self.features_cache:
 				features_file = os.path.join(self.features_cache, 'features-' + str(task['priority']) + '.pickle')
 				if os.path.exists(features_file):
-					features = loadPickle(features_file)
+					features.update(loadPickle(features_file))
 				else:
 					save_to_cache = True
 
@@ -383,89 +515,28 @@ class BaseClassifier(object):
 			# Transfer cache of features specific to this classifier from task (MOAT):
 			features.update(task.get('features', {}))
 
-			# Add the fields from the task to the list of features:
+			# Add the fields from the task to the list of features.
+			# If these features were not provided with the task, i.e. they
+			# have not been pre-computed, they will be computed by the stages below:
 			for key in ('tmag', 'variance', 'rms_hour', 'ptp'):
-				if key in task.keys():
-					features[key] = task[key]
-				else:
+				if key not in task.keys():
 					logger.warning("Key '%s' not found in task.", key)
-					features[key] = np.NaN
-
-			# Load lightcurve file and create a TessLightCurve object:
-			if 'lightcurve' in features:
-				lightcurve = features['lightcurve']
-			else:
-				lightcurve = load_lightcurve(task['lightcurve'],
-					starid=task['starid'],
-					truncate_lightcurve=self.truncate_lightcurves)
-
-				# Add the lightcurve as a seperate feature:
-				features['lightcurve'] = lightcurve
-
-			# Prepare lightcurve for power spectrum calculation:
-			# NOTE: Lightcurves are now in relative flux (ppm) with zero mean!
-			lc = lightcurve.remove_nans()
-
-			if self.linfit:
-				# Do a robust fitting with a first-order polynomial,
-				# where we are catching cases where the fitting goes bad.
-				indx = np.isfinite(lc.time) & np.isfinite(lc.flux) & np.isfinite(lc.flux_err)
-				mintime = np.nanmin(lc.time[indx])
-				with warnings.catch_warnings():
-					warnings.filterwarnings('error', category=np.RankWarning)
-					try:
-						p = np.polyfit(lc.time[indx] - mintime, lc.flux[indx], 1, w=1/lc.flux_err[indx])
-						lc -= np.polyval(p, lc.time - mintime)
-					except np.RankWarning: # pragma: no cover
-						logger.warning("Could not detrend light curve")
-						p = np.array([0, 0])
-
-				# Store the coefficients of the above detrending as a seperate feature:
-				features['detrend_coeff'] = p
-
-			# Calculate power spectrum:
-			psd = features.get('powerspectrum')
-			if psd is None:
-				psd = powerspectrum(lc)
-
-				# Save the entire power spectrum object in the features:
-				features['powerspectrum'] = psd
-
-			# Individual frequencies:
-			if 'frequencies' not in features:
-				if 'freq1' in features:
-					# There is no frequency table, but individual keys,
-					# so reconstruct the frequencies table from the features dict:
-					features['frequencies'] = freqextr_table_from_dict(features, n_peaks=6, n_harmonics=5,
-						flux_unit=lc.flux_unit)
-				else:
-					# Extract primary frequencies from lightcurve and add to features:
-					features['frequencies'] = freqextr(lc, n_peaks=6, n_harmonics=5,
-						Noptimize=5, devlim=None, initps=psd)
+				value = task.get(key, np.NaN)
+				if key == 'tmag' or (value is not None and np.isfinite(value)):
+					features[key] = value
+				elif features.is_evaluated(key) and (features[key] is None or not np.isfinite(features[key])):
+					del features[key]
 
-					# Add these for backward compatibility:
-					features.update(freqextr_table_to_dict(features['frequencies']))
+			# Frequency table stored as astropy table in older caches:
+			if features.is_evaluated('frequencies') and not isinstance(features['frequencies'], freqtable):
+				features['frequencies'] = freqtable.from_table(features['frequencies'])
 
-			# Calculate FliPer features:
-			# TODO: Should these be done before or after linfit?
-			#       Hopefully after, since otherwise we have to calculate another powerspectrum
-			if 'Fp07' not in features:
-				features.update(FliPer(psd))
-
-			# If these features were not provided with the task, i.e. they
-			# have not been pre-computed, we should compute them now:
-			# Note we are using the un-corrected lightcurve here
-			# since this will otherwise change from the values originally calculated from
-			# the corrections pipeline, where the lightcurve was not detrended first.
-			if features['variance'] is None or not np.isfinite(features['variance']):
-				features['variance'] = nanvar(lightcurve.flux, ddof=1)
-			if features['rms_hour'] is None or not np.isfinite(features['rms_hour']):
-				features['rms_hour'] = rms_timescale(lightcurve)
-			if features['ptp'] is None or not np.isfinite(features['ptp']):
-				features['ptp'] = ptp(lightcurve)
+			# Add the stages calculating the features:
+			self._add_feature_stages(features, task)
 
 			# Save features in cache file for later use:
 			if save_to_cache:
+				features.evaluate()
 				savePickle(features_file, features)
 
 		# Add the results from other classifiers to the features:
@@ -481,6 +552,112 @@ class BaseClassifier(object):
 		logger.debug(features)
 		return features
 
+	#----------------------------------------------------------------------------------------------
+	def _add_feature_stages(self, features, task):
+		"""
+		Add the stages calculating the common features to the graph of features.
+
+		Parameters:
+			features (:class:`features.featuregraph.featuregraph`): Features of the star.
+			task (dict): Task dictionary as returned by :func:`TaskManager.get_task`.
+
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		logger = logging.getLogger(__name__)
+
+		# Load lightcurve file and create a TessLightCurve object:
+		def stage_lightcurve(features):
+			lightcurve = load_lightcurve(task['lightcurve'],
+				starid=task['starid'],
+				truncate_lightcurve=self.truncate_lightcurves)
+			return {'lightcurve': lightcurve}
+
+		def stage_detrend(features):
+			# Do a robust fitting with a first-order polynomial,
+			# where we are catching cases where the fitting goes bad.
+			lc = features['lightcurve'].remove_nans()
+			indx = np.isfinite(lc.time) & np.isfinite(lc.flux) & np.isfinite(lc.flux_err)
+			mintime = np.nanmin(lc.time[indx])
+			with warnings.catch_warnings():
+				warnings.filterwarnings('error', category=np.RankWarning)
+				try:
+					p = np.polyfit(lc.time[indx] - mintime, lc.flux[indx], 1, w=1/lc.flux_err[indx])
+				except np.RankWarning: # pragma: no cover
+					logger.warning("Could not detrend light curve")
+					p = np.array([0, 0])
+			return {'detrend_coeff': p}
+
+		def _prepare_lightcurve():
+			# Prepare lightcurve for power spectrum calculation:
+			# NOTE: Lightcurves are now in relative flux (ppm) with zero mean!
+			lc = features['lightcurve'].remove_nans()
+			if self.linfit:
+				# Remove the linear trend, which is stored as a seperate feature:
+				indx = np.isfinite(lc.time) & np.isfinite(lc.flux) & np.isfinite(lc.flux_err)
+				mintime = np.nanmin(lc.time[indx])
+				lc -= np.polyval(features['detrend_coeff'], lc.time - mintime)
+			return lc
+
+		def prepare_lightcurve(features):
+			# The prepared lightcurve is shared between the power spectrum and
+			# the extraction of frequencies:
+			return features.product('lightcurve_ppm', _prepare_lightcurve)
+
+		def stage_powerspectrum(features):
+			return {'powerspectrum': powerspectrum(prepare_lightcurve(features))}
+
+		def stage_frequencies(features):
+			if features.is_evaluated('freq1'):
+				# There is no frequency table, but individual keys,
+				# so reconstruct the frequencies table from the features dict:
+				# Lightcurves are always loaded in ppm.
+				tab = freqtable.from_dict(dict(features), n_peaks=6, n_harmonics=5, flux_unit=cds.ppm)
+			else:
+				# Extract primary frequencies from lightcurve:
+				tab = freqextr(prepare_lightcurve(features), n_peaks=6, n_harmonics=5,
+					Noptimize=5, devlim=None, initps=features['powerspectrum'], as_table=False)
+
+			# Individual keys are added for backward compatibility:
+			values = tab.to_dict()
+			values['frequencies'] = tab
+			return values
+
+		# Calculate FliPer features:
+		# TODO: Should these be done before or after linfit?
+		#       Hopefully after, since otherwise we have to calculate another powerspectrum
+		def stage_fliper(features):
+			return FliPer(features['powerspectrum'])
+
+		# Time-domain statistics used by several of the classifiers.
+		# These are calculated from the lightcurve in relative flux, in the same way
+		# as the classifiers prepare the lightcurves:
+		def stage_timestats(features):
+			lc_rel = relative_lightcurve(features)
+			return timeseries_statistics(lc_rel.time, lc_rel.flux, lc_rel.flux_err)
+
+		# Note we are using the un-corrected lightcurve here
+		# since this will otherwise change from the values originally calculated from
+		# the corrections pipeline, where the lightcurve was not detrended first.
+		def stage_variance(features):
+			return {'variance': nanvar(features['lightcurve'].flux, ddof=1)}
+
+		def stage_rms_hour(features):
+			return {'rms_hour': rms_timescale(features['lightcurve'])}
+
+		def stage_ptp(features):
+			return {'ptp': ptp(features['lightcurve'])}
+
+		features.add_stage('lightcurve', ['lightcurve'], stage_lightcurve)
+		if self.linfit:
+			features.add_stage('detrend_coeff', ['detrend_coeff'], stage_detrend)
+		features.add_stage('powerspectrum', ['powerspectrum'], stage_powerspectrum)
+		features.add_stage('frequencies', ['frequencies'] + list(freqtable(6, 5).to_dict().keys()), stage_frequencies)
+		features.add_stage('fliper', list(default_bands.keys()) + ['FpWhite'], stage_fliper)
+		features.add_stage('timestats', statistics_keys, stage_timestats)
+		features.add_stage('variance', ['variance'], stage_variance)
+		features.add_stage('rms_hour', ['rms_hour'], stage_rms_hour)
+		features.add_stage('ptp', ['ptp'], stage_ptp)
+
 	#----------------------------------------------------------------------------------------------
 	def parse_labels(self, labels):
 		"""
@@ -132,6 +132,20 @@ class MetaClassifier(BaseClassifier):
 		Returns:
 			dict: Dictionary of stellar classifications.
 		"""
+		results, featarray = self.do_classify_many([features])
+		return results[0], featarray[0:1]
+
+	#----------------------------------------------------------------------------------------------
+	def do_classify_many(self, features):
+		"""
+		Classify several lightcurves, with a single evaluation of the classifier.
+
+		Parameters:
+			features (list): List of dictionaries of features.
+
+		Returns:
+			tuple: List of dictionaries of stellar classifications and array of features.
+		"""
 		# Start a logger that should be used to output e.g. debug information:
 		logger = logging.getLogger(__name__)
 
@@ -142,22 +156,24 @@ class MetaClassifier(BaseClassifier):
 		# Build features array from the probabilities from the other classifiers:
 		# TODO: What about NaN values?
 		logger.debug("Importing features...")
-		featarray = self.build_features_table([features], total=1)
+		featarray = self.build_features_table(features, total=len(features))
 
 		if anynan(featarray):
 			raise ValueError("Features contains NaNs")
 
 		logger.debug("We are starting the magic...")
-		# Comes out with shape (1,8), but instead want shape (8,) so squeeze
-		classprobs = self.classifier.predict_proba(featarray).squeeze()
+		classprobs = self.classifier.predict_proba(featarray)
 		logger.debug("Classification complete")
 
 		# Format the output:
-		result = {}
-		for c, cla in enumerate(self.classifier.classes_):
-			key = self.StellarClasses(cla)
-			result[key] = classprobs[c]
-		return result, featarray
+		results = []
+		for probs in classprobs:
+			result = {}
+			for c, cla in enumerate(self.classifier.classes_):
+				key = self.StellarClasses(cla)
+				result[key] = probs[c]
+			results.append(result)
+		return results, featarray
 
 	#----------------------------------------------------------------------------------------------
 	def train(self, tset, savecl=True, overwrite=False):
@@ -16,6 +16,8 @@ from sklearn.ensemble import RandomForestClassifier
 from . import RF_GC_featcalc as fc
 from .. import BaseClassifier, io
 from ..utilities import get_periods
+from ..features.timestats import lightcurve_statistics
+from ..features.derived import relative_lightcurve, ebperiod, phase_order
 
 # Number of frequencies used as features:
 NFREQUENCIES = 6
@@ -161,12 +163,15 @@ class RFGCClassifier(BaseClassifier):
 			# If not all features are already populated, we are going to recalculate them all:
 			if recalc or anynan(featout[k, :]):
 
-				lc = fc.prepLCs(obj['lightcurve'], linflatten=linflatten)
+				lc = relative_lightcurve(obj, linflatten=linflatten)
 
 				periods, n_usedfreqs, usedfreqs = get_periods(obj, NFREQUENCIES, lc.time, ignore_harmonics=True)
 				featout[k, :NFREQUENCIES] = periods
 
-				EBper = fc.EBperiod(lc.time, lc.flux, periods[0], linflatten=True)
+				if linflatten:
+					EBper = fc.EBperiod(lc.time, lc.flux, periods[0], linflatten=True)
+				else:
+					EBper = ebperiod(obj, periods[0])
 				featout[k, 0] = EBper # overwrites top period
 
 				featout[k, NFREQUENCIES:NFREQUENCIES+2] = fc.freq_ampratios(obj, n_usedfreqs, usedfreqs)
@@ -176,13 +181,14 @@ class RFGCClassifier(BaseClassifier):
 				# Self Organising Map
 				featout[k, NFREQUENCIES+4:NFREQUENCIES+6] = fc.SOMloc(self.classifier.som, lc.time, lc.flux, EBper, cardinality)
 
-				featout[k, NFREQUENCIES+6:NFREQUENCIES+8] = fc.phase_features(lc.time, lc.flux, EBper)
+				order = None if linflatten else phase_order(obj, EBper)
+				featout[k, NFREQUENCIES+6:NFREQUENCIES+8] = fc.phase_features(lc.time, lc.flux, EBper, order=order)
 
-				featout[k, NFREQUENCIES+8:NFREQUENCIES+10] = fc.p2p_features(lc.flux)
-
-				# Higher Order Crossings:
-				psi, zc = fc.compute_hocs(lc.time, lc.flux, 5)
-				featout[k, NFREQUENCIES+10:NFREQUENCIES+12] = psi, zc[0]
+				# Point-to-point features and Higher Order Crossings,
+				# from the time-domain statistics shared with the other classifiers:
+				stats = lightcurve_statistics(lc, features=None if linflatten else obj)
+				featout[k, NFREQUENCIES+8:NFREQUENCIES+10] = stats['p2p_98_lc'], stats['p2p_mean_lc']
+				featout[k, NFREQUENCIES+10:NFREQUENCIES+12] = stats['psi'], stats['zc']
 
 				# FliPer:
 				featout[k, NFREQUENCIES+12:NFREQUENCIES+16] = obj['Fp07'], obj['Fp7'], obj['Fp20'], obj['Fp50']
@@ -207,6 +213,20 @@ class RFGCClassifier(BaseClassifier):
 		Returns:
 			dict: Dictionary of stellar classifications.
 		"""
+		results, featarray = self.do_classify_many([features], recalc=recalc)
+		return results[0], featarray[0:1]
+
+	#----------------------------------------------------------------------------------------------
+	def do_classify_many(self, features, recalc=False):
+		"""
+		Classify several lightcurves, with a single evaluation of the classifier.
+
+		Parameters:
+			features (list): List of dictionaries of features.
+
+		Returns:
+			tuple: List of dictionaries of stellar classifications and array of features.
+		"""
 		# Start a logger that should be used to output e.g. debug information:
 		logger = logging.getLogger(__name__)
 
@@ -218,19 +238,22 @@ class RFGCClassifier(BaseClassifier):
 		# ...then self.classifier.som is not None
 
 		logger.debug("Calculating features...")
-		featarray = self.featcalc(features, total=1, recalc=recalc)
+		featarray = self.featcalc(features, total=len(features), recalc=recalc)
 		#logger.info("Features calculated.")
 
 		# Do the magic:
 		#logger.info("We are starting the magic...")
-		classprobs = self.classifier.predict_proba(featarray)[0]
+		classprobs = self.classifier.predict_proba(featarray)
 		logger.debug("Classification complete")
 
-		result = {}
-		for c, cla in enumerate(self.classifier.classes_):
-			key = self.StellarClasses(cla)
-			result[key] = classprobs[c]
-		return result, featarray
+		results = []
+		for probs in classprobs:
+			result = {}
+			for c, cla in enumerate(self.classifier.classes_):
+				key = self.StellarClasses(cla)
+				result[key] = probs[c]
+			results.append(result)
+		return results, featarray
 
 	#----------------------------------------------------------------------------------------------
 	def train(self, tset, savecl=True, recalc=False, overwrite=False):
@@ -259,14 +282,21 @@ class RFGCClassifier(BaseClassifier):
 		logger.info('Calculating features...')
 
 		# Check for pre-calculated som
+		# Features already in the MOAT can only be used if they were calculated with this SOM:
+		featarray = None
 		if self.classifier.som is None:
 			logger.info("No SOM loaded. Creating new SOM, saving to '%s'.", self.somfile)
 			self.classifier.som = fc.makeSOM(tset.features(), outfile=self.somfile, overwrite=overwrite, random_seed=self.random_seed)
 			logger.info('SOM created and saved.')
+		elif not recalc:
+			featarray = tset.feature_matrix(self.classifier_key, self.features_names)
 
-		logger.info('Calculating/Loading Features.')
-		featarray = self.featcalc(tset.features(), total=len(tset), recalc=recalc)
-		logger.info('Features calculated/loaded.')
+		if featarray is None:
+			logger.info('Calculating/Loading Features.')
+			featarray = self.featcalc(tset.features(), total=len(tset), recalc=recalc)
+			logger.info('Features calculated/loaded.')
+		else:
+			logger.info('Features loaded from MOAT.')
 
 		self.classifier.oob_score = True
 		self.classifier.fit(featarray, fitlabels)
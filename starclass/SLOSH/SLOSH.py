@@ -79,30 +79,48 @@ class SLOSHClassifier(BaseClassifier):
 		Returns:
 			dict: Dictionary of stellar classifications.
 		"""
+		results, featarray = self.do_classify_many([features])
+		return results[0], featarray[0]
+
+	#----------------------------------------------------------------------------------------------
+	def do_classify_many(self, features):
+		"""
+		Prediction for several stars, with a single evaluation of the network per iteration.
+
+		Parameters:
+			features (list): List of dictionaries of features.
+
+		Returns:
+			tuple: List of dictionaries of stellar classifications and list of (empty) features.
+		"""
 		logger = logging.getLogger(__name__)
 		if not self.predictable:
 			raise ValueError('No saved models provided. Predict functions are disabled.')
 
-		# Pre-calculated power density spectrum:
-		psd = features['powerspectrum'].standard
-
-		logger.debug('Generating Image...')
-		img_array = preprocessing.generate_single_image(psd[0], psd[1])
-		img_array = img_array.reshape(1, 128, 128, 1)
+		# Pre-calculated power density spectra:
+		logger.debug('Generating Images...')
+		img_array = []
+		for feat in features:
+			psd = feat['powerspectrum'].standard
+			img_array.append(preprocessing.generate_single_image(psd[0], psd[1]).reshape(128, 128, 1))
+		img_array = np.stack(img_array)
 
 		logger.debug('Making Predictions...')
-		pred_array = np.zeros((self.mc_iterations, self.num_labels))
+		pred_array = np.zeros((self.mc_iterations, len(features), self.num_labels))
 		for i in range(self.mc_iterations):
-			pred_array[i, :] = self.classifier_list[0](img_array, training=False)
+			pred_array[i, :, :] = self.classifier_list[0](img_array, training=False)
 		pred = np.mean(pred_array, axis=0)
 
 		# Convert the integer labels used by SLOSH to StellarClasses again
-		# and put it all together in the result dict:
-		result = {}
-		for k, stcl in enumerate(self.StellarClasses):
-			result[stcl] = pred[k]
-
-		return result, []
+		# and put it all together in the result dicts:
+		results = []
+		for p in pred:
+			result = {}
+			for k, stcl in enumerate(self.StellarClasses):
+				result[stcl] = p[k]
+			results.append(result)
+
+		return results, [[] for _ in features]
 
 	#----------------------------------------------------------------------------------------------
 	def train(self, tset):
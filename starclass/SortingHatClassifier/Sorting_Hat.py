@@ -8,7 +8,6 @@ The Sorting-Hat Classifier (Supervised randOm foRest variabiliTy classIfier usin
 
 import numpy as np
 from bottleneck import anynan
-import scipy.stats as stat
 import logging
 import os.path
 import os
@@ -16,6 +15,8 @@ from sklearn.ensemble import RandomForestClassifier
 from . import Sorting_Hat_featcalc as fc
 from .. import BaseClassifier, io
 from ..utilities import get_periods
+from ..features.timestats import lightcurve_statistics
+from ..features.derived import relative_lightcurve
 
 # Number of frequencies used as features:
 NFREQUENCIES = 3
@@ -118,7 +119,7 @@ class SortingHatClassifier(BaseClassifier):
 
 			# If not all features are already populated, we are going to recalculate them all:
 			if recalc or anynan(featout[k, :]):
-				lc = fc.prepLCs(obj['lightcurve'], linflatten=False)
+				lc = relative_lightcurve(obj)
 
 				periods, _, _ = get_periods(obj, NFREQUENCIES, lc.time, in_days=False)
 				featout[k, :NFREQUENCIES] = periods
@@ -128,8 +129,9 @@ class SortingHatClassifier(BaseClassifier):
 
 				featout[k, NFREQUENCIES:NFREQUENCIES+2] = fc.compute_varrat(obj)
 				#featout[k, NFREQUENCIES+1:NFREQUENCIES+2] = fc.compute_lpf1pa11(obj)
-				featout[k, NFREQUENCIES+2:NFREQUENCIES+3] = stat.skew(lc.flux)
-				featout[k, NFREQUENCIES+3:NFREQUENCIES+4] = fc.compute_flux_ratio(lc.flux)
+				stats = lightcurve_statistics(lc, features=obj)
+				featout[k, NFREQUENCIES+2:NFREQUENCIES+3] = stats['skewness']
+				featout[k, NFREQUENCIES+3:NFREQUENCIES+4] = stats['flux_ratio']
 				featout[k, NFREQUENCIES+4:NFREQUENCIES+5] = fc.compute_differential_entropy(lc.flux)
 				featout[k, NFREQUENCIES+5:NFREQUENCIES+6] = fc.compute_differential_entropy(obj['powerspectrum'].standard[1])
 				featout[k, NFREQUENCIES+6:NFREQUENCIES+10] = fc.compute_multiscale_entropy(lc.flux)
@@ -148,6 +150,20 @@ class SortingHatClassifier(BaseClassifier):
 		Returns:
 			dict: Dictionary of stellar classifications.
 		"""
+		results, featarray = self.do_classify_many([features], recalc=recalc)
+		return results[0], featarray[0:1]
+
+	#----------------------------------------------------------------------------------------------
+	def do_classify_many(self, features, recalc=False):
+		"""
+		Classify several lightcurves, with a single evaluation of the classifier.
+
+		Parameters:
+			features (list): List of dictionaries of features.
+
+		Returns:
+			tuple: List of dictionaries of stellar classifications and array of features.
+		"""
 		# Start a logger that should be used to output e.g. debug information:
 		logger = logging.getLogger(__name__)
 
@@ -158,19 +174,22 @@ class SortingHatClassifier(BaseClassifier):
 		# If self.classifier.trained=True, calculate additional features
 
 		logger.debug("Calculating features...")
-		featarray = self.featcalc(features, total=1, recalc=recalc)
+		featarray = self.featcalc(features, total=len(features), recalc=recalc)
 		#logger.info("Features calculated.")
 
 		# Do the magic:
 		#logger.info("We are starting the magic...")
-		classprobs = self.classifier.predict_proba(featarray)[0]
+		classprobs = self.classifier.predict_proba(featarray)
 		logger.debug("Classification complete")
 
-		result = {}
-		for c, cla in enumerate(self.classifier.classes_):
-			key = self.StellarClasses(cla)
-			result[key] = classprobs[c]
-		return result, featarray
+		results = []
+		for probs in classprobs:
+			result = {}
+			for c, cla in enumerate(self.classifier.classes_):
+				key = self.StellarClasses(cla)
+				result[key] = probs[c]
+			results.append(result)
+		return results, featarray
 
 	#----------------------------------------------------------------------------------------------
 	def train(self, tset, savecl=True, recalc=False, overwrite=False):
@@ -195,9 +214,14 @@ class SortingHatClassifier(BaseClassifier):
 
 		fitlabels = self.parse_labels(tset.labels())
 
-		logger.info('Calculating/Loading Features.')
-		featarray = self.featcalc(tset.features(), total=len(tset), recalc=recalc)
-		logger.info('Features calculated/loaded.')
+		# Use features already in the MOAT if they are available for all stars:
+		featarray = None if recalc else tset.feature_matrix(self.classifier_key, self.features_names)
+		if featarray is None:
+			logger.info('Calculating/Loading Features.')
+			featarray = self.featcalc(tset.features(), total=len(tset), recalc=recalc)
+			logger.info('Features calculated/loaded.')
+		else:
+			logger.info('Features loaded from MOAT.')
 
 		self.classifier.oob_score = True
 		self.classifier.fit(featarray, fitlabels)
@@ -8,9 +8,9 @@ Utilities for the SORTING-HAT classifier.
 
 import numpy as np
 from bottleneck import nansum
-import astropy.units as u
-import pyentrp.entropy as ent
 from . import npeet_entropy_estimators as npeet
+from ..features.phasefold import EBperiod, phasefold, binPhaseLC, prepFilePhasefold # noqa: F401
+from ..features.derived import prepare_lightcurve
 
 #--------------------------------------------------------------------------------------------------
 def prepLCs(lc, linflatten=False, detrending_coeff=1):
@@ -18,156 +18,10 @@ def prepLCs(lc, linflatten=False, detrending_coeff=1):
 	Nancut lightcurve, converts from ppm to relative flux and centres around 1.
 	Optionally removes ith polynomial trend (=detrending_coeff).
 	Assumes LCs come in normalised ppm with median zero.
-	"""
-	lc = lc.remove_nans()
-	lc = 1e-6*lc + 1
-	lc.flux_unit = u.dimensionless_unscaled
-
-	if linflatten:
-		lc = lc - np.polyval(np.polyfit(lc.time, lc.flux, detrending_coeff), lc.time) + 1
-
-	#mean = np.mean(lc.flux)
-	#variance = np.sqrt(np.sum(lc.flux - mean)**2 / (len(lc.flux) - 1))
-
-	return lc
-
-#--------------------------------------------------------------------------------------------------
-def EBperiod(time, flux, per, cut_outliers=0, linflatten=True):
-	"""
-	.. codeauthor:: David Armstrong <d.j.armstrong@warwick.ac.uk>
-
-	Tests for phase variation at double the current prime period,
-	to correct EB periods.
-
-	Inputs
-	-----------------
-	time
-	flux
-	per: 			float
-		Period to phasefold self.lc at.
-	cut_outliers:	float
-		outliers ignored if difference from median in bin divided by the MAD is
-		greater than cut_outliers.
 
-	Returns
-	-----------------
-	corrected period: float
-		Either initial period or double
+	See :func:`starclass.features.derived.prepare_lightcurve`.
 	"""
-	if per < 0:
-		return per
-	if linflatten:
-		flux_flat = flux - np.polyval(np.polyfit(time,flux,1),time) + 1
-	else:
-		flux_flat = flux
-
-	phaselc2P = np.zeros([len(time),2])
-	phaselc2P = phasefold(time,per*2)
-	idx = np.argsort(phaselc2P)
-	phaselc2P = phaselc2P[idx]
-	flux = flux_flat[idx]
-	binnedlc2P = binPhaseLC(phaselc2P, flux, 64, cut_outliers=5) # ADD OUTLIER CUTS?
-
-	minima = np.argmin(binnedlc2P[:,1])
-	posssecondary = np.mod(np.abs(binnedlc2P[:,0]-np.mod(binnedlc2P[minima,0]+0.5,1.)),1.)
-	#within 0.05 either side of phase 0.5 from minima
-	posssecondary = np.where((posssecondary < 0.05) | (posssecondary > 0.95))[0]
-
-	pointsort = np.sort(flux)
-	top10points = np.median(pointsort[-30:])
-	bottom10points = np.median(pointsort[:30])
-
-	periodlim = (np.max(time) - np.min(time))/2. # no effective limit, could be changed
-	if np.min(binnedlc2P[posssecondary,1]) - binnedlc2P[minima,1] > 0.0025 \
-		and np.min(binnedlc2P[posssecondary,1]) - binnedlc2P[minima,1] \
-		> 0.03*(top10points-bottom10points) \
-		and per*2 <= periodlim:
-		return 2*per
-	else:
-		return per
-
-#--------------------------------------------------------------------------------------------------
-def phasefold(time,per,t0=0):
-	return np.mod(time-t0,per)/per
-
-#--------------------------------------------------------------------------------------------------
-def binPhaseLC(phase, flux, nbins, cut_outliers=0):
-	"""
-	.. codeauthor:: David Armstrong <d.j.armstrong@warwick.ac.uk>
-
-	Bins a lightcurve, typically phase-folded.
-
-	Inputs
-	-----------------
-	phase: 			ndarray, N
-		Phase data (could use a time array instead)
-	flux:			ndarray, N
-		Flux data
-	nbins:			int
-		Number of bins to use
-	cut_outliers:	float
-		If not zero, cuts outliers where (difference to median)/MAD > cut_outliers
-
-	Returns
-	-----------------
-	binnedlc:		ndarray, (nbins, 2)
-		Array of (bin phases, binned fluxes)
-	"""
-	bin_edges = np.arange(nbins)/float(nbins)
-	bin_indices = np.digitize(phase, bin_edges) - 1
-	binnedlc = np.zeros([nbins,2])
-	#fixes phase of all bins - means ignoring locations of points in bin
-	binnedlc[:,0] = 1./nbins * 0.5 + bin_edges
-	for bin in range(nbins):
-		if np.sum(bin_indices == bin) > 0:
-			inbin = np.where(bin_indices == bin)[0]
-			if cut_outliers and np.sum(bin_indices == bin) > 2:
-				mad = np.median(np.abs(flux[inbin]-np.median(flux[inbin])))
-				outliers = np.abs((flux[inbin] - np.median(flux[inbin])))/mad <= cut_outliers
-				inbin = inbin[outliers]
-			binnedlc[bin,1] = np.mean(flux[inbin])
-		else:
-			#bit awkward this, but only alternative is to interpolate?
-			binnedlc[bin,1] = np.mean(flux)
-	return binnedlc
-
-#--------------------------------------------------------------------------------------------------
-def prepFilePhasefold(time, flux, period, cardinality):
-	"""
-	.. codeauthor:: David Armstrong <d.j.armstrong@warwick.ac.uk>
-
-	Prepares a lightcurve for using with the SOM.
-
-	Inputs
-	-----------------
-	time
-	flux
-	period: 			float
-		Period to phasefold self.lc at
-	cardinality:		int
-		Number of bins used in SOM
-
-	Returns
-	-----------------
-	binnedlc:		ndarray, (cardinality, 2)
-		Array of (bin phases, binned fluxes)
-	range:			float
-		Max - Min if binned lightcurve
-	"""
-	phase = phasefold(time,period)
-	idx = np.argsort(phase)
-	binnedlc = binPhaseLC(phase[idx],flux[idx],cardinality)
-	#normalise to between 0 and 1
-	minflux = np.min(binnedlc[:,1])
-	maxflux = np.max(binnedlc[:,1])
-	if maxflux != minflux:
-		binnedlc[:,1] = (binnedlc[:,1]-minflux) / (maxflux-minflux)
-	else:
-		binnedlc[:,1] = np.ones(cardinality)
-	#offset so minimum is at phase 0
-	binnedlc[:,0] = np.mod(binnedlc[:,0]-binnedlc[np.argmin(binnedlc[:,1]),0],1)
-	binnedlc = binnedlc[np.argsort(binnedlc[:,0]),:]
-	return binnedlc[:,1],maxflux-minflux
+	return prepare_lightcurve(lc, linflatten=linflatten, detrending_coeff=detrending_coeff)
 
 #--------------------------------------------------------------------------------------------------
 def compute_lpf1pa11(featdictrow):
@@ -184,8 +38,7 @@ def compute_lpf1pa11(featdictrow):
 		log10(((amp11**2+amp12**2+amp13**2+amp14**2)/amp11**2)-1)
 
 	"""
-	tab = featdictrow['frequencies']
-	peak1 = tab[tab['num'] == 1]
+	peak1 = featdictrow['frequencies'].harmonics(1)
 	amp11 = peak1['amplitude'][peak1['harmonic'] == 1]
 	amps = peak1['amplitude'][peak1['harmonic'] > 0]
 	return np.log10(nansum(amps**2)/amp11 - 1)
@@ -207,10 +60,9 @@ def compute_varrat(featdictrow):
 	significant_harmonics: int
 		number of harmonics of f1 that is not nan
 	"""
-	tab = featdictrow['frequencies']
-	peak1 = tab[tab['num'] == 1]
+	peak1 = featdictrow['frequencies'].harmonics(1)
 
-	amps = np.array(peak1['amplitude'])
+	amps = peak1['amplitude']
 	significant_harmonics = int(np.sum((peak1['harmonic'] > 0) & ~np.isnan(peak1['amplitude'])))
 
 	varrat = (featdictrow['variance'] - nansum(amps**2 / 2)) / featdictrow['variance']
@@ -219,6 +71,113 @@ def compute_varrat(featdictrow):
 
 	return varrat, significant_harmonics
 
+#--------------------------------------------------------------------------------------------------
+def sample_entropy(x, tolerance, chunksize=2**22):
+	"""
+	Sample entropy with template length 2 and Chebyshev norm.
+
+	Gives results identical to ``pyentrp.entropy.sample_entropy(x, 2, tolerance)[-1]``,
+	but instead of comparing every template against the rest of the timeseries,
+	the values are sorted, so that all the matching pairs of single points are found
+	in a window of the sorted values. Only these pairs are then checked for also
+	matching in the following point.
+
+	Inputs
+	-----------------
+	x:				ndarray
+		Timeseries.
+	tolerance:		float
+		Tolerance for points to be considered matching.
+	chunksize:		int
+		Maximum number of pairs to check at a time.
+
+	Returns
+	-----------------
+	sampen:	float
+		Sample entropy.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	x = np.asarray(x, dtype='float64')
+	n = len(x) - 1 # The last point can not start a template of length 2
+	if n < 1:
+		return np.NaN
+
+	order = np.argsort(x[:n], kind='stable')
+	s = x[order]
+
+	# For each point in the sorted values, find the end of the window of following points
+	# which are within the tolerance. The first guess is adjusted until it is identical
+	# to the test |x_j - x_i| < tolerance, since rounding can otherwise move the boundary:
+	idx = np.arange(n)
+	hi = np.maximum(np.searchsorted(s, s + tolerance, side='left'), idx + 1)
+	while True:
+		move = (hi < n)
+		move[move] = (s[hi[move]] - s[idx[move]] < tolerance)
+		if not move.any():
+			break
+		hi[move] += 1
+	while True:
+		move = (hi > idx + 1)
+		move[move] = ~(s[hi[move]-1] - s[idx[move]] < tolerance)
+		if not move.any():
+			break
+		hi[move] -= 1
+
+	# Number of matching pairs of single points:
+	counts = hi - idx - 1
+	N1 = np.sum(counts)
+
+	# Go through the matching pairs in chunks, and count the ones also matching
+	# in the following point:
+	N2 = 0
+	ends = np.cumsum(counts)
+	starts = ends - counts
+	i0 = 0
+	while i0 < n:
+		i1 = max(np.searchsorted(ends, starts[i0] + chunksize, side='right'), i0 + 1)
+		first = np.repeat(idx[i0:i1], counts[i0:i1])
+		second = first + 1 + np.arange(len(first)) - np.repeat(starts[i0:i1] - starts[i0], counts[i0:i1])
+		N2 += np.count_nonzero(np.abs(x[order[second]+1] - x[order[first]+1]) < tolerance)
+		i0 = i1
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return -np.log(np.float64(N2) / np.float64(N1))
+
+#--------------------------------------------------------------------------------------------------
+def multiscale_entropy(flux, maxscale=10, tolerance=None):
+	"""
+	Multiscale sample entropy.
+
+	Gives results identical to ``pyentrp.entropy.multiscale_entropy(flux, 2, tolerance, maxscale)``.
+
+	Inputs
+	-----------------
+	flux:
+		flux data
+	maxscale:	int
+		Maximum timescale
+	tolerance:	float
+		Tolerance. Default is 0.1 times the standard deviation of the flux.
+
+	Returns
+	-----------------
+	mse:	ndarray
+		Sample entropy of the coarse-grained flux at each timescale.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	flux = np.asarray(flux, dtype='float64')
+	if tolerance is None:
+		tolerance = 0.1 * np.std(flux)
+
+	mse = np.zeros(maxscale)
+	for scale in range(1, maxscale+1):
+		b = len(flux) // scale
+		coarse = np.mean(flux[:b*scale].reshape(b, scale), axis=1)
+		mse[scale-1] = sample_entropy(coarse, tolerance)
+	return mse
+
 #--------------------------------------------------------------------------------------------------
 def compute_multiscale_entropy(flux):
 	"""
@@ -241,7 +200,7 @@ def compute_multiscale_entropy(flux):
 		power present in the mse curve
 	"""
 
-	ms_ent = ent.multiscale_entropy(flux, 2, maxscale=10)
+	ms_ent = multiscale_entropy(flux, maxscale=10)
 	mean = np.mean(ms_ent)
 	stdev = np.std(ms_ent)
 	max_v = np.max(ms_ent)
@@ -267,8 +226,7 @@ def compute_differential_entropy(flux):
 	-----------------
 		entr: float
 	"""
-	data = helper_extract_digits(flux)
-	entr = npeet.entropy(data)
+	entr = npeet.entropy(np.asarray(flux, dtype='float64'))
 
 	return entr
 
@@ -290,33 +248,3 @@ def compute_differential_entropy(flux):
 	#lyap_exp = max(nolds.lyap_e(flux, emb_dim=10, matrix_dim=4, min_nb=None, min_tsep=0, tau=1, debug_plot=False, debug_data=False, plot_file=None))
 
 	#return lyap_exp
-
-#--------------------------------------------------------------------------------------------------
-def compute_flux_ratio(flux):
-	"""
-	Returns the ratio of fluxes that are either larger than or smaller than the mean flux (Kim & Bailer-Jones, 2016)
-
-	Inputs
-	-----------------
-	flux:
-		flux data
-
-	Returns
-	-----------------
-		flux_ratio: float
-	"""
-	mean = np.mean(flux)
-
-	# For lower (fainter) fluxes than average.
-	index = np.where(flux < mean)
-	lower_flux = flux[index]
-	lower_sum = np.sum((lower_flux - mean) ** 2) / len(lower_flux)
-
-	# For higher (brighter) fluxes than average.
-	index = np.where(flux >= mean)
-	higher_flux = flux[index]
-
-	higher_sum = np.sum((mean - higher_flux) ** 2) / len(higher_flux)
-
-	# Return flux ratio
-	return np.log(np.sqrt(lower_sum / higher_sum))
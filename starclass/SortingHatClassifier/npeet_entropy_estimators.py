@@ -15,15 +15,22 @@ def entropy(x, k=3, base=2):
 	"""
 	The classic K-L k-nearest neighbor continuous entropy estimator
 	x should be a list of vectors, e.g. x = [[1.3], [3.7], [5.1], [2.4]]
-	if x is a one-dimensional scalar and we have four samples
+	if x is a one-dimensional scalar and we have four samples.
+	One-dimensional samples can also be given as a flat array, e.g. x = [1.3, 3.7, 5.1, 2.4],
+	in which case the neighbours are found from the sorted samples instead of a tree.
 	"""
 	if k > len(x) - 1:
 		raise ValueError("Set k smaller than num. samples - 1")
 	x = np.asarray(x)
-	n_elements, n_features = x.shape
-	x = add_noise(x)
-	tree = build_tree(x)
-	nn = query_neighbors(tree, x, k)
+	if x.ndim == 1 or x.shape[1] == 1:
+		x = add_noise(x.ravel())
+		n_elements, n_features = len(x), 1
+		nn = query_neighbors_1d(x, k)
+	else:
+		n_elements, n_features = x.shape
+		x = add_noise(x)
+		tree = build_tree(x)
+		nn = query_neighbors(tree, x, k)
 	const = digamma(n_elements) - digamma(k) + n_features * np.log(2)
 	return (const + n_features * np.log(nn).mean()) / np.log(base)
 
@@ -46,6 +53,24 @@ def add_noise(x, intens=1e-10):
 def query_neighbors(tree, x, k):
 	return tree.query(x, k=k + 1)[0][:, k]
 
+#--------------------------------------------------------------------------------------------------
+def query_neighbors_1d(x, k):
+	# Distance to the k-th nearest neighbour of one-dimensional samples.
+	# In the sorted samples, the k nearest neighbours of a point are found in one of the k+1
+	# windows of k+1 consecutive samples containing the point, so the k-th neighbour distance
+	# is the smallest of the largest distances within each of these windows:
+	order = np.argsort(x)
+	s = x[order]
+	n = len(s)
+	padded = np.concatenate((np.full(k, -np.inf), s, np.full(k, np.inf)))
+	nn_sorted = np.full(n, np.inf)
+	for j in range(k+1):
+		window = np.maximum(s - padded[j:j+n], padded[j+k:j+k+n] - s)
+		np.minimum(nn_sorted, window, out=nn_sorted)
+	nn = np.empty(n)
+	nn[order] = nn_sorted
+	return nn
+
 #--------------------------------------------------------------------------------------------------
 def count_neighbors(tree, x, r):
 	return tree.query_radius(x, r, count_only=True)
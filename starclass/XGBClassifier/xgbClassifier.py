@@ -116,6 +116,21 @@ class XGBClassifier(BaseClassifier):
 			dict: Dictionary of stellar classifications.
 		"""
 
+		class_results, feature_results = self.do_classify_many([features])
+		return class_results[0], feature_results[0:1]
+
+	#----------------------------------------------------------------------------------------------
+	def do_classify_many(self, features):
+		"""
+		Classification of several lightcurves, with a single evaluation of the classifier.
+
+		Parameters:
+			features (list): List of dictionaries of features.
+
+		Returns:
+			tuple: List of dictionaries of stellar classifications and array of features.
+		"""
+
 		# Start a logger that should be used to output e.g. debug information:
 		logger = logging.getLogger(__name__)
 
@@ -125,17 +140,20 @@ class XGBClassifier(BaseClassifier):
 
 		# If classifer has been trained, calculate features
 		logger.debug("Calculating features...")
-		feature_results = xgb_features.feature_extract(features, self.features_names, total=1)
+		feature_results = xgb_features.feature_extract(features, self.features_names, total=len(features))
 		#logger.info('Feature Extraction done')
 
 		# Do the magic:
-		xgb_classprobs = self.classifier.predict_proba(feature_results)[0]
+		xgb_classprobs = self.classifier.predict_proba(feature_results)
 		logger.debug("Classification complete")
 
-		class_results = {}
-		for k, stcl in enumerate(self.StellarClasses):
-			# Cast to float for prediction
-			class_results[stcl] = float(xgb_classprobs[k])
+		class_results = []
+		for probs in xgb_classprobs:
+			res = {}
+			for k, stcl in enumerate(self.StellarClasses):
+				# Cast to float for prediction
+				res[stcl] = float(probs[k])
+			class_results.append(res)
 
 		return class_results, feature_results
 
@@ -151,9 +169,14 @@ class XGBClassifier(BaseClassifier):
 		if self.trained:
 			return
 
-		logger.info('Calculating/Loading Features.')
-		featarray = xgb_features.feature_extract(tset.features(), self.features_names, total=len(tset), recalc=recalc)
-		logger.info('Features calculated/loaded.')
+		# Use features already in the MOAT if they are available for all stars:
+		featarray = None if recalc else tset.feature_matrix(self.classifier_key, self.features_names)
+		if featarray is None:
+			logger.info('Calculating/Loading Features.')
+			featarray = xgb_features.feature_extract(tset.features(), self.features_names, total=len(tset), recalc=recalc)
+			logger.info('Features calculated/loaded.')
+		else:
+			logger.info('Features loaded from MOAT.')
 
 		# Convert classification labels to integers:
 		intlookup = {key.value: value for value, key in enumerate(self.StellarClasses)}
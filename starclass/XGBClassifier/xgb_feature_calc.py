@@ -7,8 +7,9 @@
 
 import numpy as np
 from bottleneck import anynan
-import scipy.stats as ss
 from ..RFGCClassifier import RF_GC_featcalc
+from ..features.timestats import lightcurve_statistics
+from ..features.derived import relative_lightcurve, fold_order
 from ..utilities import get_periods
 
 #--------------------------------------------------------------------------------------------------
@@ -26,12 +27,14 @@ def feature_extract(features, featnames, total=None, linflatten=False, recalc=Fa
 
 		if recalc or anynan(featout[k, :]):
 			# TODO: Why is it needed to re-normalize the lightcurve here?
-			lc = RF_GC_featcalc.prepLCs(obj['lightcurve'], linflatten)
+			lc = relative_lightcurve(obj, linflatten=linflatten)
 
-			featout[k, 0] = ss.skew(lc.flux) # Skewness
-			featout[k, 1] = ss.kurtosis(lc.flux) # Kurtosis
-			featout[k, 2] = ss.shapiro(lc.flux)[0] # Shapiro-Wilk test statistic for normality
-			featout[k, 3] = calculate_eta(lc)
+			# Time-domain statistics, which are shared with the other classifiers:
+			stats = lightcurve_statistics(lc, features=None if linflatten else obj)
+			featout[k, 0] = stats['skewness'] # Skewness
+			featout[k, 1] = stats['kurtosis'] # Kurtosis
+			featout[k, 2] = stats['shapiro_wilk'] # Shapiro-Wilk test statistic for normality
+			featout[k, 3] = stats['eta']
 
 			periods, n_usedfreqs, usedfreqs = get_periods(obj, 6, lc.time, ignore_harmonics=False)
 			amp21, amp31 = RF_GC_featcalc.freq_ampratios(obj, n_usedfreqs, usedfreqs)
@@ -40,7 +43,7 @@ def feature_extract(features, featnames, total=None, linflatten=False, recalc=Fa
 			featout[k, 4] = periods[0]
 
 			if n_usedfreqs > 0:
-				featout[k, 5] = obj['frequencies'][(obj['frequencies']['num'] == 1) & (obj['frequencies']['harmonic'] == 0)]['amplitude']
+				featout[k, 5] = obj['frequencies'].peak(1)['amplitude']
 			else:
 				featout[k, 5] = 0.
 
@@ -50,10 +53,13 @@ def feature_extract(features, featnames, total=None, linflatten=False, recalc=Fa
 			featout[k, 9] = pd31
 
 			# phase-fold lightcurve on dominant period
-			folded_lc = lc.fold(period=periods[0])
+			if linflatten:
+				folded_lc = lc.fold(period=periods[0])
+			else:
+				folded_lc = lc[fold_order(obj, periods[0])]
 
 			# Compute phi_rcs and rcs features
-			featout[k, 10] = Rcs(lc)
+			featout[k, 10] = stats['Rcs']
 			featout[k, 11] = Rcs(folded_lc)
 
 		# If the amp1 features is NaN, replace it with zero:
@@ -62,29 +68,6 @@ def feature_extract(features, featnames, total=None, linflatten=False, recalc=Fa
 
 	return featout
 
-#--------------------------------------------------------------------------------------------------
-def calculate_eta(lc):
-	"""
-	Calculate Eta feature.
-
-	Parameters:
-		mag (array_like): An array of magnitudes.
-		std (array_like): A standard deviation of magnitudes.
-
-	Returns:
-		float: The value of Eta index.
-	"""
-
-	weight = 1. / lc.flux_err
-	weighted_sum = np.sum(weight)
-	weighted_mean = np.sum(lc.flux * weight) / weighted_sum
-	std = np.sqrt(np.sum((lc.flux - weighted_mean)**2 * weight) / weighted_sum)
-
-	diff = lc.flux[1:] - lc.flux[:len(lc.flux) - 1]
-	eta = np.sum(diff * diff) / (len(lc.flux) - 1.) / std / std
-
-	return eta
-
 #--------------------------------------------------------------------------------------------------
 def Rcs(lc):
 	"""
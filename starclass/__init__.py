@@ -5,6 +5,7 @@
 from .StellarClasses import StellarClassesLevel1, StellarClassesLevel2
 from .BaseClassifier import BaseClassifier, STATUS
 from .taskmanager import TaskManager
+from .classify_star import classify_star
 from .RFGCClassifier import RFGCClassifier
 from .SLOSH import SLOSHClassifier
 from .XGBClassifier import XGBClassifier
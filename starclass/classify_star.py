@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Running all classifiers on a single star (star-major processing).
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+from astropy.table import Table
+from .BaseClassifier import STATUS
+
+#--------------------------------------------------------------------------------------------------
+def classify_star(tasks, classifiers):
+	"""
+	Run all classifiers on a single star.
+
+	The star is only loaded once, and the common features (including the lightcurve,
+	powerspectrum and extracted frequencies) are shared between all the classifiers.
+	If the meta-classifier is among the tasks, it is run after the other classifiers,
+	with their results added to ``other_classifiers``.
+
+	Parameters:
+		tasks (list): List of tasks for a single star, as returned by
+			:func:`TaskManager.get_star_tasks`.
+		classifiers (dict): Dictionary of initialized classifiers, with classifier keys
+			as keys. Must contain the classifiers of all the tasks.
+
+	Returns:
+		list: List of results from :func:`BaseClassifier.classify`, in the same order as
+		the tasks. The results can be saved in a single transaction by
+		:func:`TaskManager.save_results`.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	if len(set(task['priority'] for task in tasks)) > 1:
+		raise ValueError("All tasks should be for the same star")
+
+	results = []
+	features = None
+	for task in sorted(tasks, key=lambda task: task['classifier'] == 'meta'):
+		stcl = classifiers[task['classifier']]
+		if task['classifier'] == 'meta':
+			task = dict(task, other_classifiers=other_classifiers_table(task['other_classifiers'], results))
+			results.append(stcl.classify(task))
+		else:
+			# Load the common features of the star, which are then shared between
+			# the classifiers. Features specific to each classifier are added by classify:
+			if features is None:
+				features = stcl.load_star({key: value for key, value in task.items() if key != 'features'})
+			results.append(stcl.classify(task, features=features))
+
+	# Return the results in the same order as the tasks:
+	order = [task['classifier'] for task in tasks]
+	return sorted(results, key=lambda res: order.index(res['classifier']))
+
+#--------------------------------------------------------------------------------------------------
+def other_classifiers_table(other_classifiers, results):
+	"""
+	Add results from classifiers to the table of results used by the meta-classifier.
+
+	Parameters:
+		other_classifiers (:class:`astropy.table.Table`): Table of results already saved,
+			with columns ``classifier``, ``class`` and ``prob``.
+		results (list): Results from :func:`BaseClassifier.classify`, which take precedence
+			over results from the same classifiers in ``other_classifiers``.
+
+	Returns:
+		:class:`astropy.table.Table`: Table of results, in the same order as
+		returned by :func:`TaskManager.get_task`.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	new_classifiers = set(res['classifier'] for res in results)
+
+	rows = []
+	if other_classifiers is not None:
+		for row in other_classifiers:
+			if row['classifier'] not in new_classifiers:
+				rows.append([row['classifier'], row['class'], row['prob']])
+
+	for res in results:
+		if res['classifier'] != 'meta' and res['status'] == STATUS.OK:
+			for key, value in res['starclass_results'].items():
+				rows.append([res['classifier'], key, value])
+
+	rows = sorted(rows, key=lambda row: (row[0], row[1].name))
+	if not rows: rows = None
+	return Table(
+		rows=rows,
+		names=('classifier', 'class', 'prob'),
+	)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Products derived from the lightcurve of a star, which are shared between the classifiers.
+
+When the features are a :class:`featuregraph.featuregraph`, as returned by
+:meth:`BaseClassifier.load_star`, every product is only calculated once per star, no
+matter how many of the classifiers are using it. For plain dicts of features the products
+are simply calculated on every call.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import numpy as np
+import astropy.units as u
+from .featuregraph import featuregraph
+from .phasefold import phasefold, EBperiod
+
+#--------------------------------------------------------------------------------------------------
+def _product(features, key, func):
+	if isinstance(features, featuregraph):
+		return features.product(key, func)
+	return func()
+
+#--------------------------------------------------------------------------------------------------
+def prepare_lightcurve(lc, linflatten=False, detrending_coeff=1):
+	"""
+	Nancut lightcurve, converts from ppm to relative flux and centres around 1.
+	Optionally removes polynomial trend of order ``detrending_coeff``.
+	Assumes LCs come in in normalised ppm with median zero.
+
+	Parameters:
+		lc (:class:`lightkurve.LightCurve`): Lightcurve in ppm.
+		linflatten (bool, optional): Remove polynomial trend.
+		detrending_coeff (int, optional): Order of polynomial trend to remove.
+
+	Returns:
+		:class:`lightkurve.LightCurve`: Lightcurve in relative flux.
+	"""
+	lc = lc.remove_nans()
+	lc = lc*1e-6 + 1
+	lc.flux_unit = u.dimensionless_unscaled
+
+	if linflatten:
+		lc = lc - np.polyval(np.polyfit(lc.time, lc.flux, detrending_coeff), lc.time) + 1
+
+	return lc
+
+#--------------------------------------------------------------------------------------------------
+def relative_lightcurve(features, linflatten=False):
+	"""
+	Lightcurve without NaNs in relative flux, optionally with a linear trend removed.
+
+	Parameters:
+		features (dict): Features of star, containing the lightcurve in ppm.
+		linflatten (bool, optional): Remove linear trend.
+
+	Returns:
+		:class:`lightkurve.LightCurve`: Lightcurve in relative flux. Should not be modified.
+
+	See Also:
+		:func:`prepare_lightcurve`
+	"""
+	return _product(features, ('relative_lightcurve', bool(linflatten)),
+		lambda: prepare_lightcurve(features['lightcurve'], linflatten=linflatten))
+
+#--------------------------------------------------------------------------------------------------
+def ebperiod(features, per):
+	"""
+	Period of star, corrected to double the period if the star is an eclipsing binary.
+
+	Identical to ``EBperiod(lc.time, lc.flux, per, linflatten=True)`` on the lightcurve in
+	relative flux, but re-using the linearly detrended lightcurve.
+
+	Parameters:
+		features (dict): Features of star, containing the lightcurve in ppm.
+		per (float): Period in days.
+
+	Returns:
+		float: Either initial period or double.
+
+	See Also:
+		:func:`phasefold.EBperiod`
+	"""
+	def _ebperiod():
+		lc_flat = relative_lightcurve(features, linflatten=True)
+		return EBperiod(lc_flat.time, lc_flat.flux, per, linflatten=False)
+	return _product(features, ('ebperiod', per), _ebperiod)
+
+#--------------------------------------------------------------------------------------------------
+def phase_order(features, per):
+	"""
+	Indices sorting the lightcurve in relative flux by phase.
+
+	Parameters:
+		features (dict): Features of star, containing the lightcurve in ppm.
+		per (float): Period to fold with in days.
+
+	Returns:
+		ndarray: Indices sorting the lightcurve by :func:`phasefold.phasefold` phase.
+	"""
+	return _product(features, ('phase_order', per),
+		lambda: np.argsort(phasefold(relative_lightcurve(features).time, per)))
+
+#--------------------------------------------------------------------------------------------------
+def fold_order(features, period):
+	"""
+	Indices sorting the lightcurve in relative flux in the same order as
+	:meth:`lightkurve.LightCurve.fold`, with phases between -0.5 and 0.5, without creating
+	the folded lightcurve.
+
+	Parameters:
+		features (dict): Features of star, containing the lightcurve in ppm.
+		period (float): Period to fold with in days.
+
+	Returns:
+		ndarray: Indices sorting the lightcurve by phase.
+	"""
+	def _fold_order():
+		fold_time = (relative_lightcurve(features).time / period) % 1
+		fold_time[fold_time > 0.5] -= 1
+		return np.argsort(fold_time)
+	return _product(features, ('fold_order', period), _fold_order)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dictionary of features which are calculated lazily on first access.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+from collections import OrderedDict
+
+#--------------------------------------------------------------------------------------------------
+class featuregraph(dict):
+	"""
+	Dictionary of features, where features are calculated when they are first accessed.
+
+	Features are provided by named stages. A stage is a function which is called with the
+	featuregraph itself and returns a dict with the features the stage provides.
+	Stages can therefore depend on features from other stages, which will in turn be
+	calculated as needed. Every stage is only evaluated once, after which its features are
+	stored as normal items in the dictionary. Features which are already present in the
+	dictionary, e.g. because they were loaded from a cache, are never recalculated.
+
+	Only features which have been evaluated (or set directly) are part of the keys,
+	iteration and length of the dictionary, while ``in``, :meth:`get` and indexing also
+	considers features which can be calculated by one of the stages.
+
+	Besides the features, the graph can also hold derived products (see :meth:`product`),
+	which are intermediate results shared between calculations of features.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self._stages = OrderedDict()
+		self._providers = {}
+		self._running = set()
+		self._products = {}
+
+	#----------------------------------------------------------------------------------------------
+	def __reduce__(self):
+		# Only the evaluated features are pickled, since the stages are often not picklable:
+		return (featuregraph, (dict(self),))
+
+	#----------------------------------------------------------------------------------------------
+	def add_stage(self, name, provides, func):
+		"""
+		Add stage to the graph.
+
+		Parameters:
+			name (str): Name of stage.
+			provides (list): Names of the features provided by the stage.
+			func (callable): Function called with the featuregraph as the only argument,
+				returning a dict containing (at least) all the features in ``provides``.
+		"""
+		if name in self._stages:
+			raise ValueError("Stage already exists: '%s'" % name)
+		provides = tuple(provides)
+		self._stages[name] = (provides, func)
+		for key in provides:
+			self._providers[key] = name
+
+	#----------------------------------------------------------------------------------------------
+	@property
+	def stages(self):
+		"""List of names of stages in the graph."""
+		return list(self._stages.keys())
+
+	#----------------------------------------------------------------------------------------------
+	def provided_keys(self):
+		"""
+		Names of all features which are available, either because they have been evaluated
+		or because they can be calculated by one of the stages.
+		"""
+		keys = list(self.keys())
+		keys += [key for key in self._providers if not dict.__contains__(self, key)]
+		return keys
+
+	#----------------------------------------------------------------------------------------------
+	def is_evaluated(self, key):
+		"""Return ``True`` if the feature has been evaluated or set directly."""
+		return dict.__contains__(self, key)
+
+	#----------------------------------------------------------------------------------------------
+	def evaluate_stage(self, name):
+		"""
+		Evaluate stage, if not all of its features are already available.
+
+		Parameters:
+			name (str): Name of stage.
+		"""
+		provides, func = self._stages[name]
+		missing = [key for key in provides if not dict.__contains__(self, key)]
+		if not missing:
+			return
+
+		if name in self._running:
+			raise RuntimeError("Circular dependency of stage '%s'" % name)
+		self._running.add(name)
+		try:
+			values = func(self)
+		finally:
+			self._running.discard(name)
+
+		for key in missing:
+			dict.__setitem__(self, key, values[key])
+
+	#----------------------------------------------------------------------------------------------
+	def evaluate(self, keys=None):
+		"""
+		Evaluate the stages providing the given features.
+
+		Parameters:
+			keys (list, optional): Names of features to evaluate. Default is to evaluate all stages.
+		"""
+		if keys is None:
+			stages = self._stages.keys()
+		else:
+			stages = OrderedDict((self._providers[key], True) for key in keys if key in self._providers)
+		for name in list(stages):
+			self.evaluate_stage(name)
+
+	#----------------------------------------------------------------------------------------------
+	def product(self, key, func):
+		"""
+		Derived product, which is only calculated the first time it is requested.
+
+		Derived products are not features, so they are not part of the keys of the
+		dictionary and are not pickled. The returned object is shared with everyone else
+		requesting the same product, and should therefore not be modified.
+
+		Parameters:
+			key (hashable): Identifier of the product, typically a tuple of a name and the
+				arguments used to calculate it.
+			func (callable): Function without arguments calculating the product.
+
+		Returns:
+			The derived product.
+		"""
+		try:
+			return self._products[key]
+		except KeyError:
+			value = self._products[key] = func()
+			return value
+
+	#----------------------------------------------------------------------------------------------
+	def __missing__(self, key):
+		if key not in self._providers:
+			raise KeyError(key)
+		self.evaluate_stage(self._providers[key])
+		return dict.__getitem__(self, key)
+
+	#----------------------------------------------------------------------------------------------
+	def __contains__(self, key):
+		return dict.__contains__(self, key) or key in self._providers
+
+	#----------------------------------------------------------------------------------------------
+	def get(self, key, default=None):
+		if key in self:
+			return self[key]
+		return default
@@ -11,6 +11,17 @@ from 0.2 ,0.7, 7, 20 and 50 muHz.
 """
 
 import numpy as np
+from collections import OrderedDict
+
+#: Default FliPer frequency bands (lower and upper limits in muHz).
+default_bands = OrderedDict([
+	('Fp07', (0.7, 277)),
+	('Fp7', (7, 277)),
+	('Fp20', (20, 277)),
+	('Fp50', (50, 277)),
+	('Fphi', (0, 28)),
+	('Fplo', (250, 277))
+])
 
 # def _APODIZATION(star_tab_psd):
 # 	"""
@@ -22,41 +33,68 @@ import numpy as np
 # 	star_tab_psd[1] /= nu**2
 # 	return star_tab_psd
 
-def _region(star_tab_psd, inic, end):
+def band_means(freq, power, bands):
 	"""
-	Function that calculates the average power in a given frequency range on PSD
+	Average power in several frequency ranges of one or more PSDs.
+
+	A single cumulative sum of the power is calculated, from which the mean in each
+	frequency range (including both limits) is found from its two end-points.
+
+	Parameters:
+		freq (ndarray): Sorted frequencies in muHz.
+		power (ndarray): Power density in ppm2/muHz. Can be 2D with one spectrum
+			on each row, all sharing the same frequencies.
+		bands (list): List of tuples with lower and upper limits of frequency ranges in muHz.
+
+	Returns:
+		ndarray: Mean power in each frequency range, along the last axis. Ranges without
+			any frequencies are NaN.
 	"""
-	freq = star_tab_psd[0] # frequencies in muHz
-	power = star_tab_psd[1] # Power density in ppm2/muHz
-	return np.mean(power[(freq >= inic) & (freq <= end)])
+	power = np.asarray(power, dtype='float64')
+	bands = np.atleast_2d(np.asarray(bands, dtype='float64'))
+	csum = np.zeros(power.shape[:-1] + (power.shape[-1] + 1,), dtype='float64')
+	np.cumsum(power, axis=-1, out=csum[..., 1:])
+
+	istart = np.searchsorted(freq, bands[:, 0], side='left')
+	iend = np.searchsorted(freq, bands[:, 1], side='right')
+	count = iend - istart
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return np.where(count > 0, (csum[..., iend] - csum[..., istart]) / count, np.NaN)
 
-def FliPer(psd):
+def FliPer(psd, bands=None):
 	"""
 	Compute FliPer values from 0.7, 7, 20, & 50 muHz
 
 	Parameters:
-		psd (`powerspectrum` object): Power spectrum of which to calculate
-			the FliPer metrics.
+		psd (`powerspectrum` object or tuple): Power spectrum of which to calculate
+			the FliPer metrics. Can also be a tuple of frequencies in muHz and power density,
+			where the power density can be 2D with one spectrum on each row.
+		bands (dict, optional): Frequency ranges to calculate FliPer values in, given as
+			lower and upper limits in muHz. Default is to use :data:`default_bands`.
 
 	Returns:
-		dict: Features from FliPer method.
+		dict: Features from FliPer method. If a 2D power density was given, each value is
+			an array with one element per spectrum.
 	"""
 
+	if bands is None:
+		bands = default_bands
+
 	# Calculate powerspectrum with custom treatment of nans for FliPer method:
-	star_tab_psd = psd.standard
+	if isinstance(psd, tuple):
+		freq, power = psd
+	else:
+		freq, power = psd.standard
 
 	#star_tab_psd = _APODIZATION(star_tab_psd)
-	end = 277 # muHz
 
 	# Function that computes photon noise from last 100 bins of the spectra
-	noise = np.median(star_tab_psd[1][-100:])/((1-2./18.)**3)
-
-	return {
-		'Fp07': _region(star_tab_psd, 0.7, end) - noise,
-		'Fp7': _region(star_tab_psd, 7, end) - noise,
-		'Fp20': _region(star_tab_psd, 20, end) - noise,
-		'Fp50': _region(star_tab_psd, 50, end) - noise,
-		'FpWhite': noise,
-		'Fphi': _region(star_tab_psd, 0, 28) - noise,
-		'Fplo': _region(star_tab_psd, 250, end) - noise
-	}
+	noise = np.median(power[..., -100:], axis=-1)/((1-2./18.)**3)
+
+	means = band_means(freq, power, list(bands.values()))
+
+	features = OrderedDict()
+	for k, key in enumerate(bands.keys()):
+		features[key] = means[..., k] - noise
+	features['FpWhite'] = noise
+	return features
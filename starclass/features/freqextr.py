@@ -9,13 +9,12 @@ Extract frequencies from timeseries.
 
 import numpy as np
 import logging
-import itertools
+from collections import OrderedDict
 from bottleneck import median
-from scipy.stats import binned_statistic
 from scipy.interpolate import interp1d
 import astropy.units as u
 from astropy.table import Table
-from .powerspectrum import powerspectrum
+from .powerspectrum import powerspectrum, power_from_sums
 
 #--------------------------------------------------------------------------------------------------
 # TODO: Replace with ps.ls.model?
@@ -23,10 +22,555 @@ def model(x, a, b, freq):
 	omegax = 0.1728 * np.pi * freq * x # Strange factor is 2 * 86400 * 1e-6
 	return a * np.sin(omegax) + b * np.cos(omegax)
 
+#--------------------------------------------------------------------------------------------------
+def refit_sinusoids(x, y, nu, alpha, beta, maxiter=20, rtol=1e-10):
+	"""
+	Simultaneous non-linear least-squares fit of a sum of sinusoids.
+
+	All frequencies, sine- and cosine-amplitudes are fitted together using Gauss-Newton
+	iterations on the full design matrix, where each step is only accepted if it
+	decreases the sum of squared residuals.
+
+	Parameters:
+		x (ndarray): Time in days.
+		y (ndarray): Flux. Will be centered before fitting.
+		nu (ndarray): Initial frequencies in microHz.
+		alpha (ndarray): Initial amplitudes of the sine-components.
+		beta (ndarray): Initial amplitudes of the cosine-components.
+		maxiter (int, optional): Maximal number of iterations.
+		rtol (float, optional): Stop when the relative improvement of the sum of squared
+			residuals is smaller than this.
+
+	Returns:
+		tuple: Fitted frequencies, sine- and cosine-amplitudes.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	x = np.asarray(x, dtype='float64')
+	y = np.asarray(y, dtype='float64')
+	y = y - np.mean(y)
+	params = np.concatenate((alpha, beta, nu)).astype('float64')
+	K = len(nu)
+	factor = 0.1728 * np.pi # Strange factor is 2 * 86400 * 1e-6
+
+	def _residuals(params):
+		omegax = factor * np.outer(x, params[2*K:])
+		s = np.sin(omegax)
+		c = np.cos(omegax)
+		r = y - np.dot(s, params[:K]) - np.dot(c, params[K:2*K])
+		return r, s, c
+
+	r, s, c = _residuals(params)
+	chi2 = np.dot(r, r)
+	for _ in range(maxiter):
+		# Jacobian of the model with respect to alpha, beta and nu:
+		jac = np.hstack((s, c, factor * x[:, np.newaxis] * (params[:K]*c - params[K:2*K]*s)))
+		step = np.linalg.lstsq(jac, r, rcond=None)[0]
+
+		# Take the step, or a fraction of it, if it improves the fit:
+		for _ in range(10):
+			r_new, s_new, c_new = _residuals(params + step)
+			chi2_new = np.dot(r_new, r_new)
+			if chi2_new <= chi2:
+				break
+			step *= 0.5
+		else:
+			break
+
+		converged = (chi2 - chi2_new <= rtol*chi2)
+		params += step
+		r, s, c, chi2 = r_new, s_new, c_new, chi2_new
+		if converged:
+			break
+
+	return params[2*K:], params[:K], params[K:2*K]
+
+#--------------------------------------------------------------------------------------------------
+def refine_candidates(ps, frequency, snr, mean_noise, normfactor, oversampling, n_candidates=5):
+	"""
+	Find the highest peak by oversampling only narrow windows around the best candidates.
+
+	The candidates are the highest local maxima of the signal-to-noise spectrum evaluated on a
+	coarse frequency grid. Around each of them, the power is evaluated directly on a grid which is
+	``oversampling`` times finer, spanning the neighbouring points of the coarse grid.
+
+	Parameters:
+		ps (:class:`powerspectrum`): Power spectrum of the current residual lightcurve.
+		frequency (ndarray): Coarse frequency grid in microHz.
+		snr (ndarray): Power divided by the noise-floor on the coarse frequency grid.
+		mean_noise (ndarray or float): Noise-floor on the coarse frequency grid.
+		normfactor (float): Normalization factor converting un-scaled power of the residual
+			into the scale of ``snr``.
+		oversampling (int): Oversampling factor of the fine grid.
+		n_candidates (int, optional): Number of candidates to refine. Default=5.
+
+	Returns:
+		float or list: Frequency of the highest peak on the fine grid, or a list
+			``[freq_low, fmax, freq_high]`` bracketing it, as accepted by
+			:meth:`powerspectrum.optimize_peak`.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	# Local maxima of the coarse grid, padded so the ends of the grid can also be maxima:
+	padded = np.concatenate(([-np.inf], snr, [-np.inf]))
+	candidates = np.where((snr >= padded[:-2]) & (snr >= padded[2:]))[0]
+	candidates = candidates[np.argsort(snr[candidates])[::-1][:n_candidates]]
+
+	# Fine grids spanning the neighbouring points of the coarse grid:
+	step = (frequency[1] - frequency[0]) / oversampling
+	noffset = int(np.ceil(oversampling))
+	fine = frequency[candidates, np.newaxis] + step*np.arange(-noffset, noffset+1)
+	fine = fine[(fine > 0) & (fine <= frequency[-1])]
+
+	power = 2 * normfactor * ps.power_direct(fine*1e-6)
+	if np.ndim(mean_noise) > 0:
+		power /= np.interp(fine, frequency, mean_noise)
+	else:
+		power /= mean_noise
+
+	fmax = fine[np.argmax(power)]
+	if fmax - step <= 0:
+		return fmax
+	return [fmax - step, fmax, fmax + step]
+
+#--------------------------------------------------------------------------------------------------
+class residual_spectrum(object):
+	"""
+	Power spectrum of the residual lightcurve during pre-whitening.
+
+	The trigonometric sums behind the Lomb-Scargle periodogram are linear in the flux, so
+	when a sinusoid is removed from (or added back to) the lightcurve, the sums are updated by
+	subtracting the transform of the sinusoid instead of recomputing the spectrum from scratch.
+	The flux-independent terms are taken from the time grid of the power spectrum.
+
+	Changes are collected until the spectrum is requested, so any number of removed
+	sinusoids only costs a single transform.
+
+	Attributes:
+		frequency (ndarray): Frequency axis in microHz.
+		normfactor (float): Normalization factor of the residual spectrum.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+
+	def __init__(self, ps, oversampling=1, nyquist_factor=1):
+		"""
+		Parameters:
+			ps (:class:`powerspectrum`): Power spectrum of the lightcurve before any sinusoids
+				have been removed.
+			oversampling (int, optional): Oversampling factor. Default=1.
+			nyquist_factor (float, optional): Nyquist factor. Default=1.
+		"""
+
+		self.t = np.asarray(ps.ls.t, dtype='float64')
+		self.N = len(self.t)
+		self.normfactor = ps.normfactor
+
+		# Frequency axis, identical to the one used by powerspectrum.powerspectrum:
+		freq = np.arange(ps.df/oversampling, nyquist_factor*ps.nyquist, ps.df/oversampling, dtype='float64')
+		self._grid = {'f0': freq[0], 'df': freq[1] - freq[0], 'N': len(freq)}
+		self.frequency = freq * 1e6
+
+		# Indices of the frequencies which also lie on the standard frequency axis,
+		# used to keep the normalization factor updated as in powerspectrum:
+		Nstd = len(np.arange(ps.df, ps.nyquist, ps.df))
+		if float(oversampling).is_integer() and oversampling*Nstd <= len(freq):
+			self._standard = np.arange(oversampling-1, oversampling*Nstd, oversampling, dtype=int)
+		else:
+			self._standard = None
+
+		# Flux-independent terms, shared with all lightcurves with the same timestamps,
+		# and the flux-dependent sums of the centered flux:
+		self._timegrid = ps.timegrid
+		self._terms = self._timegrid.window_terms(self._grid['f0'], self._grid['df'], self._grid['N'])
+		self.flux = np.asarray(ps.ls.y, dtype='float64') - np.mean(ps.ls.y)
+		self._Sh, self._Ch = self._timegrid.trig_sum(self.flux/self.N, **self._grid)
+
+		# Sum of sinusoids removed since the sums were last updated:
+		self._pending = np.zeros(self.N, dtype='float64')
+
+	#----------------------------------------------------------------------------------------------
+	def subtract(self, a, b, freq):
+		"""
+		Remove sinusoid from the residual.
+
+		Parameters:
+			a (float): Amplitude of sine-component.
+			b (float): Amplitude of cosine-component.
+			freq (float): Frequency in microHz.
+		"""
+		self._pending += model(self.t/86400, a, b, freq)
+
+	#----------------------------------------------------------------------------------------------
+	def add(self, a, b, freq):
+		"""
+		Add sinusoid back into the residual.
+
+		Parameters:
+			a (float): Amplitude of sine-component.
+			b (float): Amplitude of cosine-component.
+			freq (float): Frequency in microHz.
+		"""
+		self._pending -= model(self.t/86400, a, b, freq)
+
+	#----------------------------------------------------------------------------------------------
+	def _update(self):
+		if not np.any(self._pending):
+			return
+		# Subtract the transform of the (centered) removed signal from the sums:
+		removed = self._pending - np.mean(self._pending)
+		Sm, Cm = self._timegrid.trig_sum(removed/self.N, **self._grid)
+		self._Sh -= Sm
+		self._Ch -= Cm
+		self.flux -= removed
+		self._pending[:] = 0
+
+	#----------------------------------------------------------------------------------------------
+	def powerspectrum(self, scale='power'):
+		"""
+		Power spectrum of the current residual.
+
+		Parameters:
+			scale (str, optional): 'power' or 'amplitude'. If None, the power is not scaled.
+				Default='power'.
+
+		Returns:
+			tuple: Tuple of two ndarray with frequencies in microHz and corresponding
+				power in units depending on the ``scale`` keyword.
+		"""
+		self._update()
+
+		power = power_from_sums(self._Sh, self._Ch, self._terms, self.N)
+
+		# Due to numerical errors, the "fast implementation" can return power < 0.
+		power = np.clip(power, 0, None)
+
+		# Normalization ensuring Parseval's theorem holds for the residual:
+		if self._standard is not None:
+			tot_lomb = np.sum(power[self._standard])
+			if tot_lomb > 0:
+				self.normfactor = np.sum(self.flux**2)/self.N / tot_lomb
+
+		if scale is None:
+			pass
+		elif scale == 'power':
+			power *= self.normfactor * 2
+		elif scale == 'amplitude':
+			power = np.sqrt(power*self.normfactor*2)
+
+		return self.frequency.copy(), power
+
+#--------------------------------------------------------------------------------------------------
+class noise_background(object):
+	"""
+	Frequency-dependent noise-floor of the residual power spectrum during pre-whitening.
+
+	The power spectrum is divided into bins in which the median power is calculated, and the
+	medians are interpolated linearly onto the frequency axis. Bins containing too few frequencies
+	are merged with their neighbours. Since the bins only depend on the frequency axis, they are
+	only determined once.
+
+	When a new power spectrum is given, the median is only recalculated in bins where the power
+	has changed by more than a fraction ``rtol`` of the median, since the median of a bin can
+	at most change by the largest change of the power within it.
+
+	Attributes:
+		frequency (ndarray): Frequency axis in microHz.
+		bins (ndarray): Centres of the bins in microHz.
+		rtol (float): Relative tolerance on the median in each bin.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+
+	def __init__(self, frequency, fmin, fmax, nbins=20, minpoints=20, rtol=1e-3):
+		"""
+		Parameters:
+			frequency (ndarray): Sorted frequency axis in microHz.
+			fmin (float): Lower edge of the first bin in microHz.
+			fmax (float): Upper edge of the last bin in microHz.
+			nbins (int, optional): Initial number of bin edges. Default=20.
+			minpoints (int, optional): Minimum number of frequencies in each bin. Default=20.
+			rtol (float, optional): Relative tolerance on the median in each bin. Default=1e-3.
+		"""
+
+		self.frequency = np.asarray(frequency, dtype='float64')
+		self.rtol = rtol
+
+		# Merge adjacent bins until all bins contain enough frequencies.
+		# This is only based on the number of frequencies in each bin, and so is done using
+		# counts, where the first and last elements are the frequencies outside the bins:
+		bins = np.linspace(fmin, fmax, nbins)
+		for _ in range(100):
+			edges = np.searchsorted(self.frequency, bins, side='left')
+			edges[-1] = np.searchsorted(self.frequency, bins[-1], side='right')
+			counts = np.diff(np.concatenate(([0], edges, [len(self.frequency)])))
+			counts = counts[:np.max(np.nonzero(counts)[0], initial=0)+1]
+			small = np.nonzero(counts < minpoints)[0]
+			if len(small) == 0 or len(bins) <= 2:
+				break
+			bins = np.delete(bins, min(small[0], len(bins)-1))
+
+		self.bins = bins[:-1] + 0.5*(bins[1:] - bins[:-1])
+		self._start = edges[:-1]
+		self._count = np.diff(edges)
+
+		# Power used to calculate the current median in each bin:
+		self._power = np.full_like(self.frequency, np.nan)
+		self._median = np.full(len(self.bins), np.nan)
+		self._background = None
+
+	#----------------------------------------------------------------------------------------------
+	def _binned_median(self, power, which):
+		# Indices of all frequencies in the selected bins, and the bin they belong to:
+		count = self._count[which]
+		offsets = np.cumsum(count) - count
+		binid = np.repeat(np.arange(len(count)), count)
+		indx = np.repeat(self._start[which] - offsets, count) + np.arange(np.sum(count))
+
+		# Sort within each bin and pick the middle element(s):
+		values = power[indx][np.lexsort((power[indx], binid))]
+		median = 0.5*(values[offsets + (count-1)//2] + values[offsets + count//2])
+		return median, indx
+
+	#----------------------------------------------------------------------------------------------
+	def __call__(self, power):
+		"""
+		Noise-floor of a power spectrum.
+
+		Parameters:
+			power (ndarray): Power spectrum on the frequency axis.
+
+		Returns:
+			ndarray: Median power interpolated onto the frequency axis. ``None`` if the median
+				could not be calculated in enough bins.
+		"""
+		# Find bins where the median may have changed:
+		nonempty = (self._count > 0)
+		with np.errstate(invalid='ignore'):
+			maxdiff = np.maximum.reduceat(np.abs(power - self._power), np.minimum(self._start, len(power)-1))
+			changed = nonempty & ~(maxdiff <= self.rtol*self._median)
+
+		if np.any(changed):
+			self._median[changed], indx = self._binned_median(power, changed)
+			self._power[indx] = power[indx]
+
+			indx = np.isfinite(self._median)
+			if np.sum(indx) > 2:
+				func = interp1d(self.bins[indx], self._median[indx], kind='linear', fill_value='extrapolate', assume_sorted=True)
+				self._background = func(self.frequency)
+			else:
+				self._background = None
+
+		return self._background
+
+#--------------------------------------------------------------------------------------------------
+class freqtable(object):
+	"""
+	Compact table of extracted frequencies.
+
+	The table is stored as a structured array with one row for each extracted peak and one
+	column for each harmonic, so individual peaks can be looked up directly from their peak
+	number and harmonic. Indexing with a column name returns the flattened column, in the same
+	order as the rows of the :class:`astropy.table.Table` returned by :func:`freqextr`, and any
+	other index (e.g. a boolean mask) is applied to the flattened rows.
+
+	Attributes:
+		data (ndarray): Structured array with shape ``(n_peaks, n_harmonics+1)``.
+		flux_unit (:class:`astropy.units.Unit`): Unit of the amplitude, alpha and beta columns.
+		meta (dict): Meta-information on how the table was created.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+
+	dtype = np.dtype([
+		('num', 'int32'),
+		('harmonic', 'int32'),
+		('frequency', 'float64'),
+		('amplitude', 'float64'),
+		('phase', 'float64'),
+		('alpha', 'float64'),
+		('beta', 'float64'),
+		('deviation', 'float64')
+	])
+
+	def __init__(self, n_peaks, n_harmonics, flux_unit=None, meta=None):
+		"""
+		Create table where all peaks are missing.
+
+		Parameters:
+			n_peaks (int): Number of peaks.
+			n_harmonics (int): Number of harmonics of each peak.
+			flux_unit (:class:`astropy.units.Unit`, optional): Unit of the amplitude, alpha and
+				beta columns.
+			meta (dict, optional): Meta-information. Default is to only store ``n_peaks`` and
+				``n_harmonics``.
+		"""
+		self.data = np.empty((n_peaks, n_harmonics+1), dtype=self.dtype)
+		self.data['num'] = np.arange(1, n_peaks+1)[:, np.newaxis]
+		self.data['harmonic'] = np.arange(n_harmonics+1)
+		for col in self.dtype.names[2:]:
+			self.data[col] = np.NaN
+		self.flux_unit = flux_unit
+		if meta is None:
+			meta = OrderedDict([('n_peaks', n_peaks), ('n_harmonics', n_harmonics)])
+		self.meta = meta
+
+	@property
+	def n_peaks(self):
+		return self.data.shape[0]
+
+	@property
+	def n_harmonics(self):
+		return self.data.shape[1] - 1
+
+	@property
+	def colnames(self):
+		return list(self.dtype.names)
+
+	def __len__(self):
+		return self.data.size
+
+	def __iter__(self):
+		return iter(self.data.ravel())
+
+	def __getitem__(self, key):
+		if isinstance(key, str):
+			return self.data[key].ravel()
+		return self.data.ravel()[key]
+
+	#----------------------------------------------------------------------------------------------
+	def peak(self, num, harmonic=0):
+		"""
+		Look up a single peak.
+
+		Parameters:
+			num (int): Peak number, starting from 1.
+			harmonic (int, optional): Harmonic number. Default is the main peak.
+
+		Returns:
+			:class:`numpy.void`: Row of the table.
+		"""
+		return self.data[num-1, harmonic]
+
+	#----------------------------------------------------------------------------------------------
+	def harmonics(self, num):
+		"""
+		Look up a peak and all its harmonics.
+
+		Parameters:
+			num (int): Peak number, starting from 1.
+
+		Returns:
+			ndarray: Rows of the table, starting with the main peak.
+		"""
+		return self.data[num-1]
+
+	#----------------------------------------------------------------------------------------------
+	def _keys(self):
+		return ['{0:d}'.format(num) if harmonic == 0 else '{0:d}_harmonic{1:d}'.format(num, harmonic)
+			for num, harmonic in zip(self['num'], self['harmonic'])]
+
+	#----------------------------------------------------------------------------------------------
+	def to_table(self):
+		"""
+		Convert to astropy table.
+
+		Returns:
+			:class:`astropy.table.Table`: Table in the format returned by :func:`freqextr`.
+		"""
+		tab = Table(
+			data=[self[col] for col in self.dtype.names],
+			names=self.dtype.names,
+			dtype=[self.dtype[col] for col in self.dtype.names],
+			meta=self.meta)
+
+		# Add units to columns:
+		tab['frequency'].unit = u.uHz
+		tab['amplitude'].unit = self.flux_unit
+		tab['phase'].unit = u.rad
+		tab['alpha'].unit = self.flux_unit
+		tab['beta'].unit = self.flux_unit
+		return tab
+
+	#----------------------------------------------------------------------------------------------
+	@classmethod
+	def from_table(cls, tab):
+		"""
+		Create from astropy table.
+
+		Parameters:
+			tab (:class:`astropy.table.Table`): Table in the format returned by :func:`freqextr`.
+
+		Returns:
+			:class:`freqtable`: Frequency table.
+		"""
+		num = np.asarray(tab['num'], dtype='int32')
+		harmonic = np.asarray(tab['harmonic'], dtype='int32')
+		ft = cls(np.max(num, initial=0), np.max(harmonic, initial=0),
+			flux_unit=tab['amplitude'].unit,
+			meta=OrderedDict(tab.meta))
+		for col in cls.dtype.names[2:]:
+			ft.data[col][num-1, harmonic] = tab[col]
+		return ft
+
+	#----------------------------------------------------------------------------------------------
+	def to_dict(self):
+		"""
+		Convert to features dictionary.
+
+		Returns:
+			dict: Dictionary with ``freq``, ``amp``, and ``phase`` keys.
+		"""
+		features = {}
+		for key, freq, amp, phase in zip(self._keys(), self['frequency'], self['amplitude'], self['phase']):
+			features['freq' + key] = freq
+			features['amp' + key] = amp
+			features['phase' + key] = phase
+		return features
+
+	#----------------------------------------------------------------------------------------------
+	@classmethod
+	def from_dict(cls, feat, n_peaks=None, n_harmonics=None, flux_unit=None):
+		"""
+		Create from features dictionary.
+
+		The ``deviation`` column will be all NaN, since it can not be recreated.
+
+		Parameters:
+			feat (dict): Dictionary of features.
+			n_peaks (int): If not provided, it will be determined from ``feat``.
+			n_harmonics (int): If not provided, it will be determined from ``feat``.
+			flux_unit (:class:`astropy.units.Unit`): Unit of the amplitude, alpha and beta columns.
+
+		Returns:
+			:class:`freqtable`: Frequency table.
+		"""
+		if n_peaks is None:
+			n_peaks = 0
+			while 'freq{0:d}'.format(n_peaks+1) in feat:
+				n_peaks += 1
+
+		if n_harmonics is None:
+			n_harmonics = 0
+			while 'freq1_harmonic{0:d}'.format(n_harmonics+1) in feat:
+				n_harmonics += 1
+
+		ft = cls(n_peaks, n_harmonics, flux_unit=flux_unit)
+		keys = ft._keys()
+		amp = np.array([feat.get('amp' + key, np.NaN) for key in keys], dtype='float64')
+		phase = np.array([feat.get('phase' + key, np.NaN) for key in keys], dtype='float64')
+		shape = ft.data.shape
+		ft.data['frequency'] = np.array([feat.get('freq' + key, np.NaN) for key in keys], dtype='float64').reshape(shape)
+		ft.data['amplitude'] = amp.reshape(shape)
+		ft.data['phase'] = phase.reshape(shape)
+		ft.data['alpha'] = (amp*np.cos(phase)).reshape(shape)
+		ft.data['beta'] = (amp*np.sin(phase)).reshape(shape)
+		return ft
+
 #--------------------------------------------------------------------------------------------------
 def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None, snr_width=None,
 	faplim=1-0.9973, devlim=0.5, conseclim=10, harmonics_list=None, Noptimize=10, optim_max_diff=10,
-	initps=None):
+	optim_method='sequential', search_method='full', initps=None, as_table=True):
 	r"""
 	Extract frequencies from timeseries.
 
@@ -75,13 +619,26 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 			Default is 10 uHz. Please note that this does not take the spectral windowfunction
 			into account, so this value may have to	be increased in cases where the windowfunction
 			has significant side-lobes.
+		optim_method (str, optional): Method used to re-optimize the previously found peaks.
+			With ``'sequential'`` the nearest peaks are re-optimized one at a time in the power
+			spectrum, as controlled by ``Noptimize`` and ``optim_max_diff``. With ``'joint'``
+			all extracted frequencies, amplitudes and phases are refitted simultaneously
+			using non-linear least-squares (see :func:`refit_sinusoids`), in which case only
+			``Noptimize=0`` has an effect, disabling the optimization. Default='sequential'.
+		search_method (str, optional): Method used to search for the highest peak. With
+			``'full'`` the power spectrum is searched on a grid oversampled by ``ofac``.
+			With ``'coarse'`` the power spectrum and noise-floor are calculated without
+			oversampling, and only narrow windows around the best candidates are
+			oversampled (see :func:`refine_candidates`). Default='full'.
 		initps (:class:`powerspectrum`, optional): Initial powerspectrum. Should be a powerspectrum
 			calculated from the provided lightcurve. This can be provided if the powerspectrum
 			has already been calculated. If not provided, it is calculated from the provided
 			lightcurve.
+		as_table (bool, optional): Return an astropy table. If ``False`` the compact
+			:class:`freqtable` is returned instead. Default=True.
 
 	Returns:
-		:class:`astropy.table.Table`: Table of extracted oscillations.
+		:class:`astropy.table.Table` or :class:`freqtable`: Table of extracted oscillations.
 
 	Note:
 		If the height of the peak of one of the harmonics are close to being insignificant,
@@ -102,6 +659,10 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 
 	if Noptimize is None:
 		Noptimize = 0
+	if optim_method not in ('sequential', 'joint'):
+		raise ValueError("Invalid optimization method")
+	if search_method not in ('full', 'coarse'):
+		raise ValueError("Invalid search method")
 
 	# If no list of harmonics is given, do the simple one:
 	if harmonics_list is None:
@@ -115,6 +676,7 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 
 	# Store original lightcurve and powerspectrum for later use:
 	original_lightcurve = lightcurve.copy()
+	finite = np.isfinite(original_lightcurve.flux)
 	if initps is None:
 		original_ps = powerspectrum(original_lightcurve)
 	else:
@@ -136,42 +698,28 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 	# The first powerspectrum has already been calculated:
 	ps = original_ps.copy()
 
+	# Power spectrum of the residual lightcurve used for searching for peaks.
+	# This is updated every time a sinusoid is removed from the lightcurve below:
+	# In the coarse search, this is not oversampled and the peaks are refined afterwards:
+	residual = residual_spectrum(original_ps, oversampling=1 if search_method == 'coarse' else ofac, nyquist_factor=hifac)
+
+	# Noise-floor of the residual spectrum, updated every time the residual changes:
+	if estimate_noise:
+		noise_floor = noise_background(residual.frequency, df, f_max)
+
 	for i in range(n_peaks):
 		logger.debug("-"*72)
 
 		# Calculate the powerspectrum and find the index of the largest power value
 		if i > 0:
-			ps = powerspectrum(lightcurve)
-		frequency, power = ps.powerspectrum(oversampling=ofac, nyquist_factor=hifac, scale='power')
+			ps = powerspectrum(lightcurve, parent=original_ps)
+		frequency, power = residual.powerspectrum(scale='power')
 
 		# Estimate a frequency-dependent noise-floor by binning the power spectrum.
 		if estimate_noise:
-			# Create bins to estimate noise level in:
-			#bins = np.logspace(np.floor(np.log10(df)), np.ceil(np.log10(f_max)), 20)
-			bins = np.linspace(df, f_max, 20)
-
-			# Calculate the median in the bins.
-			# Make sure we have at least 20 frequencies in each bin,
-			# otherwise combine adjacent bins until this is the case:
-			for _ in range(100):
-				mean_noise, bins, binindx = binned_statistic(frequency, power, bins=bins, statistic=median)
-
-				redo = False
-				for k, num in enumerate(np.bincount(binindx)):
-					if num < 20:
-						bins = np.delete(bins, k)
-						redo = True
-						break
-
-				if not redo:
-					break
-
-			bins = bins[:-1] + 0.5*(bins[1:] - bins[:-1])
-
-			indx = np.isfinite(mean_noise)
-			if np.sum(indx) > 2:
-				mean_noise_func = interp1d(bins[indx], mean_noise[indx], kind='linear', fill_value='extrapolate', assume_sorted=True)
-				mean_noise = power_median_to_mean * mean_noise_func(frequency)
+			background = noise_floor(power)
+			if background is not None:
+				mean_noise = power_median_to_mean * background
 				mean_noise = np.clip(mean_noise, 0, None)
 				mean_noise += 1 # Add one to avoid DivideByZero errors - only used for finding max
 			else:
@@ -185,10 +733,13 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 			#plt.show()
 
 		# Finds the frequency of the largest peak:
-		pmax_index = np.argmax(power / mean_noise)
-		fsearch = frequency[pmax_index]
-		if pmax_index > 0 and pmax_index < len(power)-1:
-			fsearch = [frequency[pmax_index-1], fsearch, frequency[pmax_index+1]]
+		if search_method == 'coarse':
+			fsearch = refine_candidates(ps, frequency, power / mean_noise, mean_noise, residual.normfactor, ofac)
+		else:
+			pmax_index = np.argmax(power / mean_noise)
+			fsearch = frequency[pmax_index]
+			if pmax_index > 0 and pmax_index < len(power)-1:
+				fsearch = [frequency[pmax_index-1], fsearch, frequency[pmax_index+1]]
 		nu[i,0] = ps.optimize_peak(fsearch)
 		alpha[i,0], beta[i,0] = ps.alpha_beta(nu[i,0])
 		logger.debug('Fundamental frequency: %f', nu[i,0])
@@ -244,6 +795,7 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 
 		# Removes the largest peak from the data:
 		lightcurve -= model(lightcurve.time, alpha[i,0], beta[i,0], nu[i,0])
+		residual.subtract(alpha[i,0], beta[i,0], nu[i,0])
 
 		# Loop through all harmonics:
 		for h in range(1, n_harmonics+1):
@@ -253,7 +805,7 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 				break
 
 			# Updates the flux and optimize to find the correct frequency
-			ps = powerspectrum(lightcurve)
+			ps = powerspectrum(lightcurve, parent=original_ps)
 
 			# Checks the significance of the harmonics. If it is too low NaN is returned in amplitude, frequency and phase for the given harmonic
 			nu[i,h] = ps.optimize_peak(n_harmonic*nu[i,0])
@@ -297,6 +849,7 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 			# Removes the harmonic peak from the data:
 			alpha[i,h], beta[i,h] = ps.alpha_beta(nu[i,h])
 			lightcurve -= model(lightcurve.time, alpha[i,h], beta[i,h], nu[i,h])
+			residual.subtract(alpha[i,h], beta[i,h], nu[i,h])
 
 			# Check how the extracted peak compares with the original powerspectrum and stops
 			# if there are to many consecutive failed peaks
@@ -304,8 +857,27 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 				atemp, btemp = original_ps.alpha_beta(nu[i,h])
 				deviation[i,h] = (alpha[i,h]**2 + beta[i,h]**2) / (atemp**2 + btemp**2)
 
+		# Refit all extracted peaks simultaneously:
+		if i != 0 and Noptimize != 0 and optim_method == 'joint':
+			indx = np.isfinite(alpha)
+			nu_new, alpha_new, beta_new = refit_sinusoids(original_lightcurve.time[finite],
+				original_lightcurve.flux[finite], nu[indx], alpha[indx], beta[indx])
+
+			# Replace the old sinusoids with the refitted ones:
+			for j, (nj, aj, bj) in enumerate(zip(nu[indx], alpha[indx], beta[indx])):
+				lightcurve += model(lightcurve.time, aj, bj, nj) - model(lightcurve.time, alpha_new[j], beta_new[j], nu_new[j])
+				residual.add(aj, bj, nj)
+				residual.subtract(alpha_new[j], beta_new[j], nu_new[j])
+			nu[indx], alpha[indx], beta[indx] = nu_new, alpha_new, beta_new
+
+			# Recalculate the deviations:
+			if devlim is not None:
+				for j in zip(*np.where(indx)):
+					atemp, btemp = original_ps.alpha_beta(nu[j])
+					deviation[j] = (alpha[j]**2 + beta[j]**2)/(atemp**2 + btemp**2)
+
 		# Optimize the Noptimize nearest peaks
-		if i != 0 and Noptimize != 0:
+		elif i != 0 and Noptimize != 0:
 			for h in range(n_harmonics+1):
 
 				# Sort to find nearest frequencies to optimize
@@ -336,7 +908,8 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 					if np.isfinite(alpha[j]): # and deviation[j] < 1/devlim and deviation[j] > devlim:
 						# Add the oscillation:
 						lightcurve += model(lightcurve.time, alpha[j], beta[j], nu[j])
-						ps = powerspectrum(lightcurve)
+						residual.add(alpha[j], beta[j], nu[j])
+						ps = powerspectrum(lightcurve, parent=original_ps)
 
 						# Find the frequency of maximum power and find alpha and beta again
 						nu[j] = ps.optimize_peak(nu[j])
@@ -349,6 +922,7 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 
 						# Remove the oscillation again:
 						lightcurve -= model(lightcurve.time, alpha[j], beta[j], nu[j])
+						residual.subtract(alpha[j], beta[j], nu[j])
 
 	# Remove anything that in the end was marked with a large deviation:
 	if devlim is not None:
@@ -381,35 +955,15 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 	amp[~np.isfinite(amp)] = np.nan
 
 	# Gather into table:
-	num, harmonic = np.meshgrid(range(1, n_peaks+1), range(n_harmonics+1))
-	tab = Table(
-		data=[
-			num.flatten(order='F'),
-			harmonic.flatten(order='F'),
-			nu.flatten(),
-			amp.flatten(),
-			phase.flatten(),
-			alpha.flatten(),
-			beta.flatten(),
-			deviation.flatten()
-		],
-		names=['num', 'harmonic', 'frequency', 'amplitude', 'phase', 'alpha', 'beta', 'deviation'],
-		dtype=['int32', 'int32', 'float64', 'float64', 'float64', 'float64', 'float64', 'float64'])
-
-	# Add units to columns:
-	tab['frequency'].unit = u.uHz
-	tab['amplitude'].unit = lightcurve.flux_unit
-	tab['phase'].unit = u.rad
-	tab['alpha'].unit = lightcurve.flux_unit
-	tab['beta'].unit = lightcurve.flux_unit
-
-	# Add index to peak number and harmonic for easy lookup:
-	# TODO: Use table indicies - Problem with Pickle
-	#tab.add_index('num')
+	tab = freqtable(n_peaks, n_harmonics, flux_unit=lightcurve.flux_unit)
+	tab.data['frequency'] = nu
+	tab.data['amplitude'] = amp
+	tab.data['phase'] = phase
+	tab.data['alpha'] = alpha
+	tab.data['beta'] = beta
+	tab.data['deviation'] = deviation
 
 	# Add meta data to table on how the list was created:
-	tab.meta['n_peaks'] = n_peaks
-	tab.meta['n_harmonics'] = n_harmonics
 	tab.meta['harmonics_list'] = harmonics_list
 	tab.meta['hifac'] = hifac
 	tab.meta['ofac'] = ofac
@@ -419,6 +973,8 @@ def freqextr(lightcurve, n_peaks=6, n_harmonics=0, hifac=1, ofac=4, snrlim=None,
 	tab.meta['devlim'] = devlim
 	tab.meta['conseclim'] = conseclim
 
+	if as_table:
+		return tab.to_table()
 	return tab
 
 #--------------------------------------------------------------------------------------------------
@@ -441,69 +997,7 @@ def freqextr_table_from_dict(feat, n_peaks=None, n_harmonics=None, flux_unit=Non
 
 	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 	"""
-
-	if n_peaks is None:
-		n_peaks = 0
-		while True:
-			n_peaks += 1
-			if 'freq{0:d}'.format(n_peaks) not in feat:
-				n_peaks -= 1
-				break
-
-	if n_harmonics is None:
-		n_harmonics = 0
-		while True:
-			n_harmonics += 1
-			if 'freq1_harmonic{0:d}'.format(n_harmonics) not in feat:
-				n_harmonics -= 1
-				break
-
-	rows = []
-	for num, harmonic in itertools.product(range(1, n_peaks+1), range(n_harmonics+1)):
-		if harmonic == 0:
-			key = '{0:d}'.format(num)
-		else:
-			key = '{0:d}_harmonic{1:d}'.format(num, harmonic)
-
-		amp = feat.get('amp' + key, np.NaN)
-		freq = feat.get('freq' + key, np.NaN)
-		phase = feat.get('phase' + key, np.NaN)
-		rows.append([
-			num,
-			harmonic,
-			freq,
-			amp,
-			phase,
-			amp*np.cos(phase),
-			amp*np.sin(phase),
-			np.NaN # There is no way to recover this information
-		])
-
-	tab = Table(
-		rows=rows,
-		names=['num', 'harmonic', 'frequency', 'amplitude', 'phase', 'alpha', 'beta', 'deviation'],
-		dtype=['int32', 'int32', 'float64', 'float64', 'float64', 'float64', 'float64', 'float64'])
-
-	# Add units to columns:
-	tab['frequency'].unit = u.uHz
-	tab['amplitude'].unit = flux_unit
-	tab['phase'].unit = u.rad
-	tab['alpha'].unit = flux_unit
-	tab['beta'].unit = flux_unit
-
-	# Add meta data to table on how the list was created:
-	tab.meta['n_peaks'] = n_peaks
-	tab.meta['n_harmonics'] = n_harmonics
-	#tab.meta['harmonics_list'] = harmonics_list
-	#tab.meta['hifac'] = hifac
-	#tab.meta['ofac'] = ofac
-	#tab.meta['snrlim'] = snrlim
-	#tab.meta['snr_width'] = snr_width * u.uHz
-	#tab.meta['faplim'] = faplim
-	#tab.meta['devlim'] = devlim
-	#tab.meta['conseclim'] = conseclim
-
-	return tab
+	return freqtable.from_dict(feat, n_peaks=n_peaks, n_harmonics=n_harmonics, flux_unit=flux_unit).to_table()
 
 #--------------------------------------------------------------------------------------------------
 def freqextr_table_to_dict(tab):
@@ -514,22 +1008,13 @@ def freqextr_table_to_dict(tab):
 	Please not that this operation does not conserve all information from the table.
 
 	Parameters:
-		tab (:class:`astropy.table.Table`): Table extracted by :func:`freqextr`.
+		tab (:class:`astropy.table.Table` or :class:`freqtable`): Table extracted by :func:`freqextr`.
 
 	Returns:
 		dict: Dictionary with frequencies, amplitudes and phases.
 
 	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 	"""
-	features = {}
-	for row in tab:
-		if row['harmonic'] == 0:
-			key = '{0:d}'.format(row['num'])
-		else:
-			key = '{0:d}_harmonic{1:d}'.format(row['num'], row['harmonic'])
-
-		features['freq' + key] = row['frequency']
-		features['amp' + key] = row['amplitude']
-		features['phase' + key] = row['phase']
-
-	return features
+	if not isinstance(tab, freqtable):
+		tab = freqtable.from_table(tab)
+	return tab.to_dict()
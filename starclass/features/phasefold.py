@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Phase-folding and binning of lightcurves, shared by the RF-GC and SORTING-HAT classifiers.
+
+.. codeauthor:: David Armstrong <d.j.armstrong@warwick.ac.uk>
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import numpy as np
+
+#--------------------------------------------------------------------------------------------------
+def phasefold(time, per, t0=0):
+	"""
+	Phase-fold timestamps.
+
+	Parameters:
+		time (ndarray): Timestamps.
+		per (float or ndarray): Period to fold with. If an array of periods is given, the
+			phases for each period are returned along the first axis.
+		t0 (float, optional): Reference time.
+
+	Returns:
+		ndarray: Phases between 0 and 1.
+	"""
+	per = np.asarray(per)
+	if per.ndim > 0:
+		per = per[:, np.newaxis]
+	return np.mod(time-t0,per)/per
+
+#--------------------------------------------------------------------------------------------------
+def _group_median(values, group, counts, starts):
+	# Median of values in each group, by sorting on the value and then the group.
+	# Using the smallest possible integer type for the groups allows a faster sort:
+	order = np.argsort(values)
+	group = group.astype(np.min_scalar_type(len(counts)), copy=False)
+	order = order[np.argsort(group[order], kind='stable')]
+	svalues = values[order]
+	with np.errstate(invalid='ignore'):
+		lower = svalues[np.clip(starts + (counts-1)//2, 0, max(len(values)-1, 0))]
+		upper = svalues[np.clip(starts + counts//2, 0, max(len(values)-1, 0))]
+	return 0.5*(lower + upper)
+
+#--------------------------------------------------------------------------------------------------
+def binPhaseLC(phase, flux, nbins, cut_outliers=0):
+	"""
+	Bins a lightcurve, typically phase-folded.
+
+	All bins are calculated together by counting the points in each bin, and when cutting
+	outliers, by sorting the points on their bin and flux to find the median and MAD of
+	every bin at once.
+
+	Inputs
+	-----------------
+	phase: 			ndarray, N or (M, N)
+		Phase data (could use a time array instead). If 2D, each row is binned separately,
+		e.g. phases from folding with M different periods.
+	flux:			ndarray, N
+		Flux data
+	nbins:			int
+		Number of bins to use
+	cut_outliers:	float
+		If not zero, cuts outliers where (difference to median)/MAD > cut_outliers
+
+	Returns
+	-----------------
+	binnedlc:		ndarray, (nbins, 2) or (M, nbins, 2)
+		Array of (bin phases, binned fluxes)
+
+	.. codeauthor:: David Armstrong <d.j.armstrong@warwick.ac.uk>
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	phase = np.asarray(phase)
+	flux = np.asarray(flux, dtype='float64')
+	nrows = 1 if phase.ndim == 1 else phase.shape[0]
+
+	bin_edges = np.arange(nbins)/float(nbins)
+	bin_indices = np.digitize(phase, bin_edges) - 1
+
+	# Give the bins of the different rows consecutive numbers, and ignore points before
+	# the first bin:
+	inside = (bin_indices >= 0)
+	group = (bin_indices + nbins*np.arange(nrows).reshape(-1, 1)).ravel()[inside.ravel()]
+	values = np.broadcast_to(flux, phase.shape).ravel()[inside.ravel()]
+	counts = np.bincount(group, minlength=nrows*nbins)
+
+	keep = np.ones(len(values), dtype='bool')
+	if cut_outliers and len(values) > 0:
+		starts = np.cumsum(counts) - counts
+		median = _group_median(values, group, counts, starts)[group]
+		absdev = np.abs(values - median)
+		mad = _group_median(absdev, group, counts, starts)[group]
+		with np.errstate(invalid='ignore', divide='ignore'):
+			keep = (absdev/mad <= cut_outliers) | (counts[group] <= 2)
+
+	kept = np.bincount(group[keep], minlength=nrows*nbins)
+	sums = np.bincount(group[keep], weights=values[keep], minlength=nrows*nbins)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		binned = sums / kept
+
+	#bit awkward this, but only alternative is to interpolate?
+	binned[counts == 0] = np.mean(flux)
+
+	binnedlc = np.zeros([nrows, nbins, 2])
+	#fixes phase of all bins - means ignoring locations of points in bin
+	binnedlc[:, :, 0] = 1./nbins * 0.5 + bin_edges
+	binnedlc[:, :, 1] = binned.reshape(nrows, nbins)
+	if phase.ndim == 1:
+		return binnedlc[0]
+	return binnedlc
+
+#--------------------------------------------------------------------------------------------------
+def EBperiod(time, flux, per, cut_outliers=0, linflatten=True):
+	"""
+	Tests for phase variation at double the current prime period,
+	to correct EB periods.
+
+	Inputs
+	-----------------
+	time
+	flux
+	per: 			float
+		Period to phasefold self.lc at.
+	cut_outliers:	float
+		outliers ignored if difference from median in bin divided by the MAD is
+		greater than cut_outliers.
+
+	Returns
+	-----------------
+	corrected period: float
+		Either initial period or double
+
+	.. codeauthor:: David Armstrong <d.j.armstrong@warwick.ac.uk>
+	"""
+	if per < 0:
+		return per
+	if linflatten:
+		flux_flat = flux - np.polyval(np.polyfit(time,flux,1),time) + 1
+	else:
+		flux_flat = flux
+
+	phaselc2P = phasefold(time,per*2)
+	binnedlc2P = binPhaseLC(phaselc2P, flux_flat, 64, cut_outliers=5) # ADD OUTLIER CUTS?
+
+	minima = np.argmin(binnedlc2P[:,1])
+	posssecondary = np.mod(np.abs(binnedlc2P[:,0]-np.mod(binnedlc2P[minima,0]+0.5,1.)),1.)
+	#within 0.05 either side of phase 0.5 from minima
+	posssecondary = np.where((posssecondary < 0.05) | (posssecondary > 0.95))[0]
+
+	pointsort = np.sort(flux_flat)
+	top10points = np.median(pointsort[-30:])
+	bottom10points = np.median(pointsort[:30])
+
+	periodlim = (np.max(time) - np.min(time))/2. # no effective limit, could be changed
+	if np.min(binnedlc2P[posssecondary,1]) - binnedlc2P[minima,1] > 0.0025 \
+		and np.min(binnedlc2P[posssecondary,1]) - binnedlc2P[minima,1] \
+		> 0.03*(top10points-bottom10points) \
+		and per*2 <= periodlim:
+		return 2*per
+	else:
+		return per
+
+#--------------------------------------------------------------------------------------------------
+def prepFilePhasefold(time, flux, period, cardinality):
+	"""
+	Prepares a lightcurve for using with the SOM.
+
+	Inputs
+	-----------------
+	time
+	flux
+	period: 			float
+		Period to phasefold self.lc at
+	cardinality:		int
+		Number of bins used in SOM
+
+	Returns
+	-----------------
+	binnedlc:		ndarray, (cardinality, 2)
+		Array of (bin phases, binned fluxes)
+	range:			float
+		Max - Min if binned lightcurve
+
+	.. codeauthor:: David Armstrong <d.j.armstrong@warwick.ac.uk>
+	"""
+	phase = phasefold(time,period)
+	binnedlc = binPhaseLC(phase,flux,cardinality)
+	#normalise to between 0 and 1
+	minflux = np.min(binnedlc[:,1])
+	maxflux = np.max(binnedlc[:,1])
+	if maxflux != minflux:
+		binnedlc[:,1] = (binnedlc[:,1]-minflux) / (maxflux-minflux)
+	else:
+		binnedlc[:,1] = np.ones(cardinality)
+	#offset so minimum is at phase 0
+	binnedlc[:,0] = np.mod(binnedlc[:,0]-binnedlc[np.argmin(binnedlc[:,1]),0],1)
+	binnedlc = binnedlc[np.argsort(binnedlc[:,0]),:]
+	return binnedlc[:,1], maxflux-minflux
@@ -9,14 +9,22 @@ import numpy as np
 import matplotlib.pyplot as plt
 import lightkurve
 import os.path
+import hashlib
+import threading
+from collections import OrderedDict
 from copy import deepcopy
 try:
 	from astropy.timeseries import LombScargle
+	from astropy.timeseries.periodograms.lombscargle.implementations.utils import trig_sum
 except ImportError:
 	from astropy.stats import LombScargle
+	from astropy.stats.lombscargle.implementations.utils import trig_sum
 from bottleneck import nanmedian, nanmean, nanmax, nanmin
 from scipy.optimize import minimize_scalar
 from scipy.integrate import simps
+from scipy.sparse import csr_matrix
+from scipy.special import factorial
+from scipy.fft import next_fast_len
 
 class powerspectrum(object):
 	"""
@@ -32,49 +40,108 @@ class powerspectrum(object):
 	"""
 
 	#----------------------------------------------------------------------------------------------
-	def __init__(self, lightcurve, fit_mean=False):
+	def __init__(self, lightcurve, fit_mean=False, parent=None):
 		"""
 		Parameters:
 			lightcurve (:class:`lightkurve.LightCurve`): Lightcurve to estimate power spectrum for.
 			fit_mean (boolean, optional):
+			parent (:class:`powerspectrum`, optional): Power spectrum of a lightcurve with the
+				same timestamps, typically before any signals were removed from it.
+				If provided, ``df``, ``nyquist`` and ``normfactor`` are taken from the parent,
+				and the standard power density spectrum is only calculated when requested.
 		"""
 
 		# Store the input settings:
 		self.fit_mean = fit_mean
-
-		# Calculate standard properties of the timeseries:
-		indx = np.isfinite(lightcurve.flux)
-		self.df = 1/(86400*(nanmax(lightcurve.time[indx]) - nanmin(lightcurve.time[indx]))) # Hz
-		self.nyquist = 1/(2*86400*nanmedian(np.diff(lightcurve.time[indx]))) # Hz
-		self.standard = None
+		self._standard = None
+		self._timegrid = None
 
 		# Create LombScargle object of timeseries, where time is in seconds:
+		indx = np.isfinite(lightcurve.flux)
 		self.ls = LombScargle(lightcurve.time[indx]*86400, lightcurve.flux[indx], center_data=True,
 			fit_mean=self.fit_mean)
 
-		# Calculate a better estimate of the fundamental frequency spacing:
-		self.df = self.fundamental_spacing_integral()
+		# Residual power spectrum, where all properties only depending on the
+		# timestamps are taken directly from the parent:
+		if parent is not None:
+			self._timegrid = parent._timegrid
+			self.df = parent.df
+			self.nyquist = parent.nyquist
+			self.normfactor = parent.normfactor
+			return
+
+		# Properties only depending on the timestamps are shared between
+		# all lightcurves with the same timestamps:
+		cadenceno = getattr(lightcurve, 'cadenceno', None)
+		if cadenceno is not None:
+			cadenceno = np.asarray(cadenceno)[indx]
+		self._timegrid = grid_cache.get(self.ls.t, fit_mean=self.fit_mean, cadenceno=cadenceno)
+
+		# Calculate standard properties of the timeseries:
+		if self._timegrid.df is None:
+			self.df = 1/(86400*(nanmax(lightcurve.time[indx]) - nanmin(lightcurve.time[indx]))) # Hz
+			self.nyquist = 1/(2*86400*nanmedian(np.diff(lightcurve.time[indx]))) # Hz
+
+			# Calculate a better estimate of the fundamental frequency spacing:
+			self.df = self.fundamental_spacing_integral()
+
+			self._timegrid.nyquist = self.nyquist
+			self._timegrid.df = self.df
+		else:
+			self.df = self._timegrid.df
+			self.nyquist = self._timegrid.nyquist
 
 		# Calculate standard power density spectrum:
 		# Start by calculating a complete un-scaled power spectrum:
-		self.standard = self.powerspectrum(oversampling=1, nyquist_factor=1, scale=None)
+		standard = self.powerspectrum(oversampling=1, nyquist_factor=1, scale=None)
 
 		# Use the un-scaled power spectrum to finding the normalisation factor
 		# which will ensure that Parseval's theorem holds:
 		N = len(self.ls.t)
 		tot_MS = np.sum((self.ls.y - nanmean(self.ls.y))**2)/N
-		tot_lomb = np.sum(self.standard[1])
+		tot_lomb = np.sum(standard[1])
 		self.normfactor = tot_MS/tot_lomb
 
 		# Re-scale the standard power spectrum to being in power density:
-		self.standard = list(self.standard)
-		self.standard[1] *= self.normfactor/(self.df*1e6)
-		self.standard = tuple(self.standard)
+		self._standard = (standard[0], standard[1] * self.normfactor/(self.df*1e6))
+
+	#----------------------------------------------------------------------------------------------
+	@property
+	def standard(self):
+		"""Frequency in microHz and power density spectrum from 0 to ``nyquist``."""
+		if self._standard is None:
+			self._standard = self.powerspectrum(oversampling=1, nyquist_factor=1, scale='powerdensity')
+		return self._standard
+
+	#----------------------------------------------------------------------------------------------
+	@property
+	def timegrid(self):
+		""":class:`timegrid` with the properties shared by lightcurves with the same timestamps."""
+		if self._timegrid is None:
+			self._timegrid = grid_cache.get(self.ls.t, fit_mean=self.fit_mean)
+		return self._timegrid
+
+	#----------------------------------------------------------------------------------------------
+	def __getstate__(self):
+		# The time grid is shared with other power spectra, and is therefore not stored:
+		state = self.__dict__.copy()
+		state['_timegrid'] = None
+		return state
+
+	#----------------------------------------------------------------------------------------------
+	def __setstate__(self, state):
+		# Power spectra pickled before the standard spectrum was made lazy:
+		if 'standard' in state:
+			state['_standard'] = state.pop('standard')
+		state.setdefault('_timegrid', None)
+		self.__dict__.update(state)
 
 	#----------------------------------------------------------------------------------------------
 	def copy(self):
 		"""Create copy of power spectrum."""
-		return deepcopy(self)
+		ps = deepcopy(self)
+		ps._timegrid = self._timegrid
+		return ps
 
 	#----------------------------------------------------------------------------------------------
 	def fundamental_spacing_minimum(self):
@@ -125,14 +192,26 @@ class powerspectrum(object):
 		if freq is None:
 			# If what we are really asking for is the standard power density spectrum, we have already
 			# calculated it in the init-function, so just return that:
-			if scale == 'powerdensity' and oversampling == 1 and nyquist_factor == 1 and self.standard:
-				return self.standard
+			if scale == 'powerdensity' and oversampling == 1 and nyquist_factor == 1 and self._standard is not None:
+				return self._standard
 			# Set the standard frequency axis:
 			freq = np.arange(self.df/oversampling, nyquist_factor*self.nyquist, self.df/oversampling, dtype='float64')
 			assume_regular_frequency = True
 
-		# Calculate power at frequencies using fast Lomb-Scargle periodiogram:
-		power = self.ls.power(freq, normalization='psd', method='fast', assume_regular_frequency=assume_regular_frequency)
+		# Calculate power at frequencies using fast Lomb-Scargle periodiogram.
+		# On the regular frequency axis, the flux-independent terms are taken from the time grid,
+		# which also calculates the sums with a bounded error if the timestamps are close to
+		# a regular cadence grid:
+		if assume_regular_frequency and not self.fit_mean and len(freq) > 1:
+			f0, fstep, Nf = freq[0], freq[1] - freq[0], len(freq)
+			terms = self.timegrid.window_terms(f0, fstep, Nf)
+			N = len(self.ls.t)
+			w = np.full(N, 1/N)
+			y = self.ls.y - np.dot(w, self.ls.y)
+			Sh, Ch = self.timegrid.trig_sum(w*y, fstep, Nf, f0=f0)
+			power = power_from_sums(Sh, Ch, terms, N)
+		else:
+			power = self.ls.power(freq, normalization='psd', method='fast', assume_regular_frequency=assume_regular_frequency)
 
 		# Due to numerical errors, the "fast implementation" can return power < 0.
 		power = np.clip(power, 0, None)
@@ -207,7 +286,8 @@ class powerspectrum(object):
 		Optimize frequency to nearest peak.
 
 		Parameters:
-			fmax (float): Frequency in microHz.
+			fmax (float): Frequency in microHz. Can also be a list of three frequencies
+				``[freq_low, fmax, freq_high]`` bracketing the peak.
 
 		Returns:
 			float: Optimized frequency in microHz.
@@ -216,32 +296,146 @@ class powerspectrum(object):
 		fmax = np.atleast_1d(fmax)
 		if len(fmax) == 3:
 			freq_low, fmax, freq_high = fmax
-		else:
-			fmax = fmax[0]
+			return self.optimize_peaks(fmax, freq_low=freq_low, freq_high=freq_high)[0]
+		return self.optimize_peaks(fmax[0])[0]
+
+	#----------------------------------------------------------------------------------------------
+	def optimize_peaks(self, fmax, freq_low=None, freq_high=None, xatol=1e-5, maxiter=100):
+		"""
+		Optimize several frequencies to their nearest peaks simultaneously.
+
+		The power is evaluated directly (see :func:`lombscargle_direct`) on a grid covering
+		the search interval of each peak, after which the maxima are refined using successive
+		parabolic interpolation. All peaks are refined together in vectorised calls.
+
+		Parameters:
+			fmax (ndarray): Frequencies in microHz.
+			freq_low (ndarray, optional): Lower limits of the search intervals in microHz.
+				Default is two times ``df`` below ``fmax``.
+			freq_high (ndarray, optional): Upper limits of the search intervals in microHz.
+				Default is two times ``df`` above ``fmax``.
+			xatol (float, optional): Absolute tolerance on the frequencies in microHz.
+			maxiter (int, optional): Maximum number of refinement iterations.
+
+		Returns:
+			ndarray: Optimized frequencies in microHz.
+		"""
+		fmax = np.atleast_1d(np.asarray(fmax, dtype='float64'))
+		if freq_low is None and freq_high is None:
+			# Without a given bracket, search a grid around the frequency:
 			freq_low = fmax - 2*self.df*1e6
 			freq_high = fmax + 2*self.df*1e6
+			ngrid = 17
+		else:
+			freq_low = np.broadcast_to(fmax - 2*self.df*1e6 if freq_low is None else freq_low, fmax.shape)
+			freq_high = np.broadcast_to(fmax + 2*self.df*1e6 if freq_high is None else freq_high, fmax.shape)
+			ngrid = 3
 
 		# Do not optimize too low to zero:
 		freq_low = np.clip(freq_low, 0.25*self.df*1e6, None)
+		freq_high = np.maximum(freq_high, freq_low)
+
+		power = lambda f: self.power_direct(f*1e-6)
+
+		# Initial grid, which for a bracket also includes the given frequency:
+		grid = np.linspace(freq_low, freq_high, ngrid, axis=-1)
+		if ngrid == 3:
+			grid[:, 1] = np.clip(fmax, freq_low, freq_high)
+		pgrid = power(grid)
+		rows = np.arange(len(fmax))
+
+		# Choose the local maximum on the grid which is nearest to the given frequency:
+		padded = np.pad(pgrid, ((0, 0), (1, 1)), mode='constant', constant_values=-np.inf)
+		local_max = (pgrid >= padded[:, :-2]) & (pgrid >= padded[:, 2:])
+		distance = np.where(local_max, np.abs(grid - fmax[:, np.newaxis]), np.inf)
+		k = np.argmin(distance, axis=1)
+
+		# Bracket around the maximum on the grid:
+		interior = (k > 0) & (k < ngrid-1)
+		a, b, c = grid[rows, np.clip(k-1, 0, None)], grid[rows, k], grid[rows, np.clip(k+1, None, ngrid-1)]
+		pa, pb, pc = pgrid[rows, np.clip(k-1, 0, None)], pgrid[rows, k], pgrid[rows, np.clip(k+1, None, ngrid-1)]
+
+		# If the maximum is at the edge of the grid, the peak is either between the edge and
+		# its neighbour or at the edge itself. Bisect towards the edge until a maximum is
+		# bracketed, or until we are within the tolerance of the edge:
+		edge, pedge = b.copy(), pb.copy()
+		inner = np.where(k == 0, c, a)
+		pinner = np.where(k == 0, pc, pa)
+		for _ in range(maxiter):
+			ie = np.where(~interior & (np.abs(edge - inner) > 2*xatol))[0]
+			if len(ie) == 0:
+				break
+			m = 0.5*(inner[ie] + edge[ie])
+			pm = power(m[:, np.newaxis])[:, 0]
+			found = (pm >= pedge[ie])
+			interior[ie] = found
+
+			# Bracket the maximum between the inner point and the edge:
+			right = (k[ie] > 0)
+			a[ie] = np.where(right, inner[ie], edge[ie])
+			pa[ie] = np.where(right, pinner[ie], pedge[ie])
+			c[ie] = np.where(right, edge[ie], inner[ie])
+			pc[ie] = np.where(right, pedge[ie], pinner[ie])
+			b[ie], pb[ie] = m, pm
+
+			# Otherwise move the inner point towards the edge:
+			inner[ie] = np.where(found, inner[ie], m)
+			pinner[ie] = np.where(found, pinner[ie], pm)
+
+		active = interior.copy()
+
+		# Successive parabolic interpolation of the peaks:
+		golden = 0.5*(3 - np.sqrt(5))
+		for _ in range(maxiter):
+			active &= (c - a > 2*xatol)
+			if not np.any(active):
+				break
+			ia = np.where(active)[0]
+			A, B, C = a[ia], b[ia], c[ia]
+			PA, PB, PC = pa[ia], pb[ia], pc[ia]
+
+			# Vertex of the parabola through the three points:
+			num = (B - A)**2*(PB - PC) - (B - C)**2*(PB - PA)
+			den = (B - A)*(PB - PC) - (B - C)*(PB - PA)
+			with np.errstate(divide='ignore', invalid='ignore'):
+				v = B - 0.5*num/den
+
+			# Fall back to golden-section steps where the parabola can not be trusted:
+			bad = ~np.isfinite(v) | (v <= A) | (v >= C) | (np.abs(v - B) < 0.5*xatol)
+			gs = np.where(C - B > B - A, B + golden*(C - B), B - golden*(B - A))
+			v = np.where(bad, gs, v)
+			pv = power(v[:, np.newaxis])[:, 0]
+
+			# Update the brackets:
+			right = (v > B)
+			better = (pv >= PB)
+			a[ia] = np.where(better, np.where(right, B, A), np.where(right, A, v))
+			pa[ia] = np.where(better, np.where(right, PB, PA), np.where(right, PA, pv))
+			c[ia] = np.where(better, np.where(right, C, B), np.where(right, v, C))
+			pc[ia] = np.where(better, np.where(right, PC, PB), np.where(right, pv, PC))
+			b[ia] = np.where(better, v, B)
+			pb[ia] = np.where(better, pv, PB)
 
-		# Optimize to find the correct frequency
-		func = lambda f: -self.ls.power(f*1e-6, method='fast', normalization='psd', assume_regular_frequency=False)
+			# Stop when the parabolic steps become smaller than the tolerance:
+			active[ia] &= bad | (np.abs(v - B) >= xatol)
 
-		#res = minimize(func, fmax, bounds=((freq_low, freq_high),), method='TNC')
-		#return res.x[0]
+		return np.where(interior, b, edge)
 
-		res = minimize_scalar(func, bracket=[freq_low, fmax, freq_high], bounds=(freq_low, freq_high), method='bounded', options={'xatol': 1e-5})
-		#print(res)
+	#----------------------------------------------------------------------------------------------
+	def power_direct(self, freq):
+		"""
+		Un-scaled power evaluated directly at the given frequencies.
 
-		#x = np.linspace(freq_low-10*self.df*1e6, freq_high+10*self.df*1e6, 200)
-		#plt.figure()
-		#plt.plot(x, func(x), 'k-', lw=0.5)
-		#plt.axvline(fmax)
-		#plt.axvline(freq_low)
-		#plt.axvline(freq_high)
-		#plt.plot(res.x, res.fun, 'ro')
+		Parameters:
+			freq (ndarray): Frequencies in Hz. Can be multi-dimensional.
 
-		return res.x
+		Returns:
+			ndarray: Power with the same normalization as ``powerspectrum(scale=None)``.
+		"""
+		if self.fit_mean:
+			freq = np.asarray(freq, dtype='float64')
+			return self.ls.power(freq.ravel(), method='slow', normalization='psd').reshape(freq.shape)
+		return lombscargle_direct(self.ls.t, self.ls.y, freq)
 
 	#----------------------------------------------------------------------------------------------
 	def alpha_beta(self, freq):
@@ -301,3 +495,642 @@ class powerspectrum(object):
 		# Create LombScargle object of timeseries, where time is in seconds:
 		indx = np.isfinite(lightcurve.flux)
 		self.ls = LombScargle(lightcurve.time[indx]*86400, lightcurve.flux[indx], center_data=True, fit_mean=self.fit_mean)
+		self._timegrid = None
+
+#--------------------------------------------------------------------------------------------------
+def window_terms(t, f0, df, Nf):
+	"""
+	Flux-independent terms of the fast Lomb-Scargle periodogram.
+
+	These only depend on the timestamps and the frequency grid, and can therefore
+	be reused for any flux sampled at the same timestamps.
+
+	Parameters:
+		t (ndarray): Timestamps in seconds.
+		f0 (float): First frequency of the grid in Hz.
+		df (float): Spacing of the frequency grid in Hz.
+		Nf (int): Number of frequencies in the grid.
+
+	Returns:
+		tuple: Tuple of four ndarrays (``Cw``, ``Sw``, ``CC``, ``SS``) to be passed to
+			:func:`power_from_sums`.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	w = np.full(len(t), 1/len(t))
+	S2, C2 = trig_sum(t, w, df, Nf, f0=f0, freq_factor=2)
+	return window_terms_from_sums(S2, C2)
+
+#--------------------------------------------------------------------------------------------------
+def window_terms_from_sums(S2, C2):
+	"""
+	Flux-independent terms of the fast Lomb-Scargle periodogram from the trigonometric sums.
+
+	Parameters:
+		S2 (ndarray): Sum of ``sin(4*pi*f*t)/N`` for each frequency.
+		C2 (ndarray): Sum of ``cos(4*pi*f*t)/N`` for each frequency.
+
+	Returns:
+		tuple: Tuple of four ndarrays (``Cw``, ``Sw``, ``CC``, ``SS``) to be passed to
+			:func:`power_from_sums`.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	# Same trigonometric identities as used by astropy (fit_mean=False):
+	tan_2omega_tau = S2 / C2
+	S2w = tan_2omega_tau / np.sqrt(1 + tan_2omega_tau * tan_2omega_tau)
+	C2w = 1 / np.sqrt(1 + tan_2omega_tau * tan_2omega_tau)
+	Cw = np.sqrt(0.5) * np.sqrt(1 + C2w)
+	Sw = np.sqrt(0.5) * np.sign(S2w) * np.sqrt(1 - C2w)
+	CC = 0.5 * (1 + C2 * C2w + S2 * S2w)
+	SS = 0.5 * (1 - C2 * C2w - S2 * S2w)
+	return Cw, Sw, CC, SS
+
+#--------------------------------------------------------------------------------------------------
+def power_from_sums(Sh, Ch, terms, N):
+	"""
+	Lomb-Scargle power from the flux-dependent trigonometric sums.
+
+	Parameters:
+		Sh (ndarray): Sum of ``y*sin(2*pi*f*t)/N`` for each frequency.
+		Ch (ndarray): Sum of ``y*cos(2*pi*f*t)/N`` for each frequency.
+		terms (tuple): Flux-independent terms as returned by :func:`window_terms`.
+		N (int): Number of data points.
+
+	Returns:
+		ndarray: Un-scaled power with the same normalization as
+			``LombScargle.power(normalization='psd')``.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	Cw, Sw, CC, SS = terms
+	YC = Ch * Cw + Sh * Sw
+	YS = Sh * Cw - Ch * Sw
+	return 0.5 * N * (YC * YC / CC + YS * YS / SS)
+
+#--------------------------------------------------------------------------------------------------
+def regular_cadence(t, cadenceno=None, tolerance=0.2):
+	"""
+	Place timestamps on a regular cadence grid, possibly with gaps.
+
+	Timestamps which have been corrected to the barycentre deviate from a regular grid
+	by several seconds over a sector. These deviations are returned as offsets from the grid,
+	which are corrected for by :func:`trig_sum_regular`.
+
+	Parameters:
+		t (ndarray): Timestamps in seconds.
+		cadenceno (ndarray, optional): Cadence numbers of the timestamps. If not provided,
+			or if they are not all finite, the cadence numbers are derived from the timestamps.
+		tolerance (float, optional): Maximal allowed deviation of the timestamps from the
+			regular grid, relative to the cadence. Larger offsets require more terms in the
+			correction done by :func:`trig_sum_regular`. Default=0.2.
+
+	Returns:
+		tuple or None: Tuple of the index of each timestamp on the grid, the first point
+			on the grid and the cadence in seconds, and the offset of each timestamp from the grid
+			in seconds, such that ``t = t0 + index*cadence + offset``. None if the timestamps
+			can not be placed on a regular grid.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	t = np.asarray(t, dtype='float64')
+	if len(t) < 3:
+		return None
+
+	if cadenceno is not None and np.all(np.isfinite(cadenceno)):
+		index = np.asarray(cadenceno, dtype='int64')
+		index = index - index[0]
+	else:
+		cadence = np.median(np.diff(t))
+		if not np.isfinite(cadence) or cadence <= 0:
+			return None
+		index = np.asarray(np.round((t - t[0])/cadence), dtype='int64')
+		# Refine the cadence, since the offsets make the median interval inaccurate:
+		cadence, t0 = np.polyfit(index, t, 1)
+		if not np.isfinite(cadence) or cadence <= 0:
+			return None
+		index = np.asarray(np.round((t - t0)/cadence), dtype='int64')
+		index = index - index[0]
+
+	# The grid should be strictly increasing, and not be mostly empty:
+	if np.any(np.diff(index) <= 0) or index[-1] >= 4*len(t):
+		return None
+
+	# Fit the regular grid to the timestamps and check that they are close to it:
+	cadence, t0 = np.polyfit(index, t, 1)
+	offset = t - (t0 + cadence*index)
+	if cadence <= 0 or np.max(np.abs(offset)) > tolerance*cadence:
+		return None
+
+	return index, t0, cadence, offset
+
+#--------------------------------------------------------------------------------------------------
+def taylor_order(x, accuracy):
+	"""
+	Number of terms needed in the Taylor series of ``exp(i*y)`` for ``|y| <= x``.
+
+	The remainder of the series truncated after order ``P`` is bounded by ``x**(P+1)/(P+1)!``.
+
+	Parameters:
+		x (float): Maximal absolute value of the argument.
+		accuracy (float): Maximal allowed remainder.
+
+	Returns:
+		int: Order ``P`` of the truncated series.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	order = 0
+	remainder = x
+	while remainder > accuracy:
+		order += 1
+		remainder *= x/(order + 1)
+	return order
+
+#--------------------------------------------------------------------------------------------------
+def regular_chirps(n, t0, cadence, df, N, f0=0):
+	"""
+	Chirps used by :func:`trig_sum_regular`.
+
+	The chirps only depend on the cadence grid and the frequency grid, and can therefore
+	be reused for all sums on the same grids.
+
+	Parameters:
+		n (int): Number of points on the cadence grid.
+		t0 (float): Timestamp of the first point on the grid in seconds.
+		cadence (float): Cadence in seconds.
+		df (float): Frequency spacing in Hz.
+		N (int): Number of frequencies.
+		f0 (float, optional): Lowest frequency in Hz. Default=0.
+
+	Returns:
+		tuple: Chirp applied on the cadence grid, Fourier transform of the convolution
+			kernel and chirp applied on the frequency grid.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	# Phases are calculated in cycles and wrapped to keep the precision:
+	phi = df*cadence
+	k = np.arange(n, dtype='float64')
+	j = np.arange(N, dtype='float64')
+	pre = np.exp(2j*np.pi*np.mod(f0*cadence*k + 0.5*phi*k*k, 1))
+
+	L = next_fast_len(n + N - 1)
+	m = np.concatenate((j, np.arange(-(L - N), 0, dtype='float64')))
+	kernel = np.fft.fft(np.exp(-2j*np.pi*np.mod(0.5*phi*m*m, 1)))
+
+	# Also shift the time reference from the first point on the grid to zero:
+	freq = f0 + df*np.arange(N)
+	post = np.exp(2j*np.pi*np.mod(0.5*phi*j*j + freq*t0, 1))
+	return pre, kernel, post
+
+#--------------------------------------------------------------------------------------------------
+def trig_sum_regular(h, index, t0, cadence, df, N, f0=0, freq_factor=1, offset=None, accuracy=1e-6, chirps=None):
+	"""
+	Trigonometric sums for timestamps close to a regular cadence grid.
+
+	The weights are placed on the full cadence grid, with zeros in the gaps, and the
+	discrete Fourier transform is evaluated directly on the requested frequency grid
+	using the chirp-z (Bluestein) algorithm.
+
+	The offsets ``delta`` of the timestamps from the grid are corrected for using a Taylor
+	series in ``2*pi*(f - fc)*delta``, where ``fc`` is the centre of the frequency grid,
+	which requires one additional transform for each order of the series. The order is
+	chosen such that the error of the sums is below ``accuracy*sum(abs(h))``. Unlike the
+	extirpolation used by ``trig_sum``, the error therefore has a known bound, and the sums
+	are exact to rounding errors if the timestamps are on the grid.
+
+	Parameters:
+		h (ndarray): Weights for the sums. Can be 2D, with one row for each set of sums.
+		index (ndarray): Index of each timestamp on the cadence grid.
+		t0 (float): Timestamp of the first point on the grid in seconds.
+		cadence (float): Cadence in seconds.
+		df (float): Frequency spacing in Hz.
+		N (int): Number of frequencies.
+		f0 (float, optional): Lowest frequency in Hz. Default=0.
+		freq_factor (float, optional): Factor which multiplies the frequency. Default=1.
+		offset (ndarray, optional): Offset of each timestamp from the grid in seconds,
+			as returned by :func:`regular_cadence`. Default is no offsets.
+		accuracy (float, optional): Bound on the error of the sums relative to the sum
+			of the absolute weights. Default=1e-6.
+		chirps (tuple, optional): Chirps as returned by :func:`regular_chirps` for the
+			grids (including ``freq_factor``). Calculated if not provided.
+
+	Returns:
+		tuple: ``S`` and ``C`` with the same meaning as returned by ``trig_sum``.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	df *= freq_factor
+	f0 *= freq_factor
+	h = np.asarray(h)
+	n = index[-1] + 1
+	if chirps is None:
+		chirps = regular_chirps(n, t0, cadence, df, N, f0=f0)
+	pre, kernel, post = chirps
+
+	# Order of the Taylor series needed to correct for the offsets:
+	halfwidth = 0.5*df*(N - 1)
+	fc = f0 + halfwidth
+	order = 0
+	if offset is not None:
+		order = taylor_order(2*np.pi*halfwidth*np.max(np.abs(offset)), accuracy)
+
+	# Zero-filled weights on the cadence grid for each order of the series.
+	# The offsets at the centre of the frequency grid are applied directly on the weights:
+	x = np.zeros((order + 1,) + h.shape[:-1] + (n,), dtype='complex128')
+	if offset is None:
+		x[0][..., index] = h
+	else:
+		x[0][..., index] = h * np.exp(2j*np.pi*np.mod(fc*offset, 1))
+		u = 2*np.pi*halfwidth*offset
+		for p in range(1, order + 1):
+			x[p][..., index] = x[p-1][..., index] * (u/p)
+	x *= pre
+
+	# Convolution with the chirp, done using FFTs:
+	X = np.fft.ifft(np.fft.fft(x, len(kernel), axis=-1) * kernel, axis=-1)[..., :N]
+
+	# Sum the Taylor series using Horner's method:
+	Y = X[order]
+	if order > 0:
+		r = 1j*(np.arange(N) - 0.5*(N - 1))/(0.5*(N - 1))
+		for p in range(order - 1, -1, -1):
+			Y = Y*r + X[p]
+	Y *= post
+
+	return Y.imag, Y.real
+
+#--------------------------------------------------------------------------------------------------
+class timegrid(object):
+	"""
+	Properties of a timeseries which only depend on the timestamps.
+
+	Attributes:
+		t (ndarray): Timestamps in seconds.
+		fit_mean (boolean): Whether the properties are for a fitted mean.
+		df (float): Fundamental frequency spacing in Hz. None until calculated.
+		nyquist (float): Nyquist frequency in Hz. None until calculated.
+		cadence (tuple): Position of the timestamps on a regular cadence grid as returned by
+			:func:`regular_cadence`. None if the timestamps are not close to a regular grid.
+		maxgrids (int): Maximal number of frequency grids to keep window terms for.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+
+	def __init__(self, t, fit_mean=False, cadenceno=None, maxgrids=2):
+		self.t = t
+		self.fit_mean = fit_mean
+		self.df = None
+		self.nyquist = None
+		self.cadence = regular_cadence(t, cadenceno)
+		self.maxgrids = maxgrids
+		self._terms = OrderedDict()
+		self._chirps = OrderedDict()
+		self._lock = threading.Lock()
+
+	#----------------------------------------------------------------------------------------------
+	def _cached(self, store, key, func):
+		# Keep the result for the most recently used frequency grids:
+		with self._lock:
+			value = store.get(key)
+			if value is not None:
+				store.move_to_end(key)
+				return value
+
+		value = func()
+		if self.maxgrids > 0:
+			with self._lock:
+				store[key] = value
+				while len(store) > self.maxgrids:
+					store.popitem(last=False)
+		return value
+
+	#----------------------------------------------------------------------------------------------
+	def trig_sum(self, h, df, N, f0=0, freq_factor=1):
+		"""
+		Trigonometric sums on a regular frequency grid.
+
+		For timestamps close to a regular cadence grid (with gaps) the sums are calculated
+		using :func:`trig_sum_regular`, otherwise the ``trig_sum`` from astropy is used.
+
+		Parameters:
+			h (ndarray): Weights for the sums. Can be 2D, with one row for each set of sums.
+			df (float): Frequency spacing in Hz.
+			N (int): Number of frequencies.
+			f0 (float, optional): Lowest frequency in Hz. Default=0.
+			freq_factor (float, optional): Factor which multiplies the frequency. Default=1.
+
+		Returns:
+			tuple: ``S`` and ``C`` with the same meaning as returned by ``trig_sum``.
+		"""
+		if self.cadence is None:
+			if np.ndim(h) > 1:
+				return trig_sum_batch(self.t, h, df, N, f0=f0, freq_factor=freq_factor)
+			return trig_sum(self.t, h, df, N, f0=f0, freq_factor=freq_factor)
+
+		index, t0, cadence, offset = self.cadence
+		chirps = self._cached(self._chirps, (f0*freq_factor, df*freq_factor, N),
+			lambda: regular_chirps(index[-1] + 1, t0, cadence, df*freq_factor, N, f0=f0*freq_factor))
+		return trig_sum_regular(h, index, t0, cadence, df, N, f0=f0, freq_factor=freq_factor,
+			offset=offset, chirps=chirps)
+
+	#----------------------------------------------------------------------------------------------
+	def window_terms(self, f0, df, Nf):
+		"""
+		Flux-independent terms of the fast Lomb-Scargle periodogram on a regular frequency grid.
+
+		The terms are calculated as in :func:`window_terms` and kept for the most recently
+		used frequency grids.
+
+		Parameters:
+			f0 (float): First frequency of the grid in Hz.
+			df (float): Spacing of the frequency grid in Hz.
+			Nf (int): Number of frequencies in the grid.
+
+		Returns:
+			tuple: Tuple of four ndarrays to be passed to :func:`power_from_sums`.
+		"""
+		w = np.full(len(self.t), 1/len(self.t))
+		return self._cached(self._terms, (f0, df, Nf),
+			lambda: window_terms_from_sums(*self.trig_sum(w, df, Nf, f0=f0, freq_factor=2)))
+
+#--------------------------------------------------------------------------------------------------
+class timegrid_cache(object):
+	"""
+	Cache of :class:`timegrid` shared between lightcurves with identical timestamps.
+
+	Lightcurves of targets observed in the same sector and camera all share the same
+	timestamps, which means that the fundamental spacing, Nyquist frequency and the
+	flux-independent terms of the periodogram only need to be calculated once.
+	Time grids are identified by a hash of the timestamps, and the least recently
+	used grids are discarded when the cache is full.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+
+	def __init__(self, maxsize=8):
+		"""
+		Parameters:
+			maxsize (int, optional): Maximal number of time grids to keep. Setting this to
+				zero disables the cache. Default=8.
+		"""
+		self.maxsize = maxsize
+		self._grids = OrderedDict()
+		self._lock = threading.Lock()
+
+	#----------------------------------------------------------------------------------------------
+	def __len__(self):
+		return len(self._grids)
+
+	#----------------------------------------------------------------------------------------------
+	def get(self, t, fit_mean=False, cadenceno=None):
+		"""
+		Time grid for the given timestamps.
+
+		Parameters:
+			t (ndarray): Timestamps in seconds.
+			fit_mean (boolean, optional):
+			cadenceno (ndarray, optional): Cadence numbers of the timestamps, used to
+				place the timestamps on a regular cadence grid.
+
+		Returns:
+			:class:`timegrid`: Time grid, which is shared with all other lightcurves
+				with identical timestamps.
+		"""
+		t = np.ascontiguousarray(t, dtype='float64')
+		if self.maxsize <= 0:
+			return timegrid(t, fit_mean=fit_mean, cadenceno=cadenceno)
+
+		key = (hashlib.sha1(t).hexdigest(), len(t), fit_mean)
+		with self._lock:
+			grid = self._grids.get(key)
+			if grid is not None:
+				self._grids.move_to_end(key)
+				return grid
+
+			grid = timegrid(t, fit_mean=fit_mean, cadenceno=cadenceno)
+			self._grids[key] = grid
+			while len(self._grids) > self.maxsize:
+				self._grids.popitem(last=False)
+		return grid
+
+	#----------------------------------------------------------------------------------------------
+	def clear(self):
+		"""Remove all time grids from the cache."""
+		with self._lock:
+			self._grids.clear()
+
+#--------------------------------------------------------------------------------------------------
+grid_cache = timegrid_cache()
+
+#--------------------------------------------------------------------------------------------------
+def extirpolation_matrix(x, N, M=4):
+	"""
+	Sparse matrix extirpolating values at the abscissas ``x`` onto the integer grid ``range(N)``.
+
+	Multiplying the matrix with a vector of ordinates gives the same result as astropy's
+	``extirpolate(x, y, N, M)``, but the weights only depend on the abscissas and can
+	therefore be applied to many sets of ordinates at once.
+
+	Parameters:
+		x (ndarray): Abscissas.
+		N (int): Number of integer bins.
+		M (int, optional): Number of adjoining points to extirpolate on. Default=4.
+
+	Returns:
+		:class:`scipy.sparse.csr_matrix`: Matrix of shape ``(N, len(x))``.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	x = np.asarray(x, dtype='float64')
+	Npoints = len(x)
+	cols = np.arange(Npoints)
+
+	# Points which are exactly on the grid only contribute to that point:
+	integers = (x % 1 == 0)
+	rows = [x[integers].astype(int)]
+	columns = [cols[integers]]
+	weights = [np.ones(np.sum(integers))]
+	x, cols = x[~integers], cols[~integers]
+
+	# Lagrange polynomial weights on the M nearest points, as in astropy:
+	ilo = np.clip((x - M // 2).astype(int), 0, N - M)
+	numerator = np.prod(x - ilo - np.arange(M)[:, np.newaxis], 0)
+	denominator = factorial(M - 1)
+	for j in range(M):
+		if j > 0:
+			denominator *= j / (j - M)
+		ind = ilo + (M - 1 - j)
+		rows.append(ind)
+		columns.append(cols)
+		weights.append(numerator / (denominator * (x - ind)))
+
+	rows = np.concatenate(rows)
+	columns = np.concatenate(columns)
+	weights = np.concatenate(weights)
+	return csr_matrix((weights, (rows, columns)), shape=(N, Npoints))
+
+#--------------------------------------------------------------------------------------------------
+def trig_sum_batch(t, h, df, N, f0=0, freq_factor=1, oversampling=5, Mfft=4):
+	"""
+	Trigonometric sums for several sets of weights sharing the same timestamps.
+
+	Equivalent to calling astropy's ``trig_sum`` with ``use_fft=True`` for each row of ``h``,
+	but the extirpolation onto the FFT grid is only set up once, and all the FFTs are done
+	in one call.
+
+	Parameters:
+		t (ndarray): Timestamps.
+		h (ndarray): 2D array of weights with one row for each set of sums.
+		df (float): Frequency spacing.
+		N (int): Number of frequencies.
+		f0 (float, optional): Lowest frequency. Default=0.
+		freq_factor (float, optional): Factor which multiplies the frequency. Default=1.
+		oversampling (int, optional): Oversampling of the FFT grid. Default=5.
+		Mfft (int, optional): Number of adjacent points used in the extirpolation. Default=4.
+
+	Returns:
+		tuple: 2D arrays ``S`` and ``C``, with one row for each row in ``h``.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	df *= freq_factor
+	f0 *= freq_factor
+	t = np.asarray(t, dtype='float64')
+	h = np.atleast_2d(h)
+
+	# Required size of fft is the power of 2 above the oversampling rate:
+	Nfft = 1 << int(np.ceil(np.log2(N * oversampling)))
+	t0 = t.min()
+
+	if f0 > 0:
+		h = h * np.exp(2j * np.pi * f0 * (t - t0))
+
+	tnorm = ((t - t0) * Nfft * df) % Nfft
+	grid = extirpolation_matrix(tnorm, Nfft, int(Mfft)).dot(h.T)
+
+	fftgrid = np.fft.ifft(grid, axis=0)[:N].T
+	if t0 != 0:
+		f = f0 + df * np.arange(N)
+		fftgrid *= np.exp(2j * np.pi * t0 * f)
+
+	C = Nfft * fftgrid.real
+	S = Nfft * fftgrid.imag
+	return S, C
+
+#--------------------------------------------------------------------------------------------------
+def standard_powerspectra(time, flux):
+	"""
+	Standard power density spectra for many stars observed at the same timestamps.
+
+	The result for each star is equivalent to ``powerspectrum(lightcurve).standard``.
+	Stars with the same missing data points share the same frequency axis, and
+	their spectra are calculated together in one vectorised pass.
+
+	Parameters:
+		time (ndarray): Timestamps in days common to all stars.
+		flux (ndarray): 2D array of fluxes with one row for each star.
+			Missing data points should be NaN.
+
+	Returns:
+		list: List with one tuple for each star, containing the frequency in microHz and
+			corresponding power density, in the same format as :attr:`powerspectrum.standard`.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	time = np.asarray(time, dtype='float64')
+	flux = np.atleast_2d(np.asarray(flux, dtype='float64'))
+	if flux.shape[1] != len(time):
+		raise ValueError("Flux must have one column for each timestamp")
+
+	# Group the stars which have the same valid data points:
+	finite = np.isfinite(flux)
+	groups = OrderedDict()
+	for r, key in enumerate(np.packbits(finite, axis=1)):
+		groups.setdefault(key.tobytes(), []).append(r)
+
+	results = [None]*flux.shape[0]
+	for rows in groups.values():
+		rows = np.asarray(rows, dtype=int)
+		indx = finite[rows[0]]
+
+		# Let the first star of the group set up the time grid,
+		# which is then shared with the rest of the stars:
+		ps = powerspectrum(lightkurve.LightCurve(time=time[indx], flux=flux[rows[0], indx]))
+		results[rows[0]] = ps.standard
+		rows = rows[1:]
+		if len(rows) == 0:
+			continue
+
+		# Frequency axis and flux-independent terms, as in powerspectrum.powerspectrum:
+		freq = np.arange(ps.df, ps.nyquist, ps.df, dtype='float64')
+		f0, fstep, Nf = freq[0], freq[1] - freq[0], len(freq)
+		terms = ps.timegrid.window_terms(f0, fstep, Nf)
+
+		# Calculate un-scaled power spectra of all the centered lightcurves:
+		N = len(ps.ls.t)
+		w = np.full(N, 1/N)
+		y = flux[np.ix_(rows, indx)]
+		y = y - np.dot(y, w)[:, np.newaxis]
+		Sh, Ch = ps.timegrid.trig_sum(w*y, fstep, Nf, f0=f0)
+		power = np.clip(power_from_sums(Sh, Ch, terms, N), 0, None)
+
+		# Normalize to power density, ensuring that Parseval's theorem holds:
+		tot_MS = np.sum(y**2, axis=1)/N
+		normfactor = tot_MS/np.sum(power, axis=1)
+		power *= normfactor[:, np.newaxis]/(ps.df*1e6)
+
+		# All stars in the group share the frequency axis:
+		for k, r in enumerate(rows):
+			results[r] = (ps.standard[0], power[k, :])
+
+	return results
+
+#--------------------------------------------------------------------------------------------------
+def lombscargle_direct(t, y, freq, blocksize=2**16):
+	"""
+	Lomb-Scargle power evaluated directly at arbitrary frequencies.
+
+	The sums are calculated exactly in :math:`O(N)` operations per frequency, which for few
+	frequencies is a lot faster than the FFT-based method. The result is the same as
+	``LombScargle.power(normalization='psd')`` with ``fit_mean=False`` and ``center_data=True``.
+
+	Parameters:
+		t (ndarray): Timestamps in seconds.
+		y (ndarray): Flux.
+		freq (ndarray): Frequencies in Hz. Can be multi-dimensional.
+		blocksize (int, optional): Maximal number of elements in temporary arrays.
+
+	Returns:
+		ndarray: Power at the frequencies, with the same shape as ``freq``.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	freq = np.asarray(freq, dtype='float64')
+	t = np.asarray(t, dtype='float64')
+	N = len(t)
+
+	# The power does not depend on the time reference, so use the first
+	# timestamp to keep the precision of the phases:
+	t = t - t[0]
+	y = np.asarray(y, dtype='float64')
+	y = (y - np.mean(y))/N
+
+	f = freq.ravel()
+	Sh = np.empty_like(f)
+	Ch = np.empty_like(f)
+	S2 = np.empty_like(f)
+	C2 = np.empty_like(f)
+	step = max(1, blocksize // N)
+	for i in range(0, len(f), step):
+		omegat = (2*np.pi) * np.outer(f[i:i+step], t)
+		s = np.sin(omegat)
+		c = np.cos(omegat)
+		Sh[i:i+step] = np.dot(s, y)
+		Ch[i:i+step] = np.dot(c, y)
+		S2[i:i+step] = 2*np.sum(s*c, axis=1)/N
+		C2[i:i+step] = np.sum((c - s)*(c + s), axis=1)/N
+
+	power = power_from_sums(Sh, Ch, window_terms_from_sums(S2, C2), N)
+	return power.reshape(freq.shape)
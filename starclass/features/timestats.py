@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time-domain statistics of lightcurves, shared by the different classifiers.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import numpy as np
+from scipy.stats import shapiro
+
+# Coefficients of the sigmoid correction for the fill-factor of the lightcurve,
+# for each order of the higher order crossings:
+hoc_sigmoid_coeffs = np.array([
+	3.625418060200669,
+	5.250836120401338,
+	7.117056856187291,
+	8.862876254180602,
+	10.608695652173914,
+	12.234113712374581])
+
+# Normalized number of crossings of Gaussian noise for each order:
+hoc_zc_gauss = np.array([0.49912, 0.666367, 0.732079, 0.769869, 0.795083, 0.81284,
+	0.827098, 0.838291, 0.847576, 0.855565, 0.862341, 0.868062,
+	0.873031, 0.877556, 0.881678])
+
+#: Names of the statistics returned by :func:`timeseries_statistics`.
+statistics_keys = ('skewness', 'kurtosis', 'shapiro_wilk', 'eta', 'Rcs',
+	'p2p_98_lc', 'p2p_mean_lc', 'psi', 'zc', 'flux_ratio')
+
+#--------------------------------------------------------------------------------------------------
+def higher_order_crossings(time, flux, k=5):
+	"""
+	Compute higher order crossings (HOC).
+
+	Parameters:
+		time (ndarray): Timestamps.
+		flux (ndarray): Flux.
+		k (int, optional): Number of k crossings to compute (inclusive). Default=5.
+
+	Returns:
+		tuple:
+			- psi (float): Deviation of the crossings from the crossings of Gaussian noise.
+			- zc (ndarray): Normalized number of crossings for each order.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	y = flux - np.median(flux)
+	N = len(y)
+
+	# Fraction of the timespan which is covered by data:
+	cadence = np.median(np.diff(time))
+	fill = np.sum(np.isfinite(time)) / ((time[-1] - time[0]) / cadence)
+
+	# Sigmoid correction factors for the fill-factor:
+	t = hoc_sigmoid_coeffs[:k]
+	sigmoid = lambda x: (1 / (1 + np.exp(-t*x))) - 0.5
+	correction = sigmoid(fill) / sigmoid(1)
+
+	# Count sign-changes of the successive differences of the lightcurve:
+	crossings = np.empty(k)
+	for i in range(k):
+		if i > 0:
+			y = np.diff(y)
+		positive = (y >= 0)
+		crossings[i] = np.count_nonzero(positive[1:] != positive[:-1])
+	zc = crossings / (N - np.arange(k)) / correction
+
+	delta_k = np.concatenate((zc[:1], np.diff(zc)))
+	delta_k_gauss = np.concatenate((hoc_zc_gauss[:1], np.diff(hoc_zc_gauss[:k])))
+	psi = np.sum((delta_k - delta_k_gauss)**2 / delta_k_gauss)
+	return psi, zc
+
+#--------------------------------------------------------------------------------------------------
+def timeseries_statistics(time, flux, flux_err=None, hoc_order=5, shapiro_max_points=None):
+	"""
+	Time-domain statistics of a lightcurve.
+
+	All the statistics are calculated from the same centered flux and point-to-point
+	differences, which are only computed once.
+
+	Parameters:
+		time (ndarray): Timestamps.
+		flux (ndarray): Flux. Should not contain NaN.
+		flux_err (ndarray, optional): Flux uncertainties, used for the weighted mean in ``eta``.
+			If not provided, ``eta`` is NaN.
+		hoc_order (int, optional): Number of orders of higher order crossings. Default=5.
+		shapiro_max_points (int, optional): If the lightcurve contains more points than this,
+			the Shapiro-Wilk statistic is calculated from a fixed random subset of this
+			many points. Default is to use all points.
+
+	Returns:
+		dict: Dictionary with the following statistics:
+
+			- ``skewness``: Skewness of the flux.
+			- ``kurtosis``: Kurtosis (Fisher) of the flux.
+			- ``shapiro_wilk``: Shapiro-Wilk test statistic for normality.
+			- ``eta``: Von Neumann ratio of point-to-point differences to weighted variance.
+			- ``Rcs``: Range of cumulative sum.
+			- ``p2p_98_lc``: 98th percentile of point-to-point differences.
+			- ``p2p_mean_lc``: Mean of point-to-point differences.
+			- ``psi``: Higher order crossings compared to Gaussian noise.
+			- ``zc``: Normalized number of zero-crossings.
+			- ``flux_ratio``: Ratio of fluxes below and above the mean (Kim & Bailer-Jones, 2016).
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	time = np.asarray(time, dtype='float64')
+	flux = np.asarray(flux, dtype='float64')
+	N = len(flux)
+
+	# Central moments:
+	mean = np.mean(flux)
+	d = flux - mean
+	d2 = d**2
+	m2 = np.mean(d2)
+	m3 = np.mean(d2*d)
+	m4 = np.mean(d2*d2)
+	sigma = np.sqrt(m2)
+
+	# Point-to-point differences:
+	diff = np.diff(flux)
+	p2p = np.abs(diff)
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		# Von Neumann ratio with weighted variance:
+		if flux_err is None:
+			eta = np.NaN
+		else:
+			weight = 1. / np.asarray(flux_err, dtype='float64')
+			weighted_sum = np.sum(weight)
+			weighted_mean = np.sum(flux * weight) / weighted_sum
+			std = np.sqrt(np.sum((flux - weighted_mean)**2 * weight) / weighted_sum)
+			eta = np.sum(diff * diff) / (N - 1.) / std / std
+
+		# Range of cumulative sum:
+		s = np.cumsum(d) / (N * sigma)
+		Rcs = np.max(s) - np.min(s) if N > 0 else np.NaN
+
+		# Flux ratio of points below and above the mean:
+		lower = (d < 0)
+		lower_sum = np.sum(d2[lower]) / np.count_nonzero(lower)
+		higher_sum = np.sum(d2[~lower]) / np.count_nonzero(~lower)
+		flux_ratio = np.log(np.sqrt(lower_sum / higher_sum))
+
+	# Shapiro-Wilk test, optionally on a random subset of the points:
+	if N < 3:
+		shapiro_wilk = np.NaN
+	elif shapiro_max_points is not None and N > shapiro_max_points:
+		rng = np.random.RandomState(42)
+		subset = np.sort(rng.choice(N, shapiro_max_points, replace=False))
+		shapiro_wilk = shapiro(flux[subset])[0]
+	else:
+		shapiro_wilk = shapiro(flux)[0]
+
+	if N > hoc_order:
+		psi, zc = higher_order_crossings(time, flux, hoc_order)
+		zc = zc[0]
+	else:
+		psi = zc = np.NaN
+
+	return {
+		'skewness': m3 / m2**1.5 if m2 > 0 else 0.0,
+		'kurtosis': (m4 / m2**2 if m2 > 0 else 0.0) - 3.0,
+		'shapiro_wilk': shapiro_wilk,
+		'eta': eta,
+		'Rcs': Rcs,
+		'p2p_98_lc': np.percentile(p2p, 98) if N > 1 else np.NaN,
+		'p2p_mean_lc': np.mean(p2p) if N > 1 else np.NaN,
+		'psi': psi,
+		'zc': zc,
+		'flux_ratio': flux_ratio
+	}
+
+#--------------------------------------------------------------------------------------------------
+def lightcurve_statistics(lc, features=None):
+	"""
+	Time-domain statistics of a lightcurve.
+
+	If the statistics are already available in the provided features, e.g. because they were
+	calculated by :meth:`BaseClassifier.load_star`, these are returned instead of calculating
+	them again.
+
+	Parameters:
+		lc (:class:`lightkurve.LightCurve`): Lightcurve in relative flux without NaNs.
+		features (dict, optional): Features of the star.
+
+	Returns:
+		dict: Statistics as returned by :func:`timeseries_statistics`.
+
+	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+	"""
+	if features is not None and all(key in features for key in statistics_keys):
+		return features
+	return timeseries_statistics(lc.time, lc.flux, lc.flux_err)
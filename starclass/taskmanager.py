@@ -10,18 +10,29 @@ import numpy as np
 import os
 import sqlite3
 import logging
+import itertools
+import threading
+from collections import OrderedDict, defaultdict, deque
+from timeit import default_timer
+from urllib.request import pathname2url
 from astropy.table import Table
 from . import STATUS
 from .constants import classifier_list
 from .version import get_version
 
+#: Table recording features which have never been stored for a star in the MOAT tables.
+#: This happens for stars saved before a feature was added to the table, and is kept
+#: separate from the MOAT tables, where NULL is used for features calculated as NaN.
+MOAT_MISSING_TABLE = 'starclass_moat_missing'
+
 #--------------------------------------------------------------------------------------------------
 class TaskManager(object):
 	"""
 	A TaskManager which keeps track of which targets to process.
 	"""
 
-	def __init__(self, todo_file, cleanup=False, readonly=False, overwrite=False, classes=None):
+	def __init__(self, todo_file, cleanup=False, readonly=False, overwrite=False, classes=None,
+		async_save=False, save_batch_size=100, save_interval=10.0):
 		"""
 		Initialize the TaskManager which keeps track of which targets to process.
 
@@ -29,12 +40,22 @@ class TaskManager(object):
 			todo_file (str): Path to the TODO-file.
 			cleanup (bool): Perform cleanup/optimization of TODO-file before
 				doing initialization. Default=False.
+			readonly (bool): Open the TODO-file in read-only mode. The TODO-file can be read
+				while another TaskManager is writing to it, but no results can be saved.
+				Default=False.
 			overwrite (bool): Overwrite any previously calculated results. Default=False.
 			classes (Enum): Possible stellar classes. This is only used for for translating
 				saved stellar classes in the ``other_classifiers`` table into proper enums.
+			async_save (bool): Buffer started tasks and results, and write them to the
+				TODO-file in a background thread. See :meth:`flush`. Default=False.
+			save_batch_size (int): With ``async_save``, write the buffer when it contains
+				this many started tasks and results. Default=100.
+			save_interval (float): With ``async_save``, write the buffer when the oldest
+				entry in it is this many seconds old. Default=10.
 
 		Raises:
 			FileNotFoundError: If TODO-file could not be found.
+			ValueError: If ``readonly`` is combined with ``overwrite`` or ``async_save``.
 		"""
 
 		if os.path.isdir(todo_file):
@@ -48,6 +69,22 @@ class TaskManager(object):
 		self.tset = None
 		self.input_folder = os.path.abspath(os.path.dirname(todo_file))
 		self._moat_tables = {}
+		self._moat_missing = False
+		self._moat_analyze = False
+		self._stars = None
+		self._queue = None
+		self._pending = None
+		self.async_save = async_save
+		self.save_batch_size = save_batch_size
+		self.save_interval = save_interval
+		self._lock = threading.RLock()
+		self._buffer_cond = threading.Condition()
+		self._buffer_starts = []
+		self._buffer_results = []
+		self._buffer_time = None
+		self._writer = None
+		self._writer_stop = False
+		self._writer_error = None
 
 		# Keep a list of all the possible classifiers here:
 		self.all_classifiers = list(classifier_list)
@@ -62,20 +99,23 @@ class TaskManager(object):
 		self.logger.addHandler(console)
 		self.logger.setLevel(logging.INFO)
 
+		if readonly and (overwrite or async_save):
+			raise ValueError("Read-only TaskManager can not be used with overwrite or async_save")
+
 		# Load the SQLite file:
-		#if self.readonly:
-		#	self.conn = sqlite3.connect('file:' + todo_file + '?mode=ro', uri=True)
-		#else:
-		self.conn = sqlite3.connect(todo_file)
+		if self.readonly:
+			self.conn = sqlite3.connect('file:' + pathname2url(os.path.abspath(todo_file)) + '?mode=ro', uri=True)
+		else:
+			self.conn = sqlite3.connect(todo_file, check_same_thread=not async_save)
 		self.conn.row_factory = sqlite3.Row
 		self.cursor = self.conn.cursor()
 		self.cursor.execute("PRAGMA foreign_keys=ON;")
-		self.cursor.execute("PRAGMA locking_mode=EXCLUSIVE;")
-		self.cursor.execute("PRAGMA journal_mode=TRUNCATE;")
+		if not self.readonly:
+			# Write-ahead logging allows others to read from the TODO-file while we are writing:
+			self.cursor.execute("PRAGMA journal_mode=WAL;")
 
 		# Find out if corrections have been run:
-		self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='diagnostics_corr';")
-		if self.cursor.fetchone() is None:
+		if not self._table_exists('diagnostics_corr'):
 			raise ValueError("The TODO-file does not contain diagnostics_corr. Are you sure corrections have been run?")
 
 		# Find existing MOAT tables in the todo-file:
@@ -85,7 +125,8 @@ class TaskManager(object):
 			self.cursor.execute("PRAGMA table_info(" + row['name'] + ");")
 			columns = [col['name'] for col in self.cursor.fetchall()]
 			columns.remove('priority')
-			self.moat_create(classifier, columns)
+			self._moat_queries(classifier, columns)
+		self._moat_missing = self._table_exists(MOAT_MISSING_TABLE)
 
 		# Reset the status of everything for a new run:
 		if overwrite:
@@ -95,6 +136,57 @@ class TaskManager(object):
 			self.conn.commit()
 			cleanup = True # Enforce a cleanup after deleting old results
 
+		# Create tables for settings, diagnostics and results if they don't already exist:
+		if not self.readonly:
+			self._create_tables()
+
+		# Load settings from setting tables:
+		if self._table_exists('starclass_settings'):
+			self.cursor.execute("SELECT * FROM starclass_settings LIMIT 1;")
+			row = self.cursor.fetchone()
+			if row is not None:
+				self.tset = row['tset']
+
+		# In read-only mode, the results may not exist if nothing has been run yet:
+		self._results_exist = self._table_exists('starclass_results')
+
+		# Find out if data-validation information exists:
+		self.datavalidation_exists = self._table_exists('datavalidation_corr')
+		if not self.datavalidation_exists:
+			self.logger.warning("DATA-VALIDATION information is not available in this TODO-file. Assuming all targets are good.")
+
+		# Analyze the tables for better query planning:
+		if not self.readonly:
+			self.cursor.execute("ANALYZE;")
+			self.conn.commit()
+
+		# Run a cleanup/optimization of the database before we get started:
+		if cleanup and not self.readonly:
+			self.logger.debug("Cleaning TODOLIST before run...")
+			try:
+				self.conn.isolation_level = None
+				self.cursor.execute("VACUUM;")
+			finally:
+				self.conn.isolation_level = ''
+
+		# Start the background thread writing results:
+		if self.async_save:
+			self._writer = threading.Thread(target=self._writer_loop, name='TaskManagerWriter', daemon=True)
+			self._writer.start()
+
+	#----------------------------------------------------------------------------------------------
+	def _table_exists(self, name):
+		# Check if table exists in the TODO-file:
+		self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", [name])
+		return self.cursor.fetchone() is not None
+
+	#----------------------------------------------------------------------------------------------
+	def _check_writable(self):
+		if self.readonly:
+			raise ValueError("Can not write to TODO-file opened in read-only mode")
+
+	#----------------------------------------------------------------------------------------------
+	def _create_tables(self):
 		# Create table for settings if it doesn't already exits:
 		self.cursor.execute("""CREATE TABLE IF NOT EXISTS starclass_settings (
 			tset TEXT NOT NULL,
@@ -102,12 +194,6 @@ class TaskManager(object):
 		);""")
 		self.conn.commit()
 
-		# Load settings from setting tables:
-		self.cursor.execute("SELECT * FROM starclass_settings LIMIT 1;")
-		row = self.cursor.fetchone()
-		if row is not None:
-			self.tset = row['tset']
-
 		# Create table for diagnostics:
 		self.cursor.execute("""CREATE TABLE IF NOT EXISTS starclass_diagnostics (
 			priority INTEGER NOT NULL,
@@ -132,33 +218,32 @@ class TaskManager(object):
 		# Make sure we have proper indicies that should have been created by the previous pipeline steps:
 		self.cursor.execute("CREATE INDEX IF NOT EXISTS corr_status_idx ON todolist (corr_status);")
 
-		# Find out if data-validation information exists:
-		self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='datavalidation_corr';")
-		self.datavalidation_exists = (self.cursor.fetchone() is not None)
-		if not self.datavalidation_exists:
-			self.logger.warning("DATA-VALIDATION information is not available in this TODO-file. Assuming all targets are good.")
-
-		# Analyze the tables for better query planning:
-		self.cursor.execute("ANALYZE;")
-		self.conn.commit()
-
-		# Run a cleanup/optimization of the database before we get started:
-		if cleanup:
-			self.logger.debug("Cleaning TODOLIST before run...")
-			try:
-				self.conn.isolation_level = None
-				self.cursor.execute("VACUUM;")
-			finally:
-				self.conn.isolation_level = ''
-
 	#----------------------------------------------------------------------------------------------
 	def close(self):
 		"""Close TaskManager and all associated objects."""
+		# Stop the background writer, which will write any remaining results:
+		if getattr(self, '_writer', None) is not None:
+			with self._buffer_cond:
+				self._writer_stop = True
+				self._buffer_cond.notify()
+			self._writer.join()
+			self._writer = None
+
 		if hasattr(self, 'cursor') and hasattr(self, 'conn') and self.conn:
 			try:
 				self.conn.rollback()
-				self.cursor.execute("PRAGMA journal_mode=DELETE;")
-				self.conn.commit()
+				if not self.readonly:
+					# Update statistics deferred from changes to the MOAT tables:
+					if self._moat_analyze:
+						self.cursor.execute("ANALYZE;")
+						self.conn.commit()
+						self._moat_analyze = False
+
+					# Leave the TODO-file as a single file, unless someone is still reading from it:
+					try:
+						self.cursor.execute("PRAGMA journal_mode=DELETE;")
+					except sqlite3.OperationalError: # pragma: no cover
+						self.logger.debug("TODO-file is in use by others. Keeping write-ahead log.")
 				self.cursor.close()
 			except sqlite3.ProgrammingError: # pragma: no cover
 				pass
@@ -167,6 +252,10 @@ class TaskManager(object):
 			self.conn.close()
 			self.conn = None
 
+		# Raise any errors from writing the last results:
+		if getattr(self, '_writer_error', None) is not None:
+			self._check_writer()
+
 	#----------------------------------------------------------------------------------------------
 	def __del__(self):
 		self.close()
@@ -190,110 +279,190 @@ class TaskManager(object):
 		raise NotImplementedError()
 
 	#----------------------------------------------------------------------------------------------
-	def _query_task(self, classifier=None, priority=None):
+	def _load_queue(self):
+		"""
+		Load all stars and the tasks which are still to be processed into memory.
 
-		search_joins = []
-		search_query = []
+		All targets which can be classified are loaded from the TODO-file once, together with
+		the tasks which have already been started or completed. The remaining tasks are kept
+		in queues for each classifier, ordered by priority, from which the next task can be
+		found without querying the TODO-file.
 
-		# TODO: Is this right?
-		if classifier is None and priority is None:
-			raise ValueError("This will just give the same again and again")
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		# Make sure that tasks which are waiting to be written are included:
+		self.flush()
+
+		with self._lock:
+			search_joins = ''
+			search_query = ''
+
+			# If data-validation information is available, only include targets
+			# which passed the data validation:
+			if self.datavalidation_exists:
+				search_joins = "INNER JOIN datavalidation_corr ON datavalidation_corr.priority=todolist.priority"
+				search_query = "AND datavalidation_corr.approved=1"
+
+			self.cursor.execute("""
+				SELECT
+					todolist.priority,
+					todolist.starid,
+					todolist.tmag,
+					diagnostics_corr.lightcurve AS lightcurve,
+					diagnostics_corr.variance,
+					diagnostics_corr.rms_hour,
+					diagnostics_corr.ptp
+				FROM
+					todolist
+					INNER JOIN diagnostics_corr ON todolist.priority=diagnostics_corr.priority
+					{joins:s}
+				WHERE
+					todolist.corr_status IN ({ok:d},{warning:d})
+					{constraints:s}
+				ORDER BY todolist.priority;""".format(
+				ok=STATUS.OK.value,
+				warning=STATUS.WARNING.value,
+				joins=search_joins,
+				constraints=search_query
+			))
+			self._stars = OrderedDict((row['priority'], tuple(row)) for row in self.cursor.fetchall())
+			self._stars_columns = ('priority', 'starid', 'tmag', 'lightcurve', 'variance', 'rms_hour', 'ptp')
+
+			# Tasks which have already been started or completed:
+			done = defaultdict(set)
+			if self._results_exist:
+				self.cursor.execute("SELECT priority,classifier FROM starclass_diagnostics;")
+				for row in self.cursor.fetchall():
+					done[row['classifier']].add(row['priority'])
+
+			# Queues of the remaining tasks for each classifier:
+			self._pending = {}
+			self._queue = {}
+			for classifier in self._classifiers_order():
+				self._pending[classifier] = set(self._stars.keys()) - done[classifier]
+				self._queue[classifier] = deque(priority for priority in self._stars.keys() if priority in self._pending[classifier])
 
-		# Build list of constraints:
-		if priority is not None:
-			search_query.append('todolist.priority=%d' % priority)
+	#----------------------------------------------------------------------------------------------
+	def _classifiers_order(self):
+		# All classifiers, in the order they should be run, with the meta-classifier last:
+		return [cl for cl in classifier_list if cl in self.all_classifiers] + ['meta']
 
-		# If data-validation information is available, only include targets
-		# which passed the data validation:
-		if self.datavalidation_exists:
-			search_joins.append("INNER JOIN datavalidation_corr ON datavalidation_corr.priority=todolist.priority")
-			search_query.append("datavalidation_corr.approved=1")
+	#----------------------------------------------------------------------------------------------
+	def _next_pending(self, classifier, num=1):
+		"""
+		Priorities of the next tasks to be processed for a classifier.
 
-		# If a classifier is specified, constrain to only that classifier:
-		if classifier is not None:
-			search_joins.append("LEFT JOIN starclass_diagnostics ON starclass_diagnostics.priority=todolist.priority AND starclass_diagnostics.classifier='{classifier:s}'".format(
-				classifier=classifier
-			))
-			search_query.append("starclass_diagnostics.status IS NULL")
+		Parameters:
+			classifier (str): Classifier.
+			num (int): Maximum number of priorities to return.
 
-		# Build query string:
-		# Note: It is not possible for search_query to be empty!
-		search_joins = "\n".join(search_joins)
-		search_query = "AND " + " AND ".join(search_query)
+		Returns:
+			list: Priorities of next tasks, in order of priority.
+		"""
+		if self._queue is None:
+			self._load_queue()
+		if classifier not in self._queue:
+			return []
 
-		self.cursor.execute("""
-			SELECT
-				todolist.priority,
-				todolist.starid,
-				todolist.tmag,
-				diagnostics_corr.lightcurve AS lightcurve,
-				diagnostics_corr.variance,
-				diagnostics_corr.rms_hour,
-				diagnostics_corr.ptp
-			FROM
-				todolist
-				INNER JOIN diagnostics_corr ON todolist.priority=diagnostics_corr.priority
-				{joins:s}
-			WHERE
-				todolist.corr_status IN ({ok:d},{warning:d})
-				{constraints:s}
-			ORDER BY todolist.priority LIMIT 1;""".format(
-			ok=STATUS.OK.value,
-			warning=STATUS.WARNING.value,
-			joins=search_joins,
-			constraints=search_query
-		))
-		task = self.cursor.fetchone()
-		if task:
-			task = dict(task)
-			task['classifier'] = classifier
-			task['lightcurve'] = os.path.join(self.input_folder, task['lightcurve'])
-
-			# Add things from the catalog file:
-			#catalog_file = os.path.join(????, 'catalog_sector{sector:03d}_camera{camera:d}_ccd{ccd:d}.sqlite')
-			# cursor.execute("SELECT ra,decl as dec,teff FROM catalog WHERE starid=?;", (task['starid'], ))
-			#task.update()
-
-			# Add common features already calculated by some other classifier:
-			# This is not needed for the meta-classifier
-			if classifier != 'meta':
-				features_common = self.moat_query('common', task['priority'])
-				if features_common is not None:
-					task['features_common'] = features_common
-				if classifier is not None:
-					features_specific = self.moat_query(classifier, task['priority'])
-					if features_specific is not None:
-						task['features'] = features_specific
-
-			# If the classifier that is running is the meta-classifier,
-			# add the results from all other classifiers to the task dict:
-			# FIXME: Enforce this for META only. The problem is the TrainingSet class, which doesn't know about which classifier is running it
-			if classifier == 'meta' or classifier is None:
-				self.cursor.execute("SELECT starclass_results.classifier,class,prob FROM starclass_results INNER JOIN starclass_diagnostics ON starclass_results.priority=starclass_diagnostics.priority AND starclass_results.classifier=starclass_diagnostics.classifier WHERE starclass_results.priority=? AND status=? AND starclass_results.classifier != 'meta' ORDER BY starclass_results.classifier, class;", [
-					task['priority'],
-					STATUS.OK.value
-				])
+		# Remove tasks which have been claimed from the start of the queue:
+		queue = self._queue[classifier]
+		pending = self._pending[classifier]
+		while queue and queue[0] not in pending:
+			queue.popleft()
 
-				# Add as a Table to the task list:
-				rows = []
-				for r in self.cursor.fetchall():
-					rows.append([r['classifier'], self.StellarClasses[r['class']], r['prob']])
-				if not rows: rows = None
-				task['other_classifiers'] = Table(
-					rows=rows,
-					names=('classifier', 'class', 'prob'),
-				)
-			else:
-				task['other_classifiers'] = None
+		if num == 1:
+			return [queue[0]] if queue else []
+		return list(itertools.islice((priority for priority in queue if priority in pending), num))
 
-			return task
-		return None
+	#----------------------------------------------------------------------------------------------
+	def _claim(self, priority, classifier):
+		# Remove task from the queue of tasks to be processed:
+		if self._pending is not None and classifier in self._pending:
+			self._pending[classifier].discard(priority)
+
+	#----------------------------------------------------------------------------------------------
+	def _query_task(self, classifier=None, priority=None):
+
+		# TODO: Is this right?
+		if classifier is None and priority is None:
+			raise ValueError("This will just give the same again and again")
+
+		if self._queue is None:
+			self._load_queue()
+
+		# If a classifier is specified, constrain to only tasks not processed by that classifier:
+		if classifier is not None:
+			if priority is None:
+				priority = self._next_pending(classifier)
+				priority = priority[0] if priority else None
+			elif priority not in self._pending.get(classifier, ()):
+				priority = None
+
+		row = self._stars.get(priority)
+		if row is None:
+			return None
+
+		task = dict(zip(self._stars_columns, row))
+		task['classifier'] = classifier
+		task['lightcurve'] = os.path.join(self.input_folder, task['lightcurve'])
+
+		# Add things from the catalog file:
+		#catalog_file = os.path.join(????, 'catalog_sector{sector:03d}_camera{camera:d}_ccd{ccd:d}.sqlite')
+		# cursor.execute("SELECT ra,decl as dec,teff FROM catalog WHERE starid=?;", (task['starid'], ))
+		#task.update()
+
+		# Add common features already calculated by some other classifier:
+		# This is not needed for the meta-classifier
+		if classifier != 'meta':
+			features_common = self.moat_query('common', task['priority'])
+			if features_common is not None:
+				task['features_common'] = features_common
+			if classifier is not None:
+				features_specific = self.moat_query(classifier, task['priority'])
+				if features_specific is not None:
+					task['features'] = features_specific
+
+		# If the classifier that is running is the meta-classifier,
+		# add the results from all other classifiers to the task dict:
+		# FIXME: Enforce this for META only. The problem is the TrainingSet class, which doesn't know about which classifier is running it
+		if classifier == 'meta' or classifier is None:
+			# Results for this star which are still waiting to be written are needed here:
+			if self._is_buffered(task['priority']):
+				self.flush()
+
+			fetched = []
+			with self._lock:
+				if self._results_exist:
+					self.cursor.execute("SELECT starclass_results.classifier,class,prob FROM starclass_results INNER JOIN starclass_diagnostics ON starclass_results.priority=starclass_diagnostics.priority AND starclass_results.classifier=starclass_diagnostics.classifier WHERE starclass_results.priority=? AND status=? AND starclass_results.classifier != 'meta' ORDER BY starclass_results.classifier, class;", [
+						task['priority'],
+						STATUS.OK.value
+					])
+					fetched = self.cursor.fetchall()
+
+			# Add as a Table to the task list:
+			rows = []
+			for r in fetched:
+				rows.append([r['classifier'], self.StellarClasses[r['class']], r['prob']])
+			if not rows: rows = None
+			task['other_classifiers'] = Table(
+				rows=rows,
+				names=('classifier', 'class', 'prob'),
+			)
+		else:
+			task['other_classifiers'] = None
+
+		return task
 
 	#----------------------------------------------------------------------------------------------
 	def get_task(self, priority=None, classifier=None, change_classifier=True):
 		"""
 		Get next task to be processed.
 
+		The task is not removed from the tasks to be processed before it is marked
+		as started using :meth:`start_task`, or its results are saved.
+		The tasks to be processed are loaded from the TODO-file the first time a task is
+		requested, so changes made directly in the TODO-file after that are not seen.
+
 		Parameters:
 			priority (integer):
 			classifier (string): Classifier to get next task for.
@@ -313,18 +482,22 @@ class TaskManager(object):
 		# If no task is returned for the given classifier, find another
 		# classifier where tasks are available:
 		if task is None and change_classifier:
-			# Make a search on all the classifiers, and record the next
-			# task for all of them:
-			all_tasks = []
+			# Find the next task for all the other classifiers,
+			# and pick the classifier that has reached the lowest priority:
+			next_priority = None
+			next_classifier = None
 			for cl in self.all_classifiers.difference([classifier]):
-				task = self._query_task(classifier=cl, priority=priority)
-				if task is not None:
-					all_tasks.append(task)
-
-			# Pick the classifier that has reached the lowest priority:
-			if all_tasks:
-				indx = np.argmin([t['priority'] for t in all_tasks])
-				return all_tasks[indx]
+				if priority is None:
+					p = self._next_pending(cl)
+					p = p[0] if p else None
+				else:
+					p = priority if priority in self._pending[cl] else None
+				if p is not None and (next_priority is None or p < next_priority):
+					next_priority = p
+					next_classifier = cl
+
+			if next_classifier is not None:
+				return self._query_task(classifier=next_classifier, priority=next_priority)
 
 			# If this is reached, all classifiers are done, and we can
 			# start running the MetaClassifier:
@@ -332,6 +505,71 @@ class TaskManager(object):
 
 		return task
 
+	#----------------------------------------------------------------------------------------------
+	def get_tasks(self, classifier=None, change_classifier=True, max_tasks=1):
+		"""
+		Get the next tasks to be processed, all for the same classifier.
+
+		The tasks should be marked as started together using :meth:`start_task`.
+
+		Parameters:
+			classifier (string): Classifier to get next tasks for.
+			change_classifier (boolean): Return tasks for another classifier
+				if there are no more tasks for the provided classifier.
+				Default=True.
+			max_tasks (int): Maximum number of tasks to return. Default=1.
+
+		Returns:
+			list: List of task dictionaries, as returned by :meth:`get_task`.
+				Empty if there are no more tasks to be processed.
+		"""
+		task = self.get_task(classifier=classifier, change_classifier=change_classifier)
+		if task is None:
+			return []
+
+		tasks = [task]
+		for priority in self._next_pending(task['classifier'], num=max_tasks):
+			if len(tasks) >= max_tasks:
+				break
+			if priority != task['priority']:
+				tasks.append(self._query_task(classifier=task['classifier'], priority=priority))
+		return tasks
+
+	#----------------------------------------------------------------------------------------------
+	def get_star_tasks(self, priority=None):
+		"""
+		Get all the tasks remaining for the next star to be processed.
+
+		This is used when processing stars one by one with all classifiers (star-major),
+		instead of one classifier at the time. The tasks of the classifiers are returned in
+		the order they should be run, with the meta-classifier last. Note that the
+		``other_classifiers`` of the meta-classifier task only contains results already
+		saved in the TODO-file.
+
+		Parameters:
+			priority (int, optional): Priority of star to get tasks for. Default is to pick
+				the star with the lowest priority which still has tasks remaining.
+
+		Returns:
+			list: List of task dictionaries, as returned by :meth:`get_task`.
+				Empty if there are no more tasks to be processed.
+		"""
+		classifiers = self._classifiers_order()
+
+		if priority is None:
+			pending = [self._next_pending(classifier) for classifier in classifiers]
+			pending = [p[0] for p in pending if p]
+			if not pending:
+				return []
+			priority = min(pending)
+
+		tasks = []
+		for classifier in classifiers:
+			task = self._query_task(classifier=classifier, priority=priority)
+			if task is not None:
+				tasks.append(task)
+		return tasks
+
 	#----------------------------------------------------------------------------------------------
 	def save_settings(self):
 		"""
@@ -339,16 +577,18 @@ class TaskManager(object):
 
 		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 		"""
-		try:
-			self.cursor.execute("DELETE FROM starclass_settings;")
-			self.cursor.execute("INSERT INTO starclass_settings (tset,version) VALUES (?,?);", [
-				self.tset,
-				get_version()
-			])
-			self.conn.commit()
-		except: # noqa: E722, pragma: no cover
-			self.conn.rollback()
-			raise
+		self._check_writable()
+		with self._lock:
+			try:
+				self.cursor.execute("DELETE FROM starclass_settings;")
+				self.cursor.execute("INSERT INTO starclass_settings (tset,version) VALUES (?,?);", [
+					self.tset,
+					get_version()
+				])
+				self.conn.commit()
+			except: # noqa: E722, pragma: no cover
+				self.conn.rollback()
+				raise
 
 	#----------------------------------------------------------------------------------------------
 	def moat_create(self, classifier, columns):
@@ -362,9 +602,7 @@ class TaskManager(object):
 		table_name = "starclass_features_" + classifier
 
 		columns = sorted(columns)
-		columns_insert = ",".join(columns)
 		columns_create = ",\n".join(['"' + key + '" REAL' for key in columns])
-		placeholders = ",".join([':' + key for key in columns])
 
 		# Create table:
 		#print("ATTACH DATABASE '' AS {db_name:s};".format(
@@ -380,52 +618,172 @@ class TaskManager(object):
 			columns=columns_create
 		)
 		self.cursor.execute(query_create)
-		self.cursor.execute("ANALYZE;")
 
-		# Generate SQL statement which will be used to insert extracted features
-		# into this table:
-		query_insert = "INSERT OR REPLACE INTO {table_name:s} (priority,{columns:s}) VALUES (:priority,{placeholders:s});".format(
-			table_name=table_name,
-			columns=columns_insert,
-			placeholders=placeholders
-		)
+		# Table keeping track of features which have never been stored for a star:
+		self.cursor.execute("""
+		CREATE TABLE IF NOT EXISTS {table_name:s} (
+			classifier TEXT NOT NULL,
+			priority INTEGER NOT NULL,
+			feature TEXT NOT NULL,
+			PRIMARY KEY (classifier, priority, feature),
+			FOREIGN KEY (priority) REFERENCES diagnostics_corr(priority) ON DELETE CASCADE ON UPDATE CASCADE
+		) WITHOUT ROWID;""".format(table_name=MOAT_MISSING_TABLE))
+		self._moat_missing = True
+
+		# The statistics of the TODO-file are updated when the TaskManager is closed:
+		self._moat_analyze = True
+
+		return self._moat_queries(classifier, columns)
+
+	#----------------------------------------------------------------------------------------------
+	def _moat_queries(self, classifier, columns):
+		"""
+		Generate the SQL statements used for selecting from a MOAT table.
+
+		Statements for inserting into the table are generated by :meth:`_moat_insert_query`
+		when needed, since they depend on which features are provided.
+
+		Parameters:
+			classifier (str): Classifier of the table.
+			columns (list): Columns of the table, except ``priority``.
+
+		Returns:
+			dict: Table name, columns and SQL statements for the table.
+
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		table_name = "starclass_features_" + classifier
+		columns = list(columns)
+		columns_quoted = ['"' + key + '"' for key in columns]
 
 		# Generate SQL statement which will be used to select extracted features
 		# from this table:
 		query_select = "SELECT {columns:s} FROM {table_name:s} WHERE priority=?;".format(
 			table_name=table_name,
-			columns=columns_insert
+			columns=",".join(columns_quoted)
 		)
 
 		# Gather into dict and save to memory for later reuse:
 		query = {
 			'table_name': table_name,
-			'insert': query_insert,
+			'columns': columns,
+			'insert': {},
 			'select': query_select,
 		}
 		self._moat_tables[classifier] = query
 		return query
 
 	#----------------------------------------------------------------------------------------------
-	def _moat_insert(self, classifier, priority, features):
+	def _moat_insert_query(self, query, columns):
+		"""
+		SQL statement for inserting the given features into a MOAT table.
+
+		Only the provided columns are written. Existing rows are only updated if any
+		of the features have changed, so writing the same features again does not touch
+		the file, and features which are not provided keep the values already stored.
+
+		Parameters:
+			query (dict): Queries of the table as returned by :meth:`_moat_queries`.
+			columns (tuple): Columns to insert, except ``priority``.
+
+		Returns:
+			str: SQL statement taking the priority followed by the values of the columns.
+
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		query_insert = query['insert'].get(columns)
+		if query_insert is None:
+			columns_quoted = ['"' + key + '"' for key in columns]
+			if columns_quoted:
+				upsert = "DO UPDATE SET {update:s} WHERE {changed:s}".format(
+					update=",".join(["{0:s}=excluded.{0:s}".format(key) for key in columns_quoted]),
+					changed=" OR ".join(["{0:s} IS NOT excluded.{0:s}".format(key) for key in columns_quoted])
+				)
+			else:
+				upsert = "DO NOTHING"
+
+			query_insert = "INSERT INTO {table_name:s} ({columns:s}) VALUES ({placeholders:s}) ON CONFLICT (priority) {upsert:s};".format(
+				table_name=query['table_name'],
+				columns=",".join(['priority'] + columns_quoted),
+				placeholders=",".join(['?']*(len(columns) + 1)),
+				upsert=upsert
+			)
+			query['insert'][columns] = query_insert
+		return query_insert
+
+	#----------------------------------------------------------------------------------------------
+	def _moat_insert(self, classifier, rows):
 		"""
 		Insert extracted features into Mother Of All Tables (MOAT).
 
+		The table is created if it doesn't exist, and new columns are added to the table
+		if features not already in the table are provided. Features which are not
+		provided for a star keep the value already stored for the star. If nothing has been
+		stored, they are recorded as missing, in which case they are not returned by
+		:meth:`moat_query`.
+
 		Parameters:
-			classifier (str):
-			priority (int):
-			features (dict):
+			classifier (str): Classifier, or ``'common'`` for the common features.
+			rows (dict): Dictionary of features for each star, with priorities as keys.
 
 		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 		"""
+		columns = set()
+		for features in rows.values():
+			columns.update(features.keys())
 
 		query = self._moat_tables.get(classifier)
 		if query is None:
-			query = self.moat_create(classifier, features.keys())
-
-		# Insert into MOAT table using pre-compiled SQL query:
-		priority_dict = {'priority': priority}
-		self.cursor.execute(query['insert'], {**features, **priority_dict})
+			query = self.moat_create(classifier, columns)
+		else:
+			# Add columns for any new features to the existing table:
+			new_columns = sorted(columns - set(query['columns']))
+			if new_columns:
+				for key in new_columns:
+					self.cursor.execute("ALTER TABLE {table_name:s} ADD COLUMN \"{column:s}\" REAL;".format(
+						table_name=query['table_name'],
+						column=key
+					))
+					# The new feature is missing for all stars already in the table:
+					self.cursor.execute("INSERT INTO {missing:s} (classifier,priority,feature) SELECT ?,priority,? FROM {table_name:s};".format(
+						missing=MOAT_MISSING_TABLE,
+						table_name=query['table_name']
+					), [classifier, key])
+				self._moat_analyze = True
+				query = self._moat_queries(classifier, query['columns'] + new_columns)
+
+		# Find the features to record as missing, or no longer missing, for each star.
+		# Features not provided are missing for new stars, and keep their state for existing stars:
+		missing_add = []
+		missing_remove = []
+		for priority, features in rows.items():
+			self.cursor.execute("SELECT priority FROM {table_name:s} WHERE priority=?;".format(
+				table_name=query['table_name']
+			), [priority])
+			if self.cursor.fetchone() is None:
+				missing_add += [(classifier, priority, key) for key in query['columns'] if key not in features]
+			else:
+				self.cursor.execute("SELECT feature FROM {missing:s} WHERE classifier=? AND priority=?;".format(
+					missing=MOAT_MISSING_TABLE
+				), [classifier, priority])
+				missing_remove += [(classifier, priority, row[0]) for row in self.cursor.fetchall() if row[0] in features]
+
+		# Insert into MOAT table using one statement for each set of provided features:
+		groups = defaultdict(list)
+		for priority, features in rows.items():
+			columns = tuple(sorted(features.keys()))
+			groups[columns].append([priority] + [features[key] for key in columns])
+		for columns, values in groups.items():
+			self.cursor.executemany(self._moat_insert_query(query, columns), values)
+
+		if missing_add:
+			self.cursor.executemany("INSERT OR IGNORE INTO {missing:s} (classifier,priority,feature) VALUES (?,?,?);".format(
+				missing=MOAT_MISSING_TABLE
+			), missing_add)
+		if missing_remove:
+			self.cursor.executemany("DELETE FROM {missing:s} WHERE classifier=? AND priority=? AND feature=?;".format(
+				missing=MOAT_MISSING_TABLE
+			), missing_remove)
 
 	#----------------------------------------------------------------------------------------------
 	def moat_query(self, classifier, priority):
@@ -443,12 +801,85 @@ class TaskManager(object):
 		"""
 		query = self._moat_tables.get(classifier)
 		if query is not None:
-			self.cursor.execute(query['select'], [priority])
-			row = self.cursor.fetchone()
+			with self._lock:
+				self.cursor.execute(query['select'], [priority])
+				row = self.cursor.fetchone()
+				missing = set()
+				if row and self._moat_missing:
+					self.cursor.execute("SELECT feature FROM {missing:s} WHERE classifier=? AND priority=?;".format(
+						missing=MOAT_MISSING_TABLE
+					), [classifier, priority])
+					missing = set(r[0] for r in self.cursor.fetchall())
 			if row:
-				return {key: (np.NaN if val is None else val) for key, val in dict(row).items()}
+				return {key: (np.NaN if val is None else val) for key, val in dict(row).items() if key not in missing}
 		return None
 
+	#----------------------------------------------------------------------------------------------
+	def moat_features(self, classifier, names, priorities=None):
+		"""
+		Matrix of cached features of many stars from Mother Of All Tables (MOAT).
+
+		The features are read from the common features and the features specific to the
+		classifier, with a single scan of each of the tables.
+
+		Parameters:
+			classifier (str): Classifier to load specific features for.
+			names (list): Names of features to load, defining the columns of the matrix.
+			priorities (array_like, optional): Priorities of stars, defining the rows of the
+				matrix. Default is all stars in the TODO-file, ordered by priority.
+
+		Returns:
+			tuple:
+			- ndarray: Priorities of the stars in the rows of the matrix.
+			- ndarray: Matrix of features (n_stars, n_features) as float32.
+			  Features which are not available in the MOAT are NaN.
+			- ndarray: Boolean matrix (n_stars, n_features) indicating which features are
+			  available in the MOAT. Features stored as NaN are available.
+
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		self.flush()
+		with self._lock:
+			if priorities is None:
+				self.cursor.execute("SELECT priority FROM todolist ORDER BY priority;")
+				priorities = [row[0] for row in self.cursor.fetchall()]
+			priorities = np.asarray(priorities, dtype='int64')
+			index = {priority: k for k, priority in enumerate(priorities)}
+
+			featout = np.full((len(priorities), len(names)), np.NaN, dtype='float32')
+			available = np.zeros((len(priorities), len(names)), dtype='bool')
+			for table in (classifier, 'common'):
+				query = self._moat_tables.get(table)
+				if query is None:
+					continue
+				columns = [(k, key) for k, key in enumerate(names) if key in query['columns']]
+				if not columns:
+					continue
+				indx = [k for k, _ in columns]
+
+				self.cursor.execute("SELECT priority,{columns:s} FROM {table_name:s};".format(
+					table_name=query['table_name'],
+					columns=",".join(['"' + key + '"' for _, key in columns])
+				))
+				for row in self.cursor:
+					k = index.get(row[0])
+					if k is not None:
+						featout[k, indx] = [np.NaN if val is None else val for val in row[1:]]
+						available[k, indx] = True
+
+				# Features which have never been stored are not available:
+				if self._moat_missing:
+					column_index = {key: k for k, key in columns}
+					self.cursor.execute("SELECT priority,feature FROM {missing:s} WHERE classifier=?;".format(
+						missing=MOAT_MISSING_TABLE
+					), [table])
+					for priority, key in self.cursor:
+						k = index.get(priority)
+						if k is not None and key in column_index:
+							available[k, column_index[key]] = False
+
+		return priorities, featout, available
+
 	#----------------------------------------------------------------------------------------------
 	def moat_clear(self):
 		"""
@@ -456,105 +887,242 @@ class TaskManager(object):
 
 		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 		"""
-		for query in self._moat_tables.values():
-			self.cursor.execute("DROP TABLE {table_name:s};".format(
-				table_name=query['table_name']
-			))
-		self.conn.commit()
-		self._moat_tables.clear()
+		self._check_writable()
+		self.flush()
+		with self._lock:
+			for query in self._moat_tables.values():
+				self.cursor.execute("DROP TABLE {table_name:s};".format(
+					table_name=query['table_name']
+				))
+			self.cursor.execute("DROP TABLE IF EXISTS {missing:s};".format(missing=MOAT_MISSING_TABLE))
+			self.conn.commit()
+			self._moat_tables.clear()
+			self._moat_missing = False
 
-		# Run a VACUUM of todo-file after potentially deleting many tables:
-		self.logger.debug("Cleaning TODOLIST after moat_clear...")
-		try:
-			self.conn.isolation_level = None
-			self.cursor.execute("VACUUM;")
-		finally:
-			self.conn.isolation_level = ''
+			# Run a VACUUM of todo-file after potentially deleting many tables:
+			self.logger.debug("Cleaning TODOLIST after moat_clear...")
+			try:
+				self.conn.isolation_level = None
+				self.cursor.execute("VACUUM;")
+			finally:
+				self.conn.isolation_level = ''
 
 	#----------------------------------------------------------------------------------------------
-	def save_results(self, result):
+	def save_results(self, results):
 		"""
 		Save results and diagnostics. This will update the TODO list.
 
 		Parameters:
-			results (dict): Dictionary of results and diagnostics.
+			results (dict or list): Dictionary of results and diagnostics.
+				If a list of results is provided, they are all saved in a single transaction.
 
 		Raises:
-			ValueError: If attempting to save results from multiple different training sets.
+			ValueError: If attempting to save results from multiple different training sets,
+				or if the TaskManager is read-only.
 
 		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 		"""
+		self._check_writable()
+		if isinstance(results, dict):
+			results = [results]
 
 		# If the training set has not already been set for this TODO-file,
 		# update the settings, and if it has check that we are not
 		# mixing results from different correctors in one TODO-file.
-		tset = result.get('tset')
-		if self.tset is None and tset:
-			self.tset = tset
-			self.save_settings()
-		elif tset != self.tset:
-			raise ValueError("Attempting to mix results from multiple training sets. Previous='%s', New='%s'." % (self.tset, tset))
-
-		priority = result.get('priority')
-		classifier = result.get('classifier')
-		status = result.get('status')
-		details = result.get('details', {})
-		starclass_results = result.get('starclass_results', {})
-		common = result.get('features_common')
-		features = result.get('features')
-
-		# Save additional diagnostics:
-		error_msg = details.get('errors', None)
-		if error_msg:
-			error_msg = '\n'.join(error_msg)
-			#self.summary['last_error'] = error_msg
+		for result in results:
+			tset = result.get('tset')
+			if self.tset is None and tset:
+				self.tset = tset
+				self.save_settings()
+			elif tset != self.tset:
+				raise ValueError("Attempting to mix results from multiple training sets. Previous='%s', New='%s'." % (self.tset, tset))
 
 		# Store the results in database:
-		try:
-			# Save additional diagnostics:
-			self.cursor.execute("INSERT OR REPLACE INTO starclass_diagnostics (priority,classifier,status,errors,elaptime,worker_wait_time) VALUES (:priority,:classifier,:status,:errors,:elaptime,:worker_wait_time);", {
-				'priority': priority,
-				'classifier': classifier,
-				'status': status.value,
-				'elaptime': result.get('elaptime'),
-				'worker_wait_time': result.get('worker_wait_time'),
-				'errors': error_msg
-			})
-
-			self.cursor.execute("DELETE FROM starclass_results WHERE priority=? AND classifier=?;", (priority, classifier))
-			for key, value in starclass_results.items():
-				self.cursor.execute("INSERT INTO starclass_results (priority,classifier,class,prob) VALUES (:priority,:classifier,:class,:prob);", {
-					'priority': priority,
-					'classifier': classifier,
-					'class': key.name,
-					'prob': value
-				})
-
-			# Save common features if they are provided:
-			if common:
-				self._moat_insert('common', priority, common)
-
-			# Save classifier-specific features if they are provided:
-			if features:
-				self._moat_insert(classifier, priority, features)
+		if self.async_save:
+			self._buffer(results=results)
+		else:
+			self._write(results=results)
 
-			self.conn.commit()
-		except: # noqa: E722, pragma: no cover
-			self.conn.rollback()
-			raise
+		# The tasks are no longer to be processed:
+		for result in results:
+			self._claim(result.get('priority'), result.get('classifier'))
+
+	#----------------------------------------------------------------------------------------------
+	def _write(self, starts=None, results=None):
+		"""
+		Write started tasks and results to the TODO-file in a single transaction.
+
+		Either all of the started tasks and results are saved, or none of them are,
+		in which case the tasks can be run again.
+
+		Parameters:
+			starts (list): List of started tasks, with ``priority``, ``classifier`` and ``status``.
+			results (list): List of results, as provided to :meth:`save_results`.
+		"""
+		if not starts and not results:
+			return
+
+		# Only keep the last results for each task:
+		if results:
+			results = list(OrderedDict(((res.get('priority'), res.get('classifier')), res) for res in results).values())
+
+		with self._lock:
+			try:
+				if starts:
+					self.cursor.executemany("INSERT INTO starclass_diagnostics (priority,classifier,status) VALUES (:priority,:classifier,:status);", starts)
+
+				if results:
+					# Save additional diagnostics:
+					diagnostics = []
+					for result in results:
+						error_msg = result.get('details', {}).get('errors', None)
+						if error_msg:
+							error_msg = '\n'.join(error_msg)
+						diagnostics.append({
+							'priority': result.get('priority'),
+							'classifier': result.get('classifier'),
+							'status': result.get('status').value,
+							'elaptime': result.get('elaptime'),
+							'worker_wait_time': result.get('worker_wait_time'),
+							'errors': error_msg
+						})
+					self.cursor.executemany("INSERT OR REPLACE INTO starclass_diagnostics (priority,classifier,status,errors,elaptime,worker_wait_time) VALUES (:priority,:classifier,:status,:errors,:elaptime,:worker_wait_time);", diagnostics)
+
+					# Replace the stellar classifications:
+					self.cursor.executemany("DELETE FROM starclass_results WHERE priority=? AND classifier=?;", [
+						(result.get('priority'), result.get('classifier')) for result in results
+					])
+					self.cursor.executemany("INSERT INTO starclass_results (priority,classifier,class,prob) VALUES (:priority,:classifier,:class,:prob);", [{
+						'priority': result.get('priority'),
+						'classifier': result.get('classifier'),
+						'class': key.name,
+						'prob': value
+					} for result in results for key, value in result.get('starclass_results', {}).items()])
+
+					# Save features in the MOAT, with one insert per table. The common features
+					# are typically provided by several classifiers for the same star:
+					moat = OrderedDict()
+					for result in results:
+						common = result.get('features_common')
+						if common:
+							moat.setdefault('common', OrderedDict()).setdefault(result.get('priority'), {}).update(common)
+
+						features = result.get('features')
+						if features:
+							moat.setdefault(result.get('classifier'), OrderedDict())[result.get('priority')] = features
+
+					for classifier, rows in moat.items():
+						self._moat_insert(classifier, rows)
+
+				self.conn.commit()
+			except: # noqa: E722, pragma: no cover
+				self.conn.rollback()
+				raise
+
+	#----------------------------------------------------------------------------------------------
+	def _buffer(self, starts=None, results=None):
+		# Add started tasks and results to the buffer written by the background thread:
+		self._check_writer()
+		with self._buffer_cond:
+			if self._buffer_time is None:
+				self._buffer_time = default_timer()
+			if starts:
+				self._buffer_starts.extend(starts)
+			if results:
+				self._buffer_results.extend(results)
+			if len(self._buffer_starts) + len(self._buffer_results) >= self.save_batch_size:
+				self._buffer_cond.notify()
+
+	#----------------------------------------------------------------------------------------------
+	def _is_buffered(self, priority):
+		# Check if there are results for the given priority waiting to be written:
+		with self._buffer_cond:
+			return any(result.get('priority') == priority for result in self._buffer_results)
+
+	#----------------------------------------------------------------------------------------------
+	def _check_writer(self):
+		# Raise any errors from the background writer in the calling thread:
+		if self._writer_error is not None:
+			error = self._writer_error
+			self._writer_error = None
+			raise error
+
+	#----------------------------------------------------------------------------------------------
+	def _writer_loop(self):
+		# Background thread writing buffered started tasks and results to the TODO-file:
+		while True:
+			with self._buffer_cond:
+				while not self._writer_stop:
+					num = len(self._buffer_starts) + len(self._buffer_results)
+					if num >= self.save_batch_size:
+						break
+					if num > 0:
+						remaining = self.save_interval - (default_timer() - self._buffer_time)
+						if remaining <= 0:
+							break
+					else:
+						remaining = None
+					self._buffer_cond.wait(timeout=remaining)
+				stop = self._writer_stop
+
+			try:
+				self.flush()
+			except: # noqa: E722, pragma: no cover
+				self.logger.exception("Writing results to TODO-file failed.")
+				if self._writer_error is None:
+					self._writer_error = RuntimeError("Writing results to TODO-file failed. See log for details.")
+
+			if stop:
+				break
+
+	#----------------------------------------------------------------------------------------------
+	def flush(self):
+		"""
+		Write all buffered started tasks and results to the TODO-file.
+
+		This is only needed when running with ``async_save``, where the started tasks and
+		results are otherwise written in the background when enough have been buffered,
+		or when they have been buffered for long enough. The buffer is written in a single
+		transaction, so a task is either fully saved, or can be run again.
+
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		# Holding the lock while emptying the buffer ensures that buffers
+		# are written in the order they were filled:
+		with self._lock:
+			with self._buffer_cond:
+				starts, self._buffer_starts = self._buffer_starts, []
+				results, self._buffer_results = self._buffer_results, []
+				self._buffer_time = None
+			self._write(starts=starts, results=results)
 
 	#----------------------------------------------------------------------------------------------
 	def start_task(self, task):
 		"""
 		Mark a task as STARTED in the TODO-list.
+
+		Parameters:
+			task (dict or list): Task dictionary, or list of tasks which are all marked
+				as started in a single transaction.
+
+		Raises:
+			ValueError: If the TaskManager is read-only.
 		"""
-		try:
-			self.cursor.execute("INSERT INTO starclass_diagnostics (priority,classifier,status) VALUES (:priority,:classifier,:status);", {
-				'priority': task['priority'],
-				'classifier': task['classifier'],
-				'status': STATUS.STARTED.value
-			})
-			self.conn.commit()
-		except: # noqa: E722, pragma: no cover
-			self.conn.rollback()
-			raise
+		self._check_writable()
+		if isinstance(task, dict):
+			task = [task]
+
+		starts = [{
+			'priority': t['priority'],
+			'classifier': t['classifier'],
+			'status': STATUS.STARTED.value
+		} for t in task]
+
+		if self.async_save:
+			self._buffer(starts=starts)
+		else:
+			self._write(starts=starts)
+
+		# Remove the tasks from the queue of tasks to be processed:
+		for t in task:
+			self._claim(t['priority'], t['classifier'])
@@ -13,9 +13,9 @@ import requests
 import zipfile
 import shutil
 import logging
-import tempfile
 import sqlite3
-from contextlib import closing
+import h5py
+from contextlib import closing, contextmanager
 from tqdm import tqdm
 from sklearn.model_selection import train_test_split, StratifiedKFold
 from .. import BaseClassifier, TaskManager, utilities, io
@@ -352,6 +352,22 @@ class TrainingSet(object):
 
 		logger.info("%s training set successfully built.", self.key)
 
+	#----------------------------------------------------------------------------------------------
+	@contextmanager
+	def _open_todo(self):
+		"""
+		TaskManager reading from the TODO-file of the training set.
+
+		The TODO-file is opened in read-only mode, so it can be read while results
+		are being saved to it, for instance while testing classifiers.
+
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		# Make sure overwrite=False, or else previous results will be deleted,
+		# meaning there would be no results for the MetaClassifier to work with
+		with TaskManager(self.todo_file, readonly=True, overwrite=False, cleanup=False, classes=self.StellarClasses) as tm:
+			yield tm
+
 	#----------------------------------------------------------------------------------------------
 	def features(self):
 		"""
@@ -362,37 +378,18 @@ class TrainingSet(object):
 
 		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 		"""
-
-		# Create a temporary copy of the TODO-file that we are going to read from.
-		# This is due to errors we have detected, where the database is unexpectively locked
-		# when opened several times in parallel.
-		try:
-			with tempfile.NamedTemporaryFile(dir=self.input_folder, suffix='.sqlite', delete=False) as tmpdir:
-				# Copy the original TODO-file to the new temp file:
-				with open(self.todo_file, 'rb') as fid:
-					shutil.copyfileobj(fid, tmpdir)
-				tmpdir.flush()
-
-				# Make sure overwrite=False, or else previous results will be deleted,
-				# meaning there would be no results for the MetaClassifier to work with
-				with TaskManager(tmpdir.name, overwrite=False, cleanup=False, classes=self.StellarClasses) as tm:
-					# NOTE: This does not propergate the 'data_dir' keyword to the BaseClassifier,
-					#       But since we are not doing anything other than loading data,
-					#       this should not cause any problems.
-					with BaseClassifier(tset=self, features_cache=self.features_cache) as stcl:
-						for rowidx in self.train_idx:
-							task = tm.get_task(priority=rowidx+1, change_classifier=False)
-
-							# Lightcurve file to load:
-							# We do not use the one from the database because in the simulations the
-							# raw and corrected light curves are stored in different files.
-							yield stcl.load_star(task)
-
-		finally:
-			if os.path.exists(tmpdir.name):
-				os.remove(tmpdir.name)
-			if os.path.exists(tmpdir.name + '-journal'):
-				os.remove(tmpdir.name + '-journal')
+		with self._open_todo() as tm:
+			# NOTE: This does not propergate the 'data_dir' keyword to the BaseClassifier,
+			#       But since we are not doing anything other than loading data,
+			#       this should not cause any problems.
+			with BaseClassifier(tset=self, features_cache=self.features_cache) as stcl:
+				for rowidx in self.train_idx:
+					task = tm.get_task(priority=rowidx+1, change_classifier=False)
+
+					# Lightcurve file to load:
+					# We do not use the one from the database because in the simulations the
+					# raw and corrected light curves are stored in different files.
+					yield stcl.load_star(task)
 
 	#----------------------------------------------------------------------------------------------
 	def features_test(self):
@@ -408,32 +405,97 @@ class TrainingSet(object):
 		if self.testfraction <= 0:
 			raise ValueError('features_test requires testfraction > 0')
 
-		# Create a temporary copy of the TODO-file that we are going to read from.
-		# This is due to errors we have detected, where the database is unexpectively locked
-		# when opened several times in parallel.
-		try:
-			with tempfile.NamedTemporaryFile(dir=self.input_folder, suffix='.sqlite', delete=False) as tmpdir:
-				# Copy the original TODO-file to the new temp file:
-				with open(self.todo_file, 'rb') as fid:
-					shutil.copyfileobj(fid, tmpdir)
-				tmpdir.flush()
-
-				# Make sure overwrite=False, or else previous results will be deleted,
-				# meaning there would be no results for the MetaClassifier to work with
-				with TaskManager(tmpdir.name, overwrite=False, cleanup=False, classes=self.StellarClasses) as tm:
-					for rowidx in self.test_idx:
-						task = tm.get_task(priority=rowidx+1, change_classifier=False)
-
-						# Lightcurve file to load:
-						# We do not use the one from the database because in the simulations the
-						# raw and corrected light curves are stored in different files.
-						yield task
-
-		finally:
-			if os.path.exists(tmpdir.name):
-				os.remove(tmpdir.name)
-			if os.path.exists(tmpdir.name + '-journal'):
-				os.remove(tmpdir.name + '-journal')
+		with self._open_todo() as tm:
+			for rowidx in self.test_idx:
+				task = tm.get_task(priority=rowidx+1, change_classifier=False)
+
+				# Lightcurve file to load:
+				# We do not use the one from the database because in the simulations the
+				# raw and corrected light curves are stored in different files.
+				yield task
+
+	#----------------------------------------------------------------------------------------------
+	def export_features(self, classifier, names, fname=None):
+		"""
+		Export features stored in the MOAT of the training set to a HDF5 file.
+
+		The features of all stars in the TODO-file are exported as a single matrix,
+		read from the MOAT with one scan of each table. See :meth:`TaskManager.moat_features`.
+
+		Parameters:
+			classifier (str): Classifier to export features for.
+			names (list): Names of features to export.
+			fname (str, optional): Path to HDF5 file to export to. Default is a file
+				in the features cache of the training set.
+
+		Returns:
+			str: Path to the HDF5 file.
+
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		if fname is None:
+			fname = os.path.join(self.features_cache, 'moat_features_' + classifier + '.hdf5')
+
+		with self._open_todo() as tm:
+			priorities, featout, available = tm.moat_features(classifier, names)
+
+		with h5py.File(fname, 'w') as hdf:
+			hdf.create_dataset('priority', data=priorities)
+			dset = hdf.create_dataset('features', data=featout, dtype='float32')
+			dset.attrs['names'] = list(names)
+			hdf.create_dataset('available', data=available, dtype='bool')
+
+		return fname
+
+	#----------------------------------------------------------------------------------------------
+	def feature_matrix(self, classifier, names):
+		"""
+		Matrix of features for training, loaded from the MOAT without loading any stars.
+
+		The features are read from a HDF5 file exported by :meth:`export_features`,
+		which is updated if the TODO-file of the training set has been changed since it
+		was exported, or if it contains different features.
+
+		Parameters:
+			classifier (str): Classifier to load features for.
+			names (list): Names of features, defining the columns of the matrix.
+
+		Returns:
+			ndarray: Matrix of features (n_stars, n_features) as float32, in the same
+			order as :meth:`features`. ``None`` if not all features are available in the MOAT.
+
+		.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+		"""
+		names = list(names)
+		fname = os.path.join(self.features_cache, 'moat_features_' + classifier + '.hdf5')
+
+		# Check if features have already been exported:
+		featall = None
+		# Changes to the TODO-file may still only be in its write-ahead log:
+		todo_mtime = max(os.path.getmtime(f) for f in (self.todo_file, self.todo_file + '-wal') if os.path.isfile(f))
+		if os.path.isfile(fname) and os.path.getmtime(fname) >= todo_mtime:
+			with h5py.File(fname, 'r') as hdf:
+				if 'available' in hdf and [str(key) for key in hdf['features'].attrs['names']] == names:
+					priorities = np.asarray(hdf['priority'])
+					featall = np.asarray(hdf['features'])
+					availall = np.asarray(hdf['available'])
+
+		if featall is None:
+			self.export_features(classifier, names, fname=fname)
+			with h5py.File(fname, 'r') as hdf:
+				priorities = np.asarray(hdf['priority'])
+				featall = np.asarray(hdf['features'])
+				availall = np.asarray(hdf['available'])
+
+		# Pick out the stars of the training set:
+		if not np.all(np.isin(self.train_idx + 1, priorities)):
+			return None
+		# Features which have been stored as NaN are legitimately NaN,
+		# but features which have not been stored at all are not available:
+		rows = np.searchsorted(priorities, self.train_idx + 1)
+		if not np.all(availall[rows, :]):
+			return None
+		return featall[rows, :]
 
 	#----------------------------------------------------------------------------------------------
 	def labels(self):
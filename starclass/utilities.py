@@ -7,9 +7,9 @@ Utility functions.
 """
 
 import numpy as np
-from bottleneck import nanmedian, nanmean, allnan
-from scipy.stats import binned_statistic
+from bottleneck import nanmedian, allnan
 import astropy.units as u
+from .features.freqextr import freqtable
 
 # Constants:
 mad_to_sigma = 1.482602218505602 #: Conversion constant from MAD to Sigma. Constant is 1/norm.ppf(3/4)
@@ -19,20 +19,29 @@ def rms_timescale(lc, timescale=3600/86400):
 	"""
 	Compute robust RMS on specified timescale. Using MAD scaled to RMS.
 
+	The timeseries is binned to each of the timescales using a single weighted bincount
+	over the data.
+
 	Parameters:
 		lc (``lightkurve.TessLightCurve`` object): Timeseries to calculate RMS for.
-		timescale (float, optional): Timescale to bin timeseries before calculating RMS. Default=1 hour.
+		timescale (float or list, optional): Timescale to bin timeseries before calculating RMS.
+			Can also be a list of timescales. Default=1 hour.
 
 	Returns:
-		float: Robust RMS on specified timescale.
+		float or ndarray: Robust RMS on specified timescale. If a list of timescales was given,
+			an array with the robust RMS on each timescale.
 
 	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 	"""
 
+	timescales = np.atleast_1d(np.asarray(timescale, dtype='float64'))
+	if np.ndim(timescale) == 0:
+		return rms_timescale(lc, timescales)[0]
+
 	time = np.asarray(lc.time)
 	flux = np.asarray(lc.flux)
 	if len(flux) == 0 or allnan(flux):
-		return np.nan
+		return np.full(len(timescales), np.nan)
 	if len(time) == 0 or allnan(time):
 		raise ValueError("Invalid time-vector specified. No valid timestamps.")
 
@@ -41,16 +50,33 @@ def rms_timescale(lc, timescale=3600/86400):
 	if not np.isfinite(time_min) or not np.isfinite(time_max) or time_max - time_min <= 0:
 		raise ValueError("Invalid time-vector specified")
 
-	# Construct the bin edges seperated by the timescale:
-	bins = np.arange(time_min, time_max, timescale)
-	bins = np.append(bins, time_max)
-
-	# Bin the timeseries to one hour:
-	indx = np.isfinite(flux)
-	flux_bin, _, _ = binned_statistic(time[indx], flux[indx], nanmean, bins=bins)
+	indx = np.isfinite(flux) & np.isfinite(time)
+	time = time[indx]
+	flux = flux[indx]
+
+	# Find the bin of every point for all timescales, where the bin edges
+	# are seperated by the timescale. The bins of the different timescales are
+	# given consecutive numbers, so they can all be counted together:
+	binindx = np.empty((len(timescales), len(time)), dtype='int64')
+	offsets = np.zeros(len(timescales)+1, dtype='int64')
+	for k, ts in enumerate(timescales):
+		bins = np.append(np.arange(time_min, time_max, ts), time_max)
+		nbins = len(bins) - 1
+		binindx[k] = np.clip(np.searchsorted(bins, time, side='right') - 1, 0, nbins-1) + offsets[k]
+		offsets[k+1] = offsets[k] + nbins
+
+	# Bin the timeseries:
+	counts = np.bincount(binindx.ravel(), minlength=offsets[-1])
+	sums = np.bincount(binindx.ravel(), weights=np.tile(flux, len(timescales)), minlength=offsets[-1])
+	with np.errstate(invalid='ignore', divide='ignore'):
+		flux_bin = sums / counts
 
 	# Compute robust RMS value (MAD scaled to RMS)
-	return mad_to_sigma * nanmedian(np.abs(flux_bin - nanmedian(flux_bin)))
+	rms = np.empty(len(timescales), dtype='float64')
+	for k in range(len(timescales)):
+		fb = flux_bin[offsets[k]:offsets[k+1]]
+		rms[k] = mad_to_sigma * nanmedian(np.abs(fb - nanmedian(fb)))
+	return rms
 
 #--------------------------------------------------------------------------------------------------
 def ptp(lc):
@@ -78,7 +104,8 @@ def get_periods(featdict, nfreqs, time, in_days=True, ignore_harmonics=False):
 	transforms them into periods in days.
 
 	Parameters:
-		featdict (dict):
+		featdict (dict): Features, where ``frequencies`` is a :class:`features.freqextr.freqtable`
+			or an astropy table returned by :func:`features.freqextr.freqextr`.
 		nfreq (int): Number of frequencies/periods to extract
 		time (ndarray):
 		in_days (bool, optional): Return periods in days instead of frequencies in uHz.
@@ -89,36 +116,37 @@ def get_periods(featdict, nfreqs, time, in_days=True, ignore_harmonics=False):
 		tuple:
 			- periods:
 			- n_usedfreqs (int): Number of true periods/frequencies that are used.
-			- usedfreqs: Indices of the used periods/frequencies in the astropy table.
+			- usedfreqs: Peak numbers and harmonics of the used periods/frequencies in the
+			  frequency table.
 
 	.. codeauthor:: Jeroen Audenaert <jeroen.audenaert@kuleuven.be>
 	.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
 	"""
 
 	tab = featdict['frequencies']
-	tab = tab[~np.isnan(tab['amplitude'])]
+	if not isinstance(tab, freqtable):
+		tab = freqtable.from_table(tab)
+
+	rows = tab[~np.isnan(tab['amplitude'])]
 	if ignore_harmonics:
-		tab.sort('amplitude', reverse=True)
-		selection = tab[:min(len(tab), nfreqs)]
+		rows = rows[np.argsort(rows['amplitude'], kind='stable')[::-1]]
+		selection = rows[:nfreqs]
 	else:
-		selection = tab[tab['harmonic'] == 0][:nfreqs]
+		selection = rows[rows['harmonic'] == 0][:nfreqs]
 
-	periods = selection['frequency'].quantity
+	periods = selection['frequency']
 	usedfreqs = selection[['num', 'harmonic']]
 
 	if in_days:
-		periods = (1/periods).to(u.day)
+		periods = (1/(periods*u.uHz)).to(u.day).value
 
-	per = (np.max(time) - np.min(time)) * u.day
+	# Pad with the length of the timeseries:
 	gap = nfreqs - len(periods)
 	if gap > 0:
-		if in_days:
-			for i in range(gap):
-				periods = periods.insert(len(periods), per)
-		else:
-			for i in range(gap):
-				periods = periods.insert(len(periods), (1/per).to(u.uHz))
+		per = (np.max(time) - np.min(time)) * u.day
+		fill = per.value if in_days else (1/per).to(u.uHz).value
+		periods = np.concatenate((periods, np.full(gap, fill)))
 
 	n_usedfreqs = len(usedfreqs)
 
-	return periods.value, n_usedfreqs, usedfreqs
+	return periods, n_usedfreqs, usedfreqs
@@ -8,12 +8,13 @@ Tests of BaseClassifier.
 
 import pytest
 import os.path
+import types
 from lightkurve import TessLightCurve
-from astropy.table import Table
 import numpy as np
 import conftest # noqa: F401
-from starclass import BaseClassifier, TaskManager, get_trainingset
+from starclass import BaseClassifier, TaskManager, STATUS, get_trainingset
 from starclass.features.powerspectrum import powerspectrum
+from starclass.features.freqextr import freqtable
 from starclass.plots import plt, plots_interactive
 from starclass.training_sets.testing_tset import testing_tset
 
@@ -63,7 +64,7 @@ def test_baseclassifier_load_star(PRIVATE_INPUT_DIR, linfit):
 				# Check the complex objects:
 				assert isinstance(feat['lightcurve'], TessLightCurve)
 				assert isinstance(feat['powerspectrum'], powerspectrum)
-				assert isinstance(feat['frequencies'], Table)
+				assert isinstance(feat['frequencies'], freqtable)
 
 				# Check "transfered" features:
 				assert feat['priority'] == 17
@@ -116,6 +117,115 @@ def test_baseclassifier_load_star(PRIVATE_INPUT_DIR, linfit):
 				else:
 					assert 'detrend_coeff' not in feat
 
+#--------------------------------------------------------------------------------------------------
+def test_baseclassifier_load_star_lazy(tmpdir):
+
+	# Create simple lightcurve file:
+	np.random.seed(42)
+	time = np.arange(0, 27, 1800/86400)
+	flux = 300*np.sin(2*np.pi*time/1.3) + 50*np.random.randn(len(time))
+	fname = os.path.join(tmpdir, 'lightcurve.txt')
+	np.savetxt(fname, np.column_stack((time, flux, 50*np.ones_like(time))))
+
+	with BaseClassifier() as cl:
+		task = {'priority': 1, 'starid': 1, 'tmag': None, 'variance': None, 'rms_hour': None, 'ptp': None, 'other_classifiers': None, 'lightcurve': fname}
+		feat = cl.load_star(task)
+
+		# Nothing should have been calculated yet:
+		assert not feat.is_evaluated('lightcurve')
+		assert not feat.is_evaluated('powerspectrum')
+		assert 'Fp07' in feat
+
+		# Accessing FliPer features will trigger the powerspectrum, but not the frequencies:
+		assert np.isfinite(feat['Fp07'])
+		assert feat.is_evaluated('lightcurve')
+		assert feat.is_evaluated('powerspectrum')
+		assert not feat.is_evaluated('freq1')
+
+		# Evaluate all common features, as they would be saved in the MOAT:
+		feat.evaluate()
+		features_common = {key: value for key, value in feat.items() if np.isscalar(value) and key not in ('priority', 'starid')}
+
+		# A star with all common features cached should never load the lightcurve:
+		task['lightcurve'] = os.path.join(tmpdir, 'does-not-exist.txt')
+		task['features_common'] = features_common
+		feat2 = cl.load_star(task)
+		for key, value in features_common.items():
+			np.testing.assert_array_equal(feat2[key], value)
+		assert isinstance(feat2['frequencies'], freqtable)
+		np.testing.assert_array_equal(feat2['frequencies']['frequency'], feat['frequencies']['frequency'])
+		assert not feat2.is_evaluated('lightcurve')
+		with pytest.raises(OSError):
+			feat2['lightcurve']
+
+#--------------------------------------------------------------------------------------------------
+def test_baseclassifier_classify_lazy(tmpdir):
+
+	# Create simple lightcurve file:
+	np.random.seed(42)
+	time = np.arange(0, 27, 1800/86400)
+	flux = 300*np.sin(2*np.pi*time/1.3) + 50*np.random.randn(len(time))
+	fname = os.path.join(tmpdir, 'lightcurve.txt')
+	np.savetxt(fname, np.column_stack((time, flux, 50*np.ones_like(time))))
+
+	with BaseClassifier() as cl:
+		cl.tset = types.SimpleNamespace(key='testing')
+		cl.classifier_key = 'slosh'
+
+		# Classifier only using the FliPer features:
+		def do_classify(features):
+			assert np.isfinite(features['Fp07'])
+			return {cl.StellarClasses.SOLARLIKE: 1.0}, None
+		cl.do_classify = do_classify
+
+		task = {'priority': 1, 'starid': 1, 'tmag': None, 'variance': None, 'rms_hour': None, 'ptp': None, 'other_classifiers': None, 'lightcurve': fname}
+		result = cl.classify(task)
+		print(result)
+		assert result['status'] == STATUS.OK
+
+		# Only the features used by the classifier should have been calculated and saved:
+		assert 'Fp07' in result['features_common']
+		assert 'freq1' not in result['features_common']
+
+#--------------------------------------------------------------------------------------------------
+def test_baseclassifier_classify_many_lazy(tmpdir):
+
+	# Create simple lightcurve files:
+	np.random.seed(42)
+	time = np.arange(0, 27, 1800/86400)
+	tasks = []
+	for k in range(2):
+		flux = 300*np.sin(2*np.pi*time/(1.3 + k)) + 50*np.random.randn(len(time))
+		fname = os.path.join(tmpdir, 'lightcurve%d.txt' % k)
+		np.savetxt(fname, np.column_stack((time, flux, 50*np.ones_like(time))))
+		tasks.append({'priority': k+1, 'starid': k+1, 'tmag': None, 'variance': None, 'rms_hour': None, 'ptp': None, 'other_classifiers': None, 'lightcurve': fname})
+
+	with BaseClassifier() as cl:
+		cl.tset = types.SimpleNamespace(key='testing')
+		cl.classifier_key = 'slosh'
+
+		# Classifier only using the FliPer features, evaluated once for the whole batch:
+		calls = []
+
+		def do_classify_many(features):
+			calls.append(len(features))
+			assert all(np.isfinite(feat['Fp07']) for feat in features)
+			return [{cl.StellarClasses.SOLARLIKE: 1.0}]*len(features), [None]*len(features)
+
+		cl.do_classify_many = do_classify_many
+
+		results = cl.classify_many(tasks)
+		assert calls == [2]
+		for task, result in zip(tasks, results):
+			print(result)
+			assert result['priority'] == task['priority']
+			assert result['status'] == STATUS.OK
+			assert result['elaptime'] > 0
+
+			# Only the features used by the classifier should have been calculated and saved:
+			assert 'Fp07' in result['features_common']
+			assert 'freq1' not in result['features_common']
+
 #--------------------------------------------------------------------------------------------------
 def test_linfit(PRIVATE_INPUT_DIR):
 
@@ -10,8 +10,10 @@ Common tests of all classifiers, excluding the Meta Classifier.
 import pytest
 import tempfile
 import os
+import itertools
 import conftest # noqa: F401
 import starclass
+from starclass import STATUS
 from starclass.training_sets.testing_tset import testing_tset
 
 AVALIABLE_CLASSIFIERS = list(starclass.classifier_list)
@@ -55,6 +57,18 @@ def test_classifiers_train_test(classifier):
 			# Run testing phase:
 			cl.test(tset)
 
+			# Classifying several stars together should give the same results as one by one:
+			tasks = list(itertools.islice(tset.features_test(), 3))
+			results = cl.classify_many(tasks)
+			assert len(results) == len(tasks)
+			for task, result in zip(tasks, results):
+				result1 = cl.classify(task)
+				assert result['priority'] == task['priority']
+				assert result['status'] == STATUS.OK
+				assert result1['status'] == STATUS.OK
+				for key, value in result1['starclass_results'].items():
+					assert result['starclass_results'][key] == pytest.approx(value)
+
 #--------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
 	pytest.main([__file__])
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of star-major processing of classifiers.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import pytest
+from astropy.table import Table
+import conftest # noqa: F401
+from starclass import STATUS
+from starclass.StellarClasses import StellarClassesLevel1
+from starclass.classify_star import other_classifiers_table
+
+#--------------------------------------------------------------------------------------------------
+def test_other_classifiers_table():
+
+	# Results already saved in the TODO-file:
+	saved = Table(
+		rows=[
+			['rfgc', StellarClassesLevel1.ECLIPSE, 0.4],
+			['rfgc', StellarClassesLevel1.SOLARLIKE, 0.6],
+			['xgb', StellarClassesLevel1.SOLARLIKE, 1.0],
+		],
+		names=('classifier', 'class', 'prob')
+	)
+
+	# New results which have not been saved yet:
+	results = [
+		{'classifier': 'xgb', 'status': STATUS.OK, 'starclass_results': {
+			StellarClassesLevel1.SOLARLIKE: 0.3,
+			StellarClassesLevel1.ECLIPSE: 0.7
+		}},
+		{'classifier': 'slosh', 'status': STATUS.OK, 'starclass_results': {
+			StellarClassesLevel1.SOLARLIKE: 1.0
+		}},
+		{'classifier': 'sortinghat', 'status': STATUS.ERROR},
+	]
+
+	tab = other_classifiers_table(saved, results)
+	print(tab)
+	assert list(tab.colnames) == ['classifier', 'class', 'prob']
+
+	# Rows are ordered by classifier and class name, and the new results replace
+	# the saved results for the same classifier:
+	assert list(tab['classifier']) == ['rfgc', 'rfgc', 'slosh', 'xgb', 'xgb']
+	assert list(tab['class']) == [StellarClassesLevel1.ECLIPSE, StellarClassesLevel1.SOLARLIKE,
+		StellarClassesLevel1.SOLARLIKE, StellarClassesLevel1.ECLIPSE, StellarClassesLevel1.SOLARLIKE]
+	assert list(tab['prob']) == [0.4, 0.6, 1.0, 0.7, 0.3]
+
+	# Without any results:
+	tab = other_classifiers_table(Table(names=('classifier', 'class', 'prob')), [])
+	assert len(tab) == 0
+
+#--------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	pytest.main([__file__])
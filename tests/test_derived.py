@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of derived products shared between the classifiers.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import pytest
+import numpy as np
+from lightkurve import TessLightCurve
+import conftest # noqa: F401
+from starclass.features.featuregraph import featuregraph
+from starclass.features import derived
+from starclass.features.phasefold import EBperiod, phasefold
+
+#--------------------------------------------------------------------------------------------------
+@pytest.fixture
+def lightcurve():
+	np.random.seed(42)
+	time = np.arange(0, 27, 1800/86400)
+	flux = 300*np.sin(2*np.pi*time/1.3) + 50*np.random.randn(len(time)) + 20*time
+	flux[100:110] = np.NaN
+	return TessLightCurve(time=time, flux=flux, flux_err=50*np.ones_like(time))
+
+#--------------------------------------------------------------------------------------------------
+def test_featuregraph_product():
+
+	calls = []
+
+	def func():
+		calls.append(1)
+		return 42
+
+	features = featuregraph()
+	assert features.product(('answer', 1), func) == 42
+	assert features.product(('answer', 1), func) == 42
+	assert calls == [1]
+
+	# Products are not features:
+	assert ('answer', 1) not in features
+	assert len(features) == 0
+
+#--------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('linflatten', [False, True])
+def test_relative_lightcurve(lightcurve, linflatten):
+
+	lc = derived.prepare_lightcurve(lightcurve, linflatten=linflatten)
+	assert np.all(np.isfinite(lc.flux))
+	if not linflatten:
+		np.testing.assert_allclose(lc.flux, 1e-6*lightcurve.remove_nans().flux + 1)
+
+	# Calculated only once, when features are a featuregraph:
+	features = featuregraph({'lightcurve': lightcurve})
+	lc2 = derived.relative_lightcurve(features, linflatten=linflatten)
+	assert derived.relative_lightcurve(features, linflatten=linflatten) is lc2
+	np.testing.assert_array_equal(lc2.flux, lc.flux)
+
+	# Plain dicts gives the same result:
+	lc3 = derived.relative_lightcurve({'lightcurve': lightcurve}, linflatten=linflatten)
+	np.testing.assert_array_equal(lc3.flux, lc.flux)
+
+#--------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('per', [0.77, 1.3, 2.6])
+def test_period_products(lightcurve, per):
+
+	features = featuregraph({'lightcurve': lightcurve})
+	lc = derived.prepare_lightcurve(lightcurve)
+
+	# Should be identical to calculating directly from the lightcurve:
+	assert derived.ebperiod(features, per) == EBperiod(lc.time, lc.flux, per, linflatten=True)
+	np.testing.assert_array_equal(derived.phase_order(features, per), np.argsort(phasefold(lc.time, per)))
+
+	folded = lc.fold(period=per)
+	lc_folded = derived.relative_lightcurve(features)[derived.fold_order(features, per)]
+	np.testing.assert_array_equal(lc_folded.flux, folded.flux)
+	np.testing.assert_array_equal(lc_folded.time, folded.time_original)
+
+#--------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	pytest.main([__file__])
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of lazily evaluated features.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import pytest
+import pickle
+import conftest # noqa: F401
+from starclass.features.featuregraph import featuregraph
+
+#--------------------------------------------------------------------------------------------------
+def test_featuregraph():
+
+	calls = []
+
+	def stage_a(features):
+		calls.append('a')
+		return {'a': 1, 'a2': 2}
+
+	def stage_b(features):
+		calls.append('b')
+		return {'b': features['a'] + 10}
+
+	features = featuregraph({'c': 3})
+	features.add_stage('a', ['a', 'a2'], stage_a)
+	features.add_stage('b', ['b'], stage_b)
+	assert features.stages == ['a', 'b']
+
+	with pytest.raises(ValueError):
+		features.add_stage('a', ['x'], stage_a)
+
+	# Nothing is evaluated to begin with:
+	assert calls == []
+	assert dict(features) == {'c': 3}
+	assert len(features) == 1
+	assert set(features.provided_keys()) == {'a', 'a2', 'b', 'c'}
+	assert 'a' in features and 'b' in features and 'c' in features
+	assert 'x' not in features
+	assert not features.is_evaluated('a')
+
+	# Evaluating stage b, should trigger stage a:
+	assert features['b'] == 11
+	assert calls == ['b', 'a']
+	assert features.is_evaluated('a') and features.is_evaluated('a2')
+	assert features.get('a2') == 2
+	assert features.get('x', 42) == 42
+	with pytest.raises(KeyError):
+		features['x']
+
+	# Stages are only evaluated once:
+	features.evaluate()
+	assert features['a'] == 1
+	assert calls == ['b', 'a']
+	assert dict(features) == {'a': 1, 'a2': 2, 'b': 11, 'c': 3}
+
+	# Pickling only keeps the evaluated features:
+	features2 = pickle.loads(pickle.dumps(features))
+	assert isinstance(features2, featuregraph)
+	assert dict(features2) == dict(features)
+	assert features2.stages == []
+
+#--------------------------------------------------------------------------------------------------
+def test_featuregraph_cached():
+
+	calls = []
+
+	def stage_a(features):
+		calls.append('a')
+		return {'a': 1, 'a2': 2}
+
+	# Features already available are not recalculated:
+	features = featuregraph({'a': 5, 'a2': 6})
+	features.add_stage('a', ['a', 'a2'], stage_a)
+	assert features['a'] == 5
+	features.evaluate(['a2'])
+	assert calls == []
+
+	# Only missing features of a stage are filled in:
+	del features['a2']
+	features.evaluate(['a2', 'nonexistent'])
+	assert calls == ['a']
+	assert dict(features) == {'a': 5, 'a2': 2}
+
+#--------------------------------------------------------------------------------------------------
+def test_featuregraph_circular():
+	features = featuregraph()
+	features.add_stage('a', ['a'], lambda f: {'a': f['b']})
+	features.add_stage('b', ['b'], lambda f: {'b': f['a']})
+	with pytest.raises(RuntimeError):
+		features['a']
+
+#--------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	pytest.main([__file__])
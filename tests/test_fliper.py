@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of FliPer features.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import pytest
+import numpy as np
+import lightkurve as lk
+from astropy.units import cds
+import conftest # noqa: F401
+from starclass.features.fliper import FliPer, band_means, default_bands
+from starclass.features.powerspectrum import powerspectrum
+
+#--------------------------------------------------------------------------------------------------
+def test_band_means():
+
+	freq = np.arange(1, 11, dtype='float64')
+	power = np.arange(1, 11, dtype='float64')
+
+	means = band_means(freq, power, [(1, 10), (2, 4), (2.5, 3.5), (20, 30)])
+	np.testing.assert_allclose(means[:3], [5.5, 3, 3])
+	assert np.isnan(means[3])
+
+	# Several spectra at once:
+	means = band_means(freq, np.vstack((power, 2*power)), [(1, 10), (2, 4)])
+	np.testing.assert_allclose(means, [[5.5, 3], [11, 6]])
+
+#--------------------------------------------------------------------------------------------------
+def test_fliper():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	flux = 10*np.random.randn(len(time))
+	lc = lk.TessLightCurve(time=time, flux=flux, flux_unit=cds.ppm)
+	ps = powerspectrum(lc)
+
+	features = FliPer(ps)
+	assert set(features.keys()) == set(default_bands.keys()) | {'FpWhite'}
+	for key, (low, high) in default_bands.items():
+		freq, power = ps.standard
+		indx = (freq >= low) & (freq <= high)
+		np.testing.assert_allclose(features[key], np.mean(power[indx]) - features['FpWhite'])
+
+	# Batch of spectra and custom bands:
+	freq, power = ps.standard
+	bands = {'Fp1': (1, 2), 'Fp2': (2, 3)}
+	batch = FliPer((freq, np.vstack((power, 4*power))), bands=bands)
+	assert set(batch.keys()) == {'Fp1', 'Fp2', 'FpWhite'}
+	single = FliPer((freq, power), bands=bands)
+	for key in batch:
+		assert batch[key].shape == (2,)
+		np.testing.assert_allclose(batch[key], [single[key], 4*single[key]])
+
+#--------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	pytest.main([__file__])
@@ -12,8 +12,9 @@ import lightkurve as lk
 from astropy.units import cds
 from astropy.table import Table
 import conftest # noqa: F401
-from starclass.features.freqextr import freqextr, freqextr_table_from_dict, freqextr_table_to_dict
-from starclass.features.powerspectrum import powerspectrum
+from starclass.features.freqextr import (freqextr, freqtable, freqextr_table_from_dict, freqextr_table_to_dict,
+	residual_spectrum, noise_background, model)
+from starclass.features.powerspectrum import powerspectrum, timegrid_cache, grid_cache, standard_powerspectra, regular_cadence
 from starclass.plots import plt, plots_interactive
 
 tol_freq = {'atol': 0.001, 'rtol': 0.001}
@@ -186,6 +187,410 @@ def test_freqextr():
 	np.testing.assert_allclose(peak1['amplitude'], 12, **tol_amp)
 	np.testing.assert_allclose(peak1['phase'], 0.32, **tol_phase)
 
+#--------------------------------------------------------------------------------------------------
+def test_freqextr_snrlim():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = 10*np.sin(50*omega)
+	flux += 12*np.sin(91.3*omega + 0.32)
+	flux += 2.4*np.random.randn(len(time))
+
+	lc = lk.TessLightCurve(time=time, flux=flux)
+
+	# The limit on the signal-to-noise should stop the extraction after the two real peaks:
+	tab = freqextr(lc, n_peaks=4, n_harmonics=0, snrlim=4)
+	_summary(lc, tab)
+
+	assert tab.meta['snrlim'] == 4
+	np.testing.assert_allclose(tab[0]['frequency'], 91.3, **tol_freq)
+	np.testing.assert_allclose(tab[1]['frequency'], 50, **tol_freq)
+	assert np.all(np.isfinite(tab['frequency'][0:2]))
+	assert allnan(tab['frequency'][2:])
+
+#--------------------------------------------------------------------------------------------------
+def test_freqextr_joint():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = 10*np.sin(50*omega)
+	flux += 3*np.sin(89*omega)
+	flux += 12*np.sin(91.3*omega + 0.32)
+	flux += 6*np.sin(2*91.3*omega + 0.32)
+	flux += 2.4*np.random.randn(len(time))
+
+	lc = lk.TessLightCurve(time=time, flux=flux, flux_unit=cds.ppm)
+
+	with pytest.raises(ValueError):
+		freqextr(lc, optim_method='nonsense')
+
+	tab = freqextr(lc, n_peaks=4, n_harmonics=2, optim_method='joint')
+	_summary(lc, tab)
+
+	# The table should have the same format as the sequential optimization:
+	tab2 = freqextr(lc, n_peaks=4, n_harmonics=2, optim_method='sequential')
+	assert tab.colnames == tab2.colnames
+	assert tab.meta.keys() == tab2.meta.keys()
+
+	for f, a in [(91.3, 12), (50, 10), (89, 3)]:
+		peak = tab[np.nanargmin(np.abs(tab['frequency'] - f))]
+		assert peak['harmonic'] == 0
+		np.testing.assert_allclose(peak['frequency'], f, **tol_freq)
+		np.testing.assert_allclose(peak['amplitude'], a, **tol_amp)
+
+	# The harmonic should be refitted as well:
+	peak = tab[(tab['num'] == 1) & (tab['harmonic'] == 1)][0]
+	np.testing.assert_allclose(peak['frequency'], 2*91.3, **tol_freq)
+	np.testing.assert_allclose(peak['amplitude'], 6, **tol_amp)
+
+#--------------------------------------------------------------------------------------------------
+def test_freqextr_coarse():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	time = time[(time < 13) | (time > 14.2)]
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = 10*np.sin(50*omega)
+	flux += 2*np.sin(100*omega)
+	flux += 3*np.sin(89*omega)
+	flux += 12*np.sin(91.3*omega + 0.32)
+	flux += 2.4*np.random.randn(len(time))
+
+	lc = lk.TessLightCurve(time=time, flux=flux, flux_unit=cds.ppm)
+
+	with pytest.raises(ValueError):
+		freqextr(lc, search_method='nonsense')
+
+	tab = freqextr(lc, n_peaks=6, n_harmonics=1, search_method='coarse')
+	_summary(lc, tab)
+
+	# The selected peaks should match the search on the full oversampled grid:
+	tab2 = freqextr(lc, n_peaks=6, n_harmonics=1, search_method='full')
+	assert tab.colnames == tab2.colnames
+	np.testing.assert_allclose(tab['frequency'], tab2['frequency'], **tol_freq)
+	np.testing.assert_allclose(tab['amplitude'], tab2['amplitude'], **tol_amp)
+
+	peak1 = tab[0]
+	np.testing.assert_allclose(peak1['frequency'], 91.3, **tol_freq)
+	np.testing.assert_allclose(peak1['amplitude'], 12, **tol_amp)
+
+#--------------------------------------------------------------------------------------------------
+def test_noise_background():
+
+	np.random.seed(42)
+	df = 0.43
+	frequency = np.arange(df/4, 4000, df/4)
+	power = np.random.exponential(size=len(frequency)) * (1 + 100/frequency)
+
+	noise = noise_background(frequency, df, 4000)
+	background = noise(power)
+	assert background.shape == frequency.shape
+
+	# Compare to medians calculated directly in the bins:
+	halfwidth = 0.5*(noise.bins[1] - noise.bins[0])
+	for b in noise.bins:
+		indx = (frequency >= b - halfwidth) & (frequency < b + halfwidth)
+		assert np.sum(indx) >= 20
+		np.testing.assert_allclose(np.interp(b, frequency, background), np.median(power[indx]), rtol=1e-4)
+
+	# Removing a peak should only change the background in the affected bin:
+	power2 = power.copy()
+	power2[10000:10100] = 0
+	background2 = noise(power2)
+	np.testing.assert_allclose(background2, noise_background(frequency, df, 4000)(power2))
+	assert not np.allclose(background2, background)
+
+	# Tiny changes below the tolerance should leave the background untouched:
+	background3 = noise(power2 * (1 + 1e-6))
+	np.testing.assert_array_equal(background3, background2)
+
+#--------------------------------------------------------------------------------------------------
+def test_freqtable():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = 12*np.sin(91.3*omega + 0.32) + 6*np.sin(2*91.3*omega + 0.32) + 10*np.sin(50*omega)
+	flux += 2.4*np.random.randn(len(time))
+	lc = lk.TessLightCurve(time=time, flux=flux, flux_unit=cds.ppm)
+
+	ft = freqextr(lc, n_peaks=4, n_harmonics=2, as_table=False)
+	tab = freqextr(lc, n_peaks=4, n_harmonics=2)
+	assert isinstance(ft, freqtable)
+	assert ft.data.shape == (4, 3)
+	assert ft.n_peaks == 4
+	assert ft.n_harmonics == 2
+	assert len(ft) == len(tab)
+	assert ft.colnames == tab.colnames
+	assert ft.meta.keys() == tab.meta.keys()
+
+	# Columns and masks should behave like the table:
+	for col in tab.colnames:
+		np.testing.assert_array_equal(ft[col], tab[col])
+	rows = ft[ft['harmonic'] == 0]
+	np.testing.assert_array_equal(rows['frequency'], tab[tab['harmonic'] == 0]['frequency'])
+
+	# Direct lookup of individual peaks:
+	peak = ft.peak(1, 1)
+	assert peak['num'] == 1
+	assert peak['harmonic'] == 1
+	np.testing.assert_allclose(peak['frequency'], 2*91.3, **tol_freq)
+	np.testing.assert_array_equal(ft.harmonics(2)['num'], [2, 2, 2])
+	np.testing.assert_array_equal(ft.harmonics(2)['harmonic'], [0, 1, 2])
+
+	# Conversions:
+	tab2 = ft.to_table()
+	assert tab2.colnames == tab.colnames
+	assert tab2.dtype == tab.dtype
+	assert tab2['amplitude'].unit == cds.ppm
+	ft2 = freqtable.from_table(tab)
+	for col in ft.colnames:
+		np.testing.assert_array_equal(ft2.data[col], ft.data[col])
+	assert ft2.flux_unit == cds.ppm
+
+	feat = ft.to_dict()
+	feat2 = freqextr_table_to_dict(tab)
+	assert feat.keys() == feat2.keys()
+	np.testing.assert_array_equal(list(feat.values()), list(feat2.values()))
+	ft3 = freqtable.from_dict(feat, flux_unit=cds.ppm)
+	assert ft3.data.shape == ft.data.shape
+	for col in ('frequency', 'amplitude', 'phase', 'alpha', 'beta'):
+		np.testing.assert_allclose(ft3[col], ft[col])
+	assert allnan(ft3['deviation'])
+
+#--------------------------------------------------------------------------------------------------
+def test_residual_spectrum():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	time = time[(time < 13) | (time > 14.2)]
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = 10*np.sin(50*omega) + 3*np.sin(89*omega + 0.5) + 2.4*np.random.randn(len(time))
+	lc = lk.TessLightCurve(time=time, flux=flux, flux_unit=cds.ppm)
+
+	ps = powerspectrum(lc)
+	residual = residual_spectrum(ps, oversampling=4, nyquist_factor=1)
+
+	# Before anything is removed, it should match the original powerspectrum:
+	frequency, power = residual.powerspectrum()
+	frequency2, power2 = ps.powerspectrum(oversampling=4, nyquist_factor=1)
+	np.testing.assert_allclose(frequency, frequency2)
+	np.testing.assert_allclose(power, power2, rtol=1e-5, atol=1e-5*np.max(power2))
+
+	# Remove two sinusoids and add one back:
+	residual.subtract(10, 0, 50)
+	residual.subtract(3*np.cos(0.5), 3*np.sin(0.5), 89)
+	residual.add(1, 2, 120)
+	lc2 = lc - model(lc.time, 10, 0, 50) - model(lc.time, 3*np.cos(0.5), 3*np.sin(0.5), 89) + model(lc.time, 1, 2, 120)
+
+	# Compare to powerspectrum recomputed from scratch:
+	ps2 = powerspectrum(lc2)
+	frequency, power = residual.powerspectrum(scale=None)
+	frequency2, power2 = ps2.powerspectrum(oversampling=4, nyquist_factor=1, scale=None)
+	np.testing.assert_allclose(frequency, frequency2)
+	np.testing.assert_allclose(residual.normfactor, ps2.normfactor, rtol=1e-4)
+	np.testing.assert_allclose(power, power2, rtol=1e-5, atol=1e-5*np.max(power2))
+
+#--------------------------------------------------------------------------------------------------
+def test_powerspectrum_parent():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = 10*np.sin(50*omega) + 2.4*np.random.randn(len(time))
+	lc = lk.TessLightCurve(time=time, flux=flux, flux_unit=cds.ppm)
+	lc2 = lc - model(lc.time, 10, 0, 50)
+
+	ps = powerspectrum(lc)
+	ps2 = powerspectrum(lc2)
+	residual = powerspectrum(lc2, parent=ps)
+
+	# Properties only depending on the timestamps are taken from the parent:
+	assert residual.df == ps.df
+	assert residual.nyquist == ps.nyquist
+	assert residual.normfactor == ps.normfactor
+
+	# The standard spectrum is only calculated when requested:
+	assert residual._standard is None
+	np.testing.assert_allclose(residual.standard[0], ps2.standard[0])
+	np.testing.assert_allclose(residual.standard[1], ps2.standard[1]*ps.normfactor/ps2.normfactor)
+
+	# Peak optimization does not depend on the normalization:
+	np.testing.assert_allclose(residual.optimize_peak(50), ps2.optimize_peak(50))
+	np.testing.assert_allclose(residual.alpha_beta(50), ps2.alpha_beta(50))
+
+#--------------------------------------------------------------------------------------------------
+def test_powerspectrum_timegrid():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	lc1 = lk.TessLightCurve(time=time, flux=2.4*np.random.randn(len(time)), flux_unit=cds.ppm)
+	lc2 = lk.TessLightCurve(time=time, flux=10*np.sin(time) + np.random.randn(len(time)), flux_unit=cds.ppm)
+
+	grid_cache.clear()
+	ps1 = powerspectrum(lc1)
+	assert len(grid_cache) == 1
+	ps2 = powerspectrum(lc2)
+	assert len(grid_cache) == 1
+	assert ps1.timegrid is ps2.timegrid
+	assert ps1.df == ps2.df
+	assert ps1.nyquist == ps2.nyquist
+
+	# Spectrum using the shared terms should match the one calculated by astropy:
+	frequency, power = ps2.powerspectrum(oversampling=4, scale=None)
+	power2 = ps2.ls.power(frequency*1e-6, normalization='psd', method='slow')
+	np.testing.assert_allclose(power, power2, rtol=1e-10, atol=1e-10*np.max(power2))
+
+	# A different time grid gives a new entry in the cache:
+	lc3 = lc1[10:]
+	ps3 = powerspectrum(lc3)
+	assert len(grid_cache) == 2
+	assert ps3.timegrid is not ps1.timegrid
+
+	# Eviction of the least recently used time grids:
+	cache = timegrid_cache(maxsize=2)
+	g1 = cache.get(ps1.ls.t)
+	g3 = cache.get(ps3.ls.t)
+	assert cache.get(ps1.ls.t) is g1
+	cache.get(ps1.ls.t[5:])
+	assert len(cache) == 2
+	assert cache.get(ps1.ls.t) is g1
+	assert cache.get(ps3.ls.t) is not g3
+
+	# Window terms are only kept for a limited number of frequency grids:
+	g1.maxgrids = 1
+	terms = g1.window_terms(1e-6, 1e-7, 100)
+	assert g1.window_terms(1e-6, 1e-7, 100) is terms
+	g1.window_terms(1e-6, 1e-7, 200)
+	assert g1.window_terms(1e-6, 1e-7, 100) is not terms
+
+#--------------------------------------------------------------------------------------------------
+def test_powerspectrum_regular():
+
+	np.random.seed(42)
+	cadenceno = np.arange(1000, 1000 + 27*48)
+	time = 1325 + (cadenceno - 1000)*1800/86400
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = 10*np.sin(50*omega) + 2.4*np.random.randn(len(time))
+
+	# Remove random points and a large gap:
+	indx = (np.random.rand(len(time)) > 0.1) & ((time < 1338) | (time > 1339))
+	lc = lk.TessLightCurve(time=time[indx], flux=flux[indx], cadenceno=cadenceno[indx], flux_unit=cds.ppm)
+
+	# Timestamps on the regular grid are detected, with and without cadence numbers:
+	index, t0, cadence, offset = regular_cadence(lc.time*86400, lc.cadenceno)
+	np.testing.assert_array_equal(index, lc.cadenceno - 1000)
+	np.testing.assert_allclose(t0, 1325*86400)
+	np.testing.assert_allclose(cadence, 1800)
+	np.testing.assert_allclose(offset, 0, atol=1e-6)
+	np.testing.assert_array_equal(regular_cadence(lc.time*86400)[0], index)
+
+	# Irregular timestamps are not:
+	assert regular_cadence(np.sort(np.random.uniform(0, 27*86400, len(lc.time)))) is None
+
+	# The regular cadence is used to calculate the exact power spectrum:
+	ps = powerspectrum(lc)
+	assert ps.timegrid.cadence is not None
+	frequency, power = ps.powerspectrum(oversampling=4, scale=None)
+	power2 = ps.ls.power(frequency*1e-6, normalization='psd', method='slow')
+	np.testing.assert_allclose(power, power2, rtol=1e-10, atol=1e-10*np.max(power2))
+
+#--------------------------------------------------------------------------------------------------
+def test_powerspectrum_barycentric():
+
+	np.random.seed(42)
+	cadenceno = np.arange(1000, 1000 + 6*720)
+	time = 1325 + (cadenceno - 1000)*120/86400
+
+	# Barycentric correction, varying with the orbit of the Earth, and jitter:
+	time += (500*np.cos(2*np.pi*(time - 1300)/365.25) + np.random.uniform(-2.6, 2.6, len(time)))/86400
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = 10*np.sin(500*omega) + 2.4*np.random.randn(len(time))
+	lc = lk.TessLightCurve(time=time, flux=flux, cadenceno=cadenceno, flux_unit=cds.ppm)
+
+	# The timestamps are placed on a regular grid, with offsets of a few seconds:
+	index, t0, cadence, offset = regular_cadence(lc.time*86400, lc.cadenceno)
+	np.testing.assert_array_equal(index, cadenceno - 1000)
+	np.testing.assert_allclose(cadence, 120, rtol=1e-4)
+	np.testing.assert_allclose(t0 + index*cadence + offset, lc.time*86400)
+	assert 2 < np.max(np.abs(offset)) < 4
+	np.testing.assert_array_equal(regular_cadence(lc.time*86400)[0], index)
+
+	# The offsets are corrected for, giving an error on the power spectrum far
+	# below that of the approximate sums used by astropy:
+	ps = powerspectrum(lc)
+	assert ps.timegrid.cadence is not None
+	frequency, power = ps.powerspectrum(oversampling=4, scale=None)
+	power2 = ps.ls.power(frequency*1e-6, normalization='psd', method='slow')
+	power3 = ps.ls.power(frequency*1e-6, normalization='psd', method='fast')
+	np.testing.assert_allclose(power, power2, rtol=1e-5, atol=1e-8*np.max(power2))
+	assert np.max(np.abs(power - power2)) < 1e-3*np.max(np.abs(power3 - power2))
+
+#--------------------------------------------------------------------------------------------------
+def test_powerspectrum_optimize_peaks():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	time = time[(time < 13) | (time > 14.2)]
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = 10*np.sin(50.03*omega) + 4*np.sin(91.31*omega + 1) + 3*np.sin(140.7*omega) + np.random.randn(len(time))
+	lc = lk.TessLightCurve(time=time, flux=flux, flux_unit=cds.ppm)
+	ps = powerspectrum(lc)
+
+	# Direct evaluation of the power should match astropy:
+	freq = np.linspace(1, 200, 50)
+	np.testing.assert_allclose(ps.power_direct(freq*1e-6), ps.ls.power(freq*1e-6, normalization='psd', method='slow'), rtol=1e-10)
+
+	# Optimize all peaks at once, starting from rough guesses:
+	fmax = np.array([50.1, 91.2, 140.5])
+	nu = ps.optimize_peaks(fmax)
+	np.testing.assert_allclose(nu, [50.03, 91.31, 140.7], atol=0.01)
+
+	# The result should be the maximum to within the tolerance:
+	p = ps.power_direct(nu*1e-6)
+	assert np.all(p >= ps.power_direct((nu - 1e-4)*1e-6))
+	assert np.all(p >= ps.power_direct((nu + 1e-4)*1e-6))
+
+	# Same results one peak at a time and when given a bracket:
+	for k, f in enumerate(fmax):
+		np.testing.assert_allclose(ps.optimize_peak(f), nu[k], atol=1e-5)
+		np.testing.assert_allclose(ps.optimize_peak([nu[k]-0.1, nu[k]-0.02, nu[k]+0.1]), nu[k], atol=1e-5)
+
+	# If the peak is outside the bracket, the result is at the edge of the bracket:
+	np.testing.assert_allclose(ps.optimize_peak([49.8, 49.9, 50.0]), 50.0, atol=1e-5)
+
+#--------------------------------------------------------------------------------------------------
+def test_standard_powerspectra():
+
+	np.random.seed(42)
+	time = np.arange(0, 27.0, 1800/86400)
+	time = time[(time < 13) | (time > 14.2)]
+	omega = 2 * np.pi * 86400e-6 * time
+	flux = np.random.randn(6, len(time)) * np.arange(1, 7)[:, np.newaxis]
+	flux += 10*np.sin(np.outer(np.arange(20, 80, 10), omega))
+
+	# Stars with different missing data:
+	flux[2, 100:120] = np.nan
+	flux[3, 100:120] = np.nan
+	flux[4, -50:] = np.nan
+
+	spectra = standard_powerspectra(time, flux)
+	assert len(spectra) == flux.shape[0]
+	for k, (freq, psd) in enumerate(spectra):
+		lc = lk.TessLightCurve(time=time, flux=flux[k, :], flux_unit=cds.ppm)
+		freq2, psd2 = powerspectrum(lc).standard
+		np.testing.assert_allclose(freq, freq2)
+		np.testing.assert_allclose(psd, psd2, rtol=1e-10, atol=1e-10*np.max(psd2))
+
+	# Stars with the same missing data share the frequency axis:
+	assert spectra[2][0] is spectra[3][0]
+	assert len(spectra[4][0]) < len(spectra[0][0])
+
+	with pytest.raises(ValueError):
+		standard_powerspectra(time, flux[:, 1:])
+
 #--------------------------------------------------------------------------------------------------
 def test_freqextr_kepler():
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of multiscale sample entropy used by the SORTING-HAT classifier.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import pytest
+import numpy as np
+import conftest # noqa: F401
+from starclass.SortingHatClassifier.Sorting_Hat_featcalc import (sample_entropy,
+	multiscale_entropy, compute_multiscale_entropy)
+
+#--------------------------------------------------------------------------------------------------
+def _sample_entropy_loop(x, tolerance):
+	# Reference implementation comparing every template with the rest of the timeseries,
+	# following pyentrp.entropy.sample_entropy with template length 2:
+	n = len(x)
+	N1 = N2 = 0
+	for i in range(n - 2):
+		rem = x[i+1:]
+		hits = np.abs(rem[:len(rem)-1] - x[i]) < tolerance
+		N1 += np.sum(hits)
+		N2 += np.sum(np.abs(rem[1:][hits] - x[i+1]) < tolerance)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return -np.log(np.float64(N2) / np.float64(N1))
+
+#--------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('chunksize', [7, 2**22])
+def test_sample_entropy(chunksize):
+
+	np.random.seed(42)
+	time = np.arange(3000)*2/1440
+	cases = [
+		np.random.randn(3000),
+		1 + 1e-3*np.sin(2*np.pi*time/1.3) + 1e-4*np.random.randn(3000),
+		np.round(3*np.random.randn(2000))/3, # Many identical values
+	]
+	for x in cases:
+		tolerance = 0.1*np.std(x)
+		assert sample_entropy(x, tolerance, chunksize=chunksize) == _sample_entropy_loop(x, tolerance)
+
+	# Too few matching templates:
+	assert np.isnan(sample_entropy(np.ones(10), 0))
+	assert np.isnan(sample_entropy([1.0], 0.1))
+
+#--------------------------------------------------------------------------------------------------
+def test_multiscale_entropy():
+
+	np.random.seed(42)
+	flux = np.random.randn(2000)
+	tolerance = 0.1*np.std(flux)
+
+	mse = multiscale_entropy(flux, maxscale=10)
+	assert mse.shape == (10,)
+	for scale in range(1, 11):
+		b = len(flux) // scale
+		coarse = np.mean(flux[:b*scale].reshape(b, scale), axis=1)
+		assert mse[scale-1] == _sample_entropy_loop(coarse, tolerance)
+
+	mean, max_v, stdev, power = compute_multiscale_entropy(flux)
+	assert mean == np.mean(mse)
+	assert max_v == np.max(mse)
+	assert stdev == np.std(mse)
+	np.testing.assert_allclose(power, np.mean(mse**2))
+
+#--------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	pytest.main([__file__])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the k-nearest neighbour entropy estimators used by the SORTING-HAT classifier.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import pytest
+import numpy as np
+import conftest # noqa: F401
+from starclass.SortingHatClassifier import npeet_entropy_estimators as npeet
+from starclass.SortingHatClassifier.Sorting_Hat_featcalc import compute_differential_entropy
+
+#--------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('k', [1, 3, 5])
+def test_query_neighbors_1d(k):
+
+	np.random.seed(42)
+	for x in (np.random.randn(2000), np.round(np.random.randn(500), 1), np.random.rand(7)):
+		# Compare to the neighbours found from the tree:
+		tree = npeet.build_tree(x.reshape(-1, 1))
+		expected = npeet.query_neighbors(tree, x.reshape(-1, 1), k)
+		np.testing.assert_array_equal(npeet.query_neighbors_1d(x, k), expected)
+
+#--------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('k', [1, 3, 5])
+def test_entropy_1d(k):
+
+	np.random.seed(42)
+	x = np.random.randn(2000)
+
+	# Flat arrays and lists of one-dimensional vectors should give the same results:
+	np.random.seed(1)
+	entr = npeet.entropy(x, k=k)
+	np.random.seed(1)
+	assert npeet.entropy(x.reshape(-1, 1), k=k) == entr
+	np.random.seed(1)
+	assert npeet.entropy([[v] for v in x], k=k) == entr
+	if k == 3:
+		np.random.seed(1)
+		assert compute_differential_entropy(x) == entr
+
+	# Entropy of standard normal distribution, in bits:
+	np.testing.assert_allclose(entr, 0.5*np.log2(2*np.pi*np.e), atol=0.1)
+
+	with pytest.raises(ValueError):
+		npeet.entropy(x[:k], k=k)
+
+#--------------------------------------------------------------------------------------------------
+def test_entropy_2d():
+	# Multi-dimensional samples are still using the tree:
+	np.random.seed(42)
+	x = np.random.randn(2000, 2)
+	entr = npeet.entropy(x)
+	np.testing.assert_allclose(entr, np.log2(2*np.pi*np.e), atol=0.2)
+
+#--------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	pytest.main([__file__])
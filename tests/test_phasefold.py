@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of phase-folding and binning of lightcurves.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import pytest
+import numpy as np
+import conftest # noqa: F401
+from starclass.features.phasefold import phasefold, binPhaseLC, EBperiod, prepFilePhasefold
+
+#--------------------------------------------------------------------------------------------------
+def _binPhaseLC_loop(phase, flux, nbins, cut_outliers=0):
+	# Simple reference implementation looping over the bins:
+	bin_indices = np.digitize(phase, np.arange(nbins)/nbins) - 1
+	binned = np.empty(nbins)
+	for b in range(nbins):
+		inbin = np.where(bin_indices == b)[0]
+		if len(inbin) == 0:
+			binned[b] = np.mean(flux)
+			continue
+		if cut_outliers and len(inbin) > 2:
+			mad = np.median(np.abs(flux[inbin] - np.median(flux[inbin])))
+			inbin = inbin[np.abs(flux[inbin] - np.median(flux[inbin]))/mad <= cut_outliers]
+		binned[b] = np.mean(flux[inbin])
+	return binned
+
+#--------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('cut_outliers', [0, 5])
+def test_binPhaseLC(cut_outliers):
+
+	np.random.seed(42)
+	time = np.sort(np.random.uniform(0, 27, 5000))
+	flux = 1 + 0.01*np.sin(2*np.pi*time/1.3) + 0.001*np.random.randn(len(time))
+	flux[::50] += 0.05
+
+	phase = phasefold(time, 1.3)
+	assert np.all((phase >= 0) & (phase < 1))
+
+	binnedlc = binPhaseLC(phase, flux, 64, cut_outliers=cut_outliers)
+	assert binnedlc.shape == (64, 2)
+	np.testing.assert_allclose(binnedlc[:, 0], (np.arange(64) + 0.5)/64)
+	np.testing.assert_allclose(binnedlc[:, 1], _binPhaseLC_loop(phase, flux, 64, cut_outliers), rtol=1e-12)
+
+	# The order of the points should not matter:
+	indx = np.argsort(phase)
+	np.testing.assert_allclose(binPhaseLC(phase[indx], flux[indx], 64, cut_outliers=cut_outliers), binnedlc, rtol=1e-12)
+
+	# Several periods at once:
+	periods = [0.5, 1.3, 2.6]
+	phases = phasefold(time, periods)
+	assert phases.shape == (3, len(time))
+	binnedlcs = binPhaseLC(phases, flux, 64, cut_outliers=cut_outliers)
+	assert binnedlcs.shape == (3, 64, 2)
+	for k, per in enumerate(periods):
+		np.testing.assert_allclose(binnedlcs[k], binPhaseLC(phasefold(time, per), flux, 64, cut_outliers=cut_outliers), rtol=1e-12)
+
+	# Empty bins are filled with the mean flux:
+	binnedlc = binPhaseLC(phase[:10], flux[:10], 64, cut_outliers=cut_outliers)
+	np.testing.assert_allclose(binnedlc[:, 1], _binPhaseLC_loop(phase[:10], flux[:10], 64, cut_outliers), rtol=1e-12)
+
+#--------------------------------------------------------------------------------------------------
+def test_EBperiod():
+
+	np.random.seed(42)
+	time = np.arange(0, 27, 1800/86400)
+	per = 2.0
+
+	# Eclipsing binary with primary and shallower secondary eclipse:
+	phase = phasefold(time, 2*per)
+	flux = np.ones(len(time)) + 1e-4*np.random.randn(len(time))
+	flux[np.abs(phase - 0.25) < 0.02] -= 0.1
+	flux[np.abs(phase - 0.75) < 0.02] -= 0.05
+	assert EBperiod(time, flux, per) == 2*per
+
+	# Sinusoid at the given period should not be doubled:
+	flux = 1 + 0.01*np.sin(2*np.pi*time/per) + 1e-4*np.random.randn(len(time))
+	assert EBperiod(time, flux, per) == per
+
+	binned, flux_range = prepFilePhasefold(time, flux, per, 64)
+	assert binned.shape == (64,)
+	assert np.min(binned) == 0 and np.max(binned) == 1
+	assert binned[0] == 0
+	np.testing.assert_allclose(flux_range, 0.02, rtol=0.05)
+
+#--------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	pytest.main([__file__])
@@ -8,6 +8,7 @@ Tests of starclass.TaskManager.
 
 import pytest
 import os.path
+import numpy as np
 from astropy.table import Table
 import conftest # noqa: F401
 import starclass
@@ -147,6 +148,141 @@ def test_taskmanager_meta_classifier(PRIVATE_TODO_FILE):
 		assert tab[tab['class'] == StellarClassesLevel1.DSCT_BCEP]['prob'] == 0.1
 		assert tab[tab['class'] == StellarClassesLevel1.ECLIPSE]['prob'] == 0.7
 
+#--------------------------------------------------------------------------------------------------
+def test_taskmanager_get_tasks_batch(PRIVATE_TODO_FILE):
+	"""Test of TaskManager getting several tasks at once"""
+
+	with TaskManager(PRIVATE_TODO_FILE, overwrite=True) as tm:
+		tasks = tm.get_tasks(classifier='slosh', max_tasks=2)
+		print(tasks)
+		assert [task['priority'] for task in tasks] == [17, 26]
+		assert [task['classifier'] for task in tasks] == ['slosh', 'slosh']
+
+		# The tasks are not handed out again once they are started:
+		assert tm.get_task(classifier='slosh')['priority'] == 17
+		tm.start_task(tasks)
+		task3 = tm.get_task(classifier='slosh', change_classifier=False)
+		assert task3 is None or task3['priority'] not in (17, 26)
+
+		tm.cursor.execute("SELECT COUNT(*) FROM starclass_diagnostics WHERE classifier='slosh' AND status=?;", [STATUS.STARTED.value])
+		assert tm.cursor.fetchone()[0] == 2
+
+#--------------------------------------------------------------------------------------------------
+def test_taskmanager_star_tasks(PRIVATE_TODO_FILE):
+	"""Test of TaskManager getting all tasks for a star at once"""
+
+	with TaskManager(PRIVATE_TODO_FILE, overwrite=True, classes=StellarClassesLevel1) as tm:
+		# The first star should have tasks for all classifiers, with meta last:
+		tasks = tm.get_star_tasks()
+		print(tasks)
+		assert [task['priority'] for task in tasks] == [17]*len(starclass.classifier_list)
+		assert [task['classifier'] for task in tasks] == AVALIABLE_CLASSIFIERS + ['meta']
+		assert isinstance(tasks[-1]['other_classifiers'], Table)
+
+		# Start all but one of the tasks, in one go:
+		tm.start_task(tasks[1:])
+		tasks2 = tm.get_star_tasks()
+		assert len(tasks2) == 1
+		assert tasks2[0]['priority'] == 17
+		assert tasks2[0]['classifier'] == AVALIABLE_CLASSIFIERS[0]
+
+		# When all tasks of the star are started, we move on to the next star:
+		tm.start_task(tasks2)
+		tasks3 = tm.get_star_tasks()
+		assert [task['priority'] for task in tasks3] == [26]*len(starclass.classifier_list)
+
+		# Asking for specific star:
+		assert tm.get_star_tasks(priority=17) == []
+		assert tm.get_star_tasks(priority=-1234567890) == []
+
+		# Save results from several classifiers in one go:
+		results = []
+		for task in tasks3:
+			result = task.copy()
+			result['status'] = STATUS.OK
+			result['starclass_results'] = {StellarClassesLevel1.SOLARLIKE: 1.0}
+			results.append(result)
+		tm.save_results(results)
+
+		tm.cursor.execute("SELECT COUNT(*) FROM starclass_diagnostics WHERE priority=26 AND status=?;", [STATUS.OK.value])
+		assert tm.cursor.fetchone()[0] == len(tasks3)
+		tm.cursor.execute("SELECT COUNT(*) FROM starclass_results WHERE priority=26;")
+		assert tm.cursor.fetchone()[0] == len(tasks3)
+
+#--------------------------------------------------------------------------------------------------
+def test_taskmanager_async_save(PRIVATE_TODO_FILE):
+	"""Test of TaskManager writing results in a background thread"""
+
+	with TaskManager(PRIVATE_TODO_FILE, overwrite=True, classes=StellarClassesLevel1, async_save=True, save_batch_size=1000, save_interval=1000) as tm:
+		tasks = tm.get_tasks(classifier='slosh', change_classifier=False, max_tasks=2)
+		tm.start_task(tasks)
+
+		# Nothing has been written yet, but the tasks are not handed out again:
+		tm.cursor.execute("SELECT COUNT(*) FROM starclass_diagnostics;")
+		assert tm.cursor.fetchone()[0] == 0
+		task3 = tm.get_task(classifier='slosh', change_classifier=False)
+		assert task3['priority'] not in [task['priority'] for task in tasks]
+
+		results = []
+		for task in tasks:
+			result = task.copy()
+			result['status'] = STATUS.OK
+			result['starclass_results'] = {StellarClassesLevel1.SOLARLIKE: 1.0}
+			results.append(result)
+		tm.save_results(results)
+
+		# Buffered results are written before they are needed by the meta-classifier:
+		task_meta = tm.get_task(priority=tasks[0]['priority'], classifier='meta')
+		assert len(task_meta['other_classifiers']) == 1
+
+		# Write everything that is still buffered:
+		tm.flush()
+		tm.cursor.execute("SELECT COUNT(*) FROM starclass_diagnostics WHERE classifier='slosh' AND status=?;", [STATUS.OK.value])
+		assert tm.cursor.fetchone()[0] == 2
+
+		# Anything buffered when closing is also written:
+		tm.start_task(task3)
+
+	with TaskManager(PRIVATE_TODO_FILE, overwrite=False) as tm:
+		tm.cursor.execute("SELECT COUNT(*) FROM starclass_diagnostics WHERE priority=? AND classifier='slosh' AND status=?;", [task3['priority'], STATUS.STARTED.value])
+		assert tm.cursor.fetchone()[0] == 1
+
+#--------------------------------------------------------------------------------------------------
+def test_taskmanager_readonly(PRIVATE_TODO_FILE):
+	"""Test of TaskManager reading a TODO-file while results are written to it"""
+
+	with pytest.raises(ValueError):
+		TaskManager(PRIVATE_TODO_FILE, readonly=True, overwrite=True)
+
+	with TaskManager(PRIVATE_TODO_FILE, overwrite=True, classes=StellarClassesLevel1) as tm:
+		task = tm.get_task(classifier='slosh')
+		tm.start_task(task)
+		result = task.copy()
+		result['tset'] = 'keplerq9v3'
+		result['status'] = STATUS.OK
+		result['starclass_results'] = {StellarClassesLevel1.SOLARLIKE: 1.0}
+		result['features_common'] = {'freq1': 42.0}
+		tm.save_results(result)
+
+		# Read the TODO-file while it is still open for writing:
+		with TaskManager(PRIVATE_TODO_FILE, readonly=True, classes=StellarClassesLevel1) as tm_ro:
+			assert tm_ro.tset == 'keplerq9v3'
+			task_meta = tm_ro.get_task(priority=task['priority'], classifier='meta')
+			assert len(task_meta['other_classifiers']) == 1
+			assert tm_ro.moat_query('common', task['priority']) == {'freq1': 42.0}
+
+			# The task is already done, so the next task is another star:
+			assert tm_ro.get_task(classifier='slosh', change_classifier=False)['priority'] != task['priority']
+
+			# Nothing can be written:
+			with pytest.raises(ValueError):
+				tm_ro.start_task(task_meta)
+			with pytest.raises(ValueError):
+				tm_ro.save_results(result)
+
+			# Writing can continue while the TODO-file is being read:
+			tm.start_task(tm.get_task(classifier='slosh'))
+
 #--------------------------------------------------------------------------------------------------
 def test_taskmanager_save_and_settings(PRIVATE_TODO_FILE):
 	"""Test of TaskManager saving results and settings."""
@@ -284,6 +420,104 @@ def test_taskmanager_moat(PRIVATE_TODO_FILE, classifier):
 		assert tm.moat_query('common', task['priority']) is None
 		assert tm.moat_query(classifier, task['priority']) is None
 
+#--------------------------------------------------------------------------------------------------
+def test_taskmanager_moat_update(PRIVATE_TODO_FILE):
+	"""Test updating and adding features to the MOAT"""
+
+	with TaskManager(PRIVATE_TODO_FILE, overwrite=True, classes=StellarClassesLevel1) as tm:
+		task1, task2 = tm.get_tasks(classifier='slosh', change_classifier=False, max_tasks=2)
+		features_common = {'freq1': 42.0, 'amp1': 43.0, 'phase1': np.NaN}
+
+		def fake_result(task, classifier, features_common):
+			result = task.copy()
+			result['tset'] = 'keplerq9v3'
+			result['classifier'] = classifier
+			result['status'] = STATUS.OK
+			result['starclass_results'] = {}
+			result['features_common'] = features_common
+			return result
+
+		# Common features from several classifiers are written once:
+		tm.save_results([fake_result(task1, 'slosh', features_common), fake_result(task1, 'xgb', features_common)])
+		tm.cursor.execute("SELECT COUNT(*) FROM starclass_features_common;")
+		assert tm.cursor.fetchone()[0] == 1
+
+		# Saving the same common features again does not change the table,
+		# so only the diagnostics row is changed:
+		changes = tm.conn.total_changes
+		tm.save_results(fake_result(task1, 'rfgc', features_common))
+		assert tm.conn.total_changes - changes == 1
+
+		# New features are added as new columns, which are missing for the first star:
+		tm.save_results(fake_result(task2, 'slosh', dict(features_common, new_feature=3.0)))
+		assert tm.moat_query('common', task2['priority'])['new_feature'] == 3.0
+		features1 = tm.moat_query('common', task1['priority'])
+		assert 'new_feature' not in features1
+		assert features1['freq1'] == 42.0
+		assert np.isnan(features1['phase1'])
+
+		# Missing features are not stored in the feature columns, which only contain
+		# numbers, or NULL for features calculated as NaN:
+		tm.cursor.execute("SELECT DISTINCT typeof(new_feature), typeof(phase1) FROM starclass_features_common;")
+		assert set(tuple(row) for row in tm.cursor.fetchall()) == {('null', 'null'), ('real', 'null')}
+		tm.cursor.execute("SELECT priority,feature FROM starclass_moat_missing WHERE classifier='common';")
+		assert [tuple(row) for row in tm.cursor.fetchall()] == [(task1['priority'], 'new_feature')]
+
+		# Saving only some of the features keeps the rest of the stored features:
+		tm.save_results(fake_result(task2, 'xgb', {'freq1': 1.0}))
+		features2 = tm.moat_query('common', task2['priority'])
+		assert features2['freq1'] == 1.0
+		assert features2['amp1'] == 43.0
+		assert np.isnan(features2['phase1'])
+		assert features2['new_feature'] == 3.0
+
+	with TaskManager(PRIVATE_TODO_FILE, overwrite=True, classes=StellarClassesLevel1) as tm:
+		assert 'new_feature' not in tm.moat_query('common', task1['priority'])
+		assert tm.moat_query('common', task2['priority'])['new_feature'] == 3.0
+
+#--------------------------------------------------------------------------------------------------
+def test_taskmanager_moat_features(PRIVATE_TODO_FILE):
+	"""Test loading matrix of features from the MOAT"""
+
+	with TaskManager(PRIVATE_TODO_FILE, overwrite=True, classes=StellarClassesLevel1) as tm:
+		tasks = tm.get_tasks(classifier='xgb', change_classifier=False, max_tasks=3)
+		results = []
+		for task in tasks:
+			result = task.copy()
+			result['tset'] = 'keplerq9v3'
+			result['status'] = STATUS.OK
+			result['starclass_results'] = {}
+			result['features_common'] = {'freq1': float(task['priority'])}
+			result['features'] = {'special_feature': 2.0*task['priority']}
+			results.append(result)
+		# A feature which was calculated as NaN:
+		results[1]['features']['special_feature'] = np.NaN
+		tm.save_results(results)
+
+		# Rows are in the order of the requested priorities,
+		# and features which are not available are NaN:
+		priorities = [tasks[2]['priority'], tasks[0]['priority'], -1]
+		prio, featout, available = tm.moat_features('xgb', ['special_feature', 'freq1', 'nonexistent'], priorities=priorities)
+		assert featout.dtype == 'float32'
+		np.testing.assert_array_equal(prio, priorities)
+		np.testing.assert_array_equal(featout[0:2, 0], [2.0*tasks[2]['priority'], 2.0*tasks[0]['priority']])
+		np.testing.assert_array_equal(featout[0:2, 1], [tasks[2]['priority'], tasks[0]['priority']])
+		assert np.all(np.isnan(featout[:, 2]))
+		assert np.all(np.isnan(featout[2, :]))
+		assert available.dtype == 'bool'
+		np.testing.assert_array_equal(available, [[True, True, False], [True, True, False], [False, False, False]])
+
+		# A stored NaN is available, unlike a feature which was never stored:
+		prio, featout, available = tm.moat_features('xgb', ['special_feature', 'nonexistent'], priorities=[tasks[1]['priority']])
+		assert np.all(np.isnan(featout))
+		np.testing.assert_array_equal(available, [[True, False]])
+
+		# Without priorities, all stars are returned:
+		prio, featout, available = tm.moat_features('xgb', ['freq1'])
+		assert np.all(np.diff(prio) > 0)
+		assert np.sum(np.isfinite(featout)) == 3
+		assert np.sum(available) == 3
+
 #--------------------------------------------------------------------------------------------------
 def test_taskmanager_moat_create_wrong(PRIVATE_TODO_FILE):
 	"""Test moat-create with wrong input"""
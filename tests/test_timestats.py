@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of time-domain statistics of lightcurves.
+
+.. codeauthor:: Rasmus Handberg <rasmush@phys.au.dk>
+"""
+
+import pytest
+import numpy as np
+import scipy.stats as ss
+import lightkurve as lk
+import conftest # noqa: F401
+from starclass.features.timestats import (timeseries_statistics, lightcurve_statistics,
+	higher_order_crossings, statistics_keys, hoc_sigmoid_coeffs, hoc_zc_gauss)
+
+#--------------------------------------------------------------------------------------------------
+def _hocs_loop(x, y, k):
+	# Simple reference implementation of the higher order crossings:
+	y = y - np.median(y)
+	fill = len(x) / ((x[-1] - x[0]) / np.median(np.diff(x)))
+	sig = lambda t: ((1 / (1 + np.exp(-t*fill))) - 0.5) / ((1 / (1 + np.exp(-t))) - 0.5)
+	zc = np.zeros(k)
+	for i in range(k):
+		window = np.where(np.diff(y, i) >= 0, 1, 0)
+		zc[i] = np.sum(np.diff(window)**2) / (len(y) - i) / sig(hoc_sigmoid_coeffs[i])
+	delta_k = np.append(zc[0], np.diff(zc))
+	delta_k_gauss = np.append(hoc_zc_gauss[0], np.diff(hoc_zc_gauss[:k]))
+	return np.sum((delta_k - delta_k_gauss)**2 / delta_k_gauss), zc
+
+#--------------------------------------------------------------------------------------------------
+@pytest.fixture
+def lightcurve():
+	np.random.seed(42)
+	time = np.arange(0, 27, 1800/86400)
+	time = time[(time < 13) | (time > 14)]
+	flux = 1 + 1e-3*np.sin(2*np.pi*time/1.7) + 2e-4*np.random.standard_t(5, size=len(time))
+	flux_err = 2e-4*np.random.uniform(0.8, 1.2, size=len(time))
+	return time, flux, flux_err
+
+#--------------------------------------------------------------------------------------------------
+def test_timeseries_statistics(lightcurve):
+
+	time, flux, flux_err = lightcurve
+	stats = timeseries_statistics(time, flux, flux_err)
+	assert set(stats.keys()) == set(statistics_keys)
+
+	np.testing.assert_allclose(stats['skewness'], ss.skew(flux), rtol=1e-10)
+	np.testing.assert_allclose(stats['kurtosis'], ss.kurtosis(flux), rtol=1e-10)
+	assert stats['shapiro_wilk'] == ss.shapiro(flux)[0]
+
+	# Eta with weighted standard deviation:
+	weight = 1/flux_err
+	mean = np.sum(flux*weight) / np.sum(weight)
+	std2 = np.sum((flux - mean)**2 * weight) / np.sum(weight)
+	np.testing.assert_allclose(stats['eta'], np.sum(np.diff(flux)**2) / (len(flux) - 1) / std2, rtol=1e-10)
+
+	s = np.cumsum(flux - np.mean(flux)) / (len(flux) * np.std(flux))
+	np.testing.assert_allclose(stats['Rcs'], np.ptp(s), rtol=1e-10)
+
+	p2p = np.abs(np.diff(flux))
+	np.testing.assert_allclose(stats['p2p_98_lc'], np.percentile(p2p, 98), rtol=1e-10)
+	np.testing.assert_allclose(stats['p2p_mean_lc'], np.mean(p2p), rtol=1e-10)
+
+	psi, zc = _hocs_loop(time, flux, 5)
+	np.testing.assert_allclose(stats['psi'], psi, rtol=1e-10)
+	np.testing.assert_allclose(stats['zc'], zc[0], rtol=1e-10)
+
+	lower = flux < np.mean(flux)
+	ratio = np.mean((flux[lower] - np.mean(flux))**2) / np.mean((flux[~lower] - np.mean(flux))**2)
+	np.testing.assert_allclose(stats['flux_ratio'], np.log(np.sqrt(ratio)), rtol=1e-10)
+
+	# Without uncertainties eta can not be calculated:
+	assert np.isnan(timeseries_statistics(time, flux)['eta'])
+
+	# Constant lightcurve:
+	stats = timeseries_statistics(time, np.ones_like(flux), flux_err)
+	assert stats['skewness'] == 0
+	assert stats['kurtosis'] == -3
+
+#--------------------------------------------------------------------------------------------------
+def test_timeseries_statistics_shapiro_subsample(lightcurve):
+
+	time, flux, flux_err = lightcurve
+	assert len(flux) > 1000
+
+	stats = timeseries_statistics(time, flux, flux_err, shapiro_max_points=1000)
+	stats2 = timeseries_statistics(time, flux, flux_err, shapiro_max_points=1000)
+	assert stats['shapiro_wilk'] == stats2['shapiro_wilk']
+	np.testing.assert_allclose(stats['shapiro_wilk'], ss.shapiro(flux)[0], atol=0.01)
+
+	# Other statistics are not affected:
+	stats_full = timeseries_statistics(time, flux, flux_err)
+	for key in statistics_keys:
+		if key != 'shapiro_wilk':
+			assert stats[key] == stats_full[key]
+
+#--------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('k', [1, 3, 5, 6])
+def test_higher_order_crossings(lightcurve, k):
+	time, flux, _ = lightcurve
+	psi, zc = higher_order_crossings(time, flux, k)
+	psi_ref, zc_ref = _hocs_loop(time, flux, k)
+	assert zc.shape == (k,)
+	np.testing.assert_allclose(zc, zc_ref, rtol=1e-12)
+	np.testing.assert_allclose(psi, psi_ref, rtol=1e-12)
+
+#--------------------------------------------------------------------------------------------------
+def test_lightcurve_statistics(lightcurve):
+
+	time, flux, flux_err = lightcurve
+	lc = lk.LightCurve(time=time, flux=flux, flux_err=flux_err)
+	stats = lightcurve_statistics(lc)
+	assert stats == timeseries_statistics(time, flux, flux_err)
+
+	# Statistics already available in the features are used directly:
+	features = {key: 1.0 for key in statistics_keys}
+	assert lightcurve_statistics(lc, features) is features
+
+	# Unless some of them are missing:
+	del features['psi']
+	assert lightcurve_statistics(lc, features) == stats
+
+#--------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+	pytest.main([__file__])
@@ -9,7 +9,8 @@ import numpy as np
 import warnings
 from lightkurve import LightCurve, LightkurveWarning
 import conftest # noqa: F401
-from starclass.utilities import rms_timescale, ptp
+from starclass.utilities import rms_timescale, ptp, get_periods, mad_to_sigma
+from starclass.features.freqextr import freqtable
 
 #--------------------------------------------------------------------------------------------------
 def test_rms_timescale():
@@ -56,6 +57,27 @@ def test_rms_timescale():
 	print(rms)
 	np.testing.assert_allclose(rms, 0)
 
+	# Several timescales at once should give the same as one at a time:
+	time = np.arange(0, 27, 120/86400)
+	flux = np.random.randn(len(time)) + np.sin(time)
+	flux[::17] = np.nan
+	lc = LightCurve(time=time, flux=flux)
+	timescales = [1800/86400, 3600/86400, 6*3600/86400, 1.0]
+	rms = rms_timescale(lc, timescale=timescales)
+	print(rms)
+	assert rms.shape == (4,)
+	for k, timescale in enumerate(timescales):
+		np.testing.assert_allclose(rms[k], rms_timescale(lc, timescale=timescale))
+	np.testing.assert_allclose(rms[1], rms_timescale(lc))
+
+	# Compare to manually binning to one day:
+	flux_bin = np.array([np.nanmean(flux[(time >= d) & (time < d+1)]) for d in range(27)])
+	np.testing.assert_allclose(rms[3], mad_to_sigma * np.median(np.abs(flux_bin - np.median(flux_bin))))
+
+	rms = rms_timescale(LightCurve(time=time, flux=flux*np.nan), timescale=timescales)
+	assert rms.shape == (4,)
+	assert np.all(np.isnan(rms)), "Should return nan on pure nan input"
+
 #--------------------------------------------------------------------------------------------------
 def test_ptp():
 
@@ -87,6 +109,32 @@ def test_ptp():
 	print(p)
 	np.testing.assert_allclose(p, 0)
 
+#--------------------------------------------------------------------------------------------------
+def test_get_periods():
+
+	ft = freqtable(3, 1)
+	ft.data['frequency'] = [[10, 20], [5, np.NaN], [np.NaN, np.NaN]]
+	ft.data['amplitude'] = [[4, 5], [3, np.NaN], [np.NaN, np.NaN]]
+	time = np.linspace(0, 100/86400e-6, 1000) # Duration of 100 microHz^-1
+
+	periods, n_usedfreqs, usedfreqs = get_periods({'frequencies': ft}, 3, time, in_days=False)
+	assert n_usedfreqs == 2
+	np.testing.assert_allclose(periods, [10, 5, 0.01])
+	np.testing.assert_array_equal(usedfreqs['num'], [1, 2])
+	np.testing.assert_array_equal(usedfreqs['harmonic'], [0, 0])
+
+	# Sorted by amplitude including the harmonics:
+	periods, n_usedfreqs, usedfreqs = get_periods({'frequencies': ft}, 2, time, ignore_harmonics=True)
+	assert n_usedfreqs == 2
+	np.testing.assert_allclose(periods, 1/(86400e-6*np.array([20, 10])))
+	np.testing.assert_array_equal(usedfreqs['num'], [1, 1])
+	np.testing.assert_array_equal(usedfreqs['harmonic'], [1, 0])
+
+	# Astropy tables should give the same result:
+	periods2, n_usedfreqs2, usedfreqs2 = get_periods({'frequencies': ft.to_table()}, 2, time, ignore_harmonics=True)
+	np.testing.assert_allclose(periods2, periods)
+	assert n_usedfreqs2 == n_usedfreqs
+
 #--------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
 	pytest.main([__file__])